@@ -0,0 +1,82 @@
+"""
+    DEEP-mon
+    Copyright (C) 2020  Brondolin Rolando
+
+    This file is part of DEEP-mon
+
+    DEEP-mon is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DEEP-mon is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Context switch microbenchmark: pairs of processes bounce one byte over two
+# pipes, so every round trip costs two context switches. Run it on an idle
+# host without DEEP-mon, then with DEEP-mon running with percpu_maps set to
+# False and to True. The difference of the ns/switch values is the overhead
+# added by trace_switch.
+
+import argparse
+import multiprocessing
+import os
+import time
+
+
+def ping_pong(iterations, cpu_a, cpu_b, results):
+    parent_read, child_write = os.pipe()
+    child_read, parent_write = os.pipe()
+
+    pid = os.fork()
+    if pid == 0:
+        os.sched_setaffinity(0, {cpu_b})
+        for i in range(iterations):
+            os.read(child_read, 1)
+            os.write(child_write, b"x")
+        os._exit(0)
+
+    os.sched_setaffinity(0, {cpu_a})
+    start = time.perf_counter_ns()
+    for i in range(iterations):
+        os.write(parent_write, b"x")
+        os.read(parent_read, 1)
+    elapsed = time.perf_counter_ns() - start
+    os.waitpid(pid, 0)
+    results.put(elapsed / (iterations * 2.0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cost of a context switch")
+    parser.add_argument("--iterations", type=int, default=200000)
+    parser.add_argument("--pairs", type=int, default=multiprocessing.cpu_count() // 2)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    cpus = sorted(os.sched_getaffinity(0))
+    pairs = max(1, min(args.pairs, len(cpus) // 2))
+
+    for run in range(args.runs):
+        results = multiprocessing.Queue()
+        workers = []
+        for pair in range(pairs):
+            cpu_a = cpus[(2 * pair) % len(cpus)]
+            cpu_b = cpus[(2 * pair + 1) % len(cpus)]
+            worker = multiprocessing.Process(target=ping_pong,
+                args=(args.iterations, cpu_a, cpu_b, results))
+            worker.start()
+            workers.append(worker)
+        for worker in workers:
+            worker.join()
+        values = [results.get() for worker in workers]
+        print("run %d: %.1f ns/switch (%d pairs)" % (run, sum(values) / len(values), pairs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+    DEEP-mon
+    Copyright (C) 2020  Brondolin Rolando
+
+    This file is part of DEEP-mon
+
+    DEEP-mon is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DEEP-mon is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# VFS microbenchmark: each worker writes and reads back small blocks of a
+# file that stays in the page cache, so the cost is dominated by the
+# read/write syscalls. Run it on an idle host without DEEP-mon, then with
+# DEEP-mon running with vfs_probe_mode set to "kprobe" and to "fexit".
+# The difference of the ns/syscall values is the overhead of the probes.
+
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+
+def read_write(iterations, block_size, directory, results):
+    fd, path = tempfile.mkstemp(dir=directory)
+    block = b"x" * block_size
+    try:
+        start = time.perf_counter_ns()
+        for i in range(iterations):
+            os.pwrite(fd, block, 0)
+            os.pread(fd, block_size, 0)
+        elapsed = time.perf_counter_ns() - start
+    finally:
+        os.close(fd)
+        os.unlink(path)
+    results.put(elapsed / (iterations * 2.0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cost of a read/write syscall")
+    parser.add_argument("--iterations", type=int, default=500000)
+    parser.add_argument("--block-size", type=int, default=4096)
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--dir", default=None, help="directory of the test files, on a disk backed filesystem")
+    args = parser.parse_args()
+
+    for run in range(args.runs):
+        results = multiprocessing.Queue()
+        workers = []
+        for worker_index in range(args.workers):
+            worker = multiprocessing.Process(target=read_write,
+                args=(args.iterations, args.block_size, args.dir, results))
+            worker.start()
+            workers.append(worker)
+        for worker in workers:
+            worker.join()
+        values = [results.get() for worker in workers]
+        print("run %d: %.1f ns/syscall (%d workers)" % (run, sum(values) / len(values), args.workers))
+
+
+if __name__ == '__main__':
+    main()
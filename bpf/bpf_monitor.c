@@ -128,9 +128,48 @@ BPF_PERF_ARRAY(cache_misses, NUM_CPUS);
 BPF_PERF_ARRAY(cache_refs, NUM_CPUS);
 #endif
 BPF_HASH(processors, u64, struct proc_topology);
+
+/**
+ * With PERCPU_MAPS each cpu keeps its own copy of the pid_status of the
+ * threads it runs, to avoid cache line bouncing among cpus on the scheduler
+ * hot path. Userspace merges the copies at sample time.
+ * idles does not need it, since each cpu only updates its own key.
+ */
+#ifdef PERCPU_MAPS
+BPF_PERCPU_HASH(pids, int, struct pid_status);
+#else
 BPF_HASH(pids, int, struct pid_status);
+#endif
 BPF_HASH(idles, u64, struct pid_status);
 
+/**
+ * exited_pids keeps the final counters of the threads that exited, after
+ * their entry has been removed from pids. Userspace drains it at each sample.
+ * Entries are keyed by pid and window selector, so that the exits of the
+ * window userspace is about to read are not overwritten by the exits of the
+ * new window
+ */
+struct exited_key_t {
+        int pid;
+        unsigned int bpf_selector;
+};
+
+BPF_HASH(exited_pids, struct exited_key_t, struct pid_status);
+
+/**
+ * With CGROUP_AGGREGATION the counters of each thread are also summed up
+ * per cgroup (cgroup v2 id of the thread), so that userspace can read one
+ * entry per container instead of one per thread. Each cpu keeps its own
+ * copy of the entry, so that the reset of the counters at the start of a
+ * window does not race with the updates of the other cpus. Userspace sums
+ * up the copies of the window it reads, like the pids with PERCPU_MAPS.
+ * cgroup_init is never written, it is the zeroed template of new entries.
+ */
+#ifdef CGROUP_AGGREGATION
+BPF_PERCPU_HASH(cgroups, u64, struct pid_status);
+BPF_PERCPU_ARRAY(cgroup_init, struct pid_status, 1);
+#endif
+
 /**
  * conf struct has 4 integer keys initialized in user space
  * 0: current bpf selector
@@ -147,7 +186,21 @@ BPF_ARRAY(conf, u32, 4);
 /*
  * timestamp array to store the last timestamp of a given time slot
  */
+#ifdef PERCPU_MAPS
+BPF_PERCPU_ARRAY(global_timestamps, u64, SELECTOR_DIM);
+
+/*
+ * per cpu context switch count, tagged with the selector of the window
+ * it refers to. Userspace sums the counts of the current window.
+ */
+struct switch_count_t {
+        u32 bpf_selector;
+        u32 count;
+};
+BPF_PERCPU_ARRAY(switch_counts, struct switch_count_t, 1);
+#else
 BPF_ARRAY(global_timestamps, u64, SELECTOR_DIM);
+#endif
 
 
 /**
@@ -190,6 +243,81 @@ static void send_perf_error(struct bpf_perf_event_data *ctx, int err_code) {
 #endif
 }
 
+#ifdef CGROUP_AGGREGATION
+/**
+ * Add the counters accounted to the current thread to the copy of the entry
+ * of its cgroup of this cpu. Only this cpu writes the copy, so the counters
+ * are updated without atomic adds
+ */
+static inline void update_cgroup_count(u32 bpf_selector, u32 step,
+        u64 socket_id, u64 ts, u64 time_ns, u64 cycles,
+        u64 instruction_retired, u64 cache_misses, u64 cache_refs,
+        u64 weighted_cycles) {
+
+    u64 cgroup_id = bpf_get_current_cgroup_id();
+    struct pid_status *status = cgroups.lookup(&cgroup_id);
+    if (status == NULL) {
+            int zero = 0;
+            struct pid_status *empty = cgroup_init.lookup(&zero);
+            if (empty == NULL) {
+                    return;
+            }
+            cgroups.insert(&cgroup_id, empty);
+            status = cgroups.lookup(&cgroup_id);
+            if (status == NULL) {
+                    return;
+            }
+    }
+
+    u64 last_ts = 0;
+    #pragma clang loop unroll(full)
+    for(int array_index = 0; array_index<SELECTOR_DIM; array_index++) {
+            if(array_index == status->bpf_selector) {
+                    last_ts = status->ts[array_index];
+            }
+    }
+
+    // same window logic of the pids, see update_cycles_count
+    if(status->bpf_selector != bpf_selector || last_ts + step < ts) {
+            status->bpf_selector = bpf_selector;
+            #pragma clang loop unroll(full)
+            for(int array_index = 0; array_index<NUM_SLOTS; array_index++) {
+                    if(array_index % SELECTOR_DIM == bpf_selector) {
+                            status->weighted_cycles[array_index] = 0;
+                    }
+            }
+            #pragma clang loop unroll(full)
+            for(int array_index = 0; array_index < SELECTOR_DIM; array_index++) {
+                    if(array_index == bpf_selector) {
+                            status->cycles[array_index] = 0;
+                            status->instruction_retired[array_index] = 0;
+                            status->cache_misses[array_index] = 0;
+                            status->cache_refs[array_index] = 0;
+                            status->time_ns[array_index] = 0;
+                    }
+            }
+    }
+
+    #pragma clang loop unroll(full)
+    for(int array_index = 0; array_index < SELECTOR_DIM; array_index++) {
+            if(array_index == bpf_selector) {
+                    status->cycles[array_index] += cycles;
+                    status->instruction_retired[array_index] += instruction_retired;
+                    status->cache_misses[array_index] += cache_misses;
+                    status->cache_refs[array_index] += cache_refs;
+                    status->time_ns[array_index] += time_ns;
+                    status->ts[array_index] = ts;
+            }
+    }
+    #pragma clang loop unroll(full)
+    for(int array_index = 0; array_index<NUM_SLOTS; array_index++) {
+            if(array_index == bpf_selector + SELECTOR_DIM * socket_id) {
+                    status->weighted_cycles[array_index] += weighted_cycles;
+            }
+    }
+}
+#endif
+
 static inline int update_cycles_count(void *ctx,
         int old_pid, u32 bpf_selector, u32 step, u64 processor_id,
 #ifdef PERFORMANCE_COUNTERS
@@ -324,6 +452,14 @@ static inline int update_cycles_count(void *ctx,
     //         }
     // }
 
+    // counters added to the pid in this call, summed up per cgroup as well
+    u64 delta_time_ns = 0;
+    u64 delta_cycles = 0;
+    u64 delta_instruction_retired = 0;
+    u64 delta_cache_misses = 0;
+    u64 delta_cache_refs = 0;
+    u64 delta_weighted_cycles = 0;
+
     if (topology_info.ts > 0) {
             // update per process measurements (aka IR, cache misses, cycles not weighted)
             #pragma clang loop unroll(full)
@@ -331,27 +467,32 @@ static inline int update_cycles_count(void *ctx,
                     if(array_index == status_old.bpf_selector){
 #ifdef PERFORMANCE_COUNTERS
                             if (instruction_retired_thread >= topology_info.instruction_thread) {
-                                    status_old.instruction_retired[array_index] += instruction_retired_thread - topology_info.instruction_thread;
+                                    delta_instruction_retired = instruction_retired_thread - topology_info.instruction_thread;
+                                    status_old.instruction_retired[array_index] += delta_instruction_retired;
                             } else {
                                     send_error(ctx, old_pid);
                             }
                             if (cache_misses_thread >= topology_info.cache_misses) {
-                                    status_old.cache_misses[array_index] += cache_misses_thread - topology_info.cache_misses;
+                                    delta_cache_misses = cache_misses_thread - topology_info.cache_misses;
+                                    status_old.cache_misses[array_index] += delta_cache_misses;
                             } else {
                                     send_error(ctx, old_pid);
                             }
                             if (cache_refs_thread >= topology_info.cache_refs) {
-                                    status_old.cache_refs[array_index] += cache_refs_thread - topology_info.cache_refs;
+                                    delta_cache_refs = cache_refs_thread - topology_info.cache_refs;
+                                    status_old.cache_refs[array_index] += delta_cache_refs;
                             } else {
                                     send_error(ctx, old_pid);
                             }
                             if (thread_cycles_sample >= topology_info.cycles_thread){
-                                    status_old.cycles[array_index] += thread_cycles_sample - topology_info.cycles_thread;
+                                    delta_cycles = thread_cycles_sample - topology_info.cycles_thread;
+                                    status_old.cycles[array_index] += delta_cycles;
                             } else {
                                     send_error(ctx, old_pid);
                             }
 #endif
-                            status_old.time_ns[array_index] += ts - topology_info.ts;
+                            delta_time_ns = ts - topology_info.ts;
+                            status_old.time_ns[array_index] += delta_time_ns;
                             status_old.ts[array_index] = ts;
                     }
             }
@@ -369,7 +510,8 @@ static inline int update_cycles_count(void *ctx,
                                     u64 cycle1 = thread_cycles_sample - topology_info.cycles_thread;
                                     u64 cycle_overlap = topology_info.cycles_core_delta_sibling;
                                     u64 cycle_non_overlap = cycle1 > topology_info.cycles_core_delta_sibling ? cycle1 - topology_info.cycles_core_delta_sibling : 0;
-                                    status_old.weighted_cycles[array_index] += cycle_non_overlap + cycle_overlap*HAPPY_FACTOR;
+                                    delta_weighted_cycles = cycle_non_overlap + cycle_overlap*HAPPY_FACTOR;
+                                    status_old.weighted_cycles[array_index] += delta_weighted_cycles;
                             } else {
                                     send_error(ctx, old_pid);
                             }
@@ -384,6 +526,13 @@ static inline int update_cycles_count(void *ctx,
     } else {
             status_old.tgid = bpf_get_current_pid_tgid() >> 32;
             pids.update(&old_pid, &status_old);
+#ifdef CGROUP_AGGREGATION
+            if (topology_info.ts > 0) {
+                    update_cgroup_count(bpf_selector, step, topology_info.processor_id,
+                            ts, delta_time_ns, delta_cycles, delta_instruction_retired,
+                            delta_cache_misses, delta_cache_refs, delta_weighted_cycles);
+            }
+#endif
     }
 
     return 0;
@@ -410,6 +559,19 @@ int trace_switch(struct sched_switch_args *ctx) {
                 return 0;
         }
 
+#ifdef PERCPU_MAPS
+        // Update the switch count of this cpu, reset it when the window changes
+        int switch_count_index = 0;
+        struct switch_count_t *cpu_switch_count = switch_counts.lookup(&switch_count_index);
+        if (cpu_switch_count != NULL) {
+                if (cpu_switch_count->bpf_selector != bpf_selector) {
+                        cpu_switch_count->bpf_selector = bpf_selector;
+                        cpu_switch_count->count = 1;
+                } else {
+                        cpu_switch_count->count++;
+                }
+        }
+#else
         // Retrieve general switch count
         unsigned int switch_count = 0;
         ret = 0;
@@ -433,6 +595,7 @@ int trace_switch(struct sched_switch_args *ctx) {
                 switch_count++;
         }
         conf.update(&switch_count_key, &switch_count);
+#endif
 
         /**
          * Retrieve sampling step (dynamic window)
@@ -493,6 +656,12 @@ int trace_switch(struct sched_switch_args *ctx) {
                 ret = bpf_probe_read(&status_new, sizeof(status_new), idles.lookup(&(processor_id)));
         } else {
                 ret = bpf_probe_read(&status_new, sizeof(status_new), pids.lookup(&(new_pid)));
+#ifdef PERCPU_MAPS
+                // the copy of a cpu where the thread never ran is zeroed
+                if(ret == 0 && status_new.pid != new_pid) {
+                        ret = -1;
+                }
+#endif
         }
         //If no status for PID, then create one, otherwise update selector
         if(ret) {
@@ -518,7 +687,12 @@ int trace_switch(struct sched_switch_args *ctx) {
                 if(new_pid == 0) {
                         idles.insert(&processor_id, &status_new);
                 } else {
+#ifdef PERCPU_MAPS
+                        // the key might exist already for the other cpus
+                        pids.update(&new_pid, &status_new);
+#else
                         pids.insert(&new_pid, &status_new);
+#endif
                 }
         }
         //add info on new running pid into processors table
@@ -540,119 +714,116 @@ int trace_switch(struct sched_switch_args *ctx) {
 
 }
 
+/**
+ * Move the final counters of an exiting thread to exited_pids. A pid reused
+ * within the window already has an exited entry for the window: the counters
+ * are added to it, so that none of the exited threads is lost. An entry of
+ * an older window is replaced
+ */
+static inline void add_exited_pid(int pid, struct pid_status *status, u32 step) {
+        struct exited_key_t key = {};
+        key.pid = pid;
+        key.bpf_selector = status->bpf_selector;
+        struct pid_status *exited = exited_pids.lookup(&key);
+        if (exited == NULL) {
+                exited_pids.update(&key, status);
+                return;
+        }
+
+        u64 exited_ts = 0;
+        u64 status_ts = 0;
+        #pragma clang loop unroll(full)
+        for(int array_index = 0; array_index < SELECTOR_DIM; array_index++) {
+                if(array_index == status->bpf_selector) {
+                        exited_ts = exited->ts[array_index];
+                        status_ts = status->ts[array_index];
+                }
+        }
+        // same window logic of the pids, see update_cycles_count
+        if (exited_ts + step < status_ts) {
+                exited_pids.update(&key, status);
+                return;
+        }
+
+        #pragma clang loop unroll(full)
+        for(int array_index = 0; array_index < NUM_SLOTS; array_index++) {
+                if(array_index % SELECTOR_DIM == status->bpf_selector) {
+                        exited->weighted_cycles[array_index] += status->weighted_cycles[array_index];
+                }
+        }
+        #pragma clang loop unroll(full)
+        for(int array_index = 0; array_index < SELECTOR_DIM; array_index++) {
+                if(array_index == status->bpf_selector) {
+                        exited->cycles[array_index] += status->cycles[array_index];
+                        exited->instruction_retired[array_index] += status->instruction_retired[array_index];
+                        exited->cache_misses[array_index] += status->cache_misses[array_index];
+                        exited->cache_refs[array_index] += status->cache_refs[array_index];
+                        exited->time_ns[array_index] += status->time_ns[array_index];
+                        if (exited->ts[array_index] < status->ts[array_index]) {
+                                exited->ts[array_index] = status->ts[array_index];
+                        }
+                }
+        }
+        // the entry is reported with the identity of the last thread
+        exited->tgid = status->tgid;
+        __builtin_memcpy(exited->comm, status->comm, sizeof(exited->comm));
+}
+
 int trace_exit(struct sched_process_exit_args *ctx) {
 
-        // // Keys for the conf hash
-        // int selector_key = BPF_SELECTOR_INDEX;
-        // int old_selector_key = BPF_SELECTOR_INDEX_OLD;
-        // int step_key = BPF_TIMESLICE;
-        // int switch_count_key = BPF_SWITCH_COUNT;
-        //
-        //
-        // // Binary selector to avoid event overwriting
-        // unsigned int bpf_selector = 0;
-        // int ret = 0;
-        // ret = bpf_probe_read(&bpf_selector, sizeof(bpf_selector), conf.lookup(&selector_key));
-        // // If selector is not in place correctly, signal debug error and stop tracing routine
-        // if (ret!= 0 || bpf_selector > 1) {
-        //         //send_error(ctx, BPF_SELECTOR_NOT_IN_PLACE);
-        //         return 0;
-        // }
-        //
-        // unsigned int step = 1000000000;
-        // ret = bpf_probe_read(&step, sizeof(step), conf.lookup(&step_key));
-        // if (ret!= 0 || step < STEP_MIN || step > STEP_MAX) {
-        //         //send_error(ctx, TIMESTEP_NOT_IN_PLACE);
-        //         return 0;
-        // }
+        // Keys for the conf hash
+        int selector_key = BPF_SELECTOR_INDEX;
+        int step_key = BPF_TIMESLICE;
 
-        char comm[16];
-        bpf_probe_read(&(comm), sizeof(comm), ctx->comm);
         int pid = ctx->pid;
         u64 ts = bpf_ktime_get_ns();
         u64 processor_id = bpf_get_smp_processor_id();
 
-        //
-        // // if (ret==0) {
-        // //         u64 thread_cycles_sample = cycles_thread.perf_read(processor_id);
-        // //         u64 core_cycles_sample = cycles_core.perf_read(processor_id);
-        // //         u64 instruction_retired_thread = instr_thread.perf_read(processor_id);
-        // //         update_cycles_count(ctx, pid, bpf_selector, step, processor_id, thread_cycles_sample, core_cycles_sample, instruction_retired_thread, ts);
-        // // }
-        //
-        // //account data to the father
-        // u64 tgid_pid = bpf_get_current_pid_tgid();
-        // int tgid = tgid_pid >> 32;
-        //
-        // struct pid_status tg_status;
-        // if(tgid == 0) {
-        //         ret = bpf_probe_read(&tg_status, sizeof(tg_status), idles.lookup(&(processor_id)));
-        // } else {
-        //         ret = bpf_probe_read(&tg_status, sizeof(tg_status), pids.lookup(&(tgid)));
-        // }
-        //
-        // if(ret == 0) {
-        //
-        //         //retrieve data about the exiting pid
-        //         struct pid_status status_old;
-        //         status_old.pid = -1;
-        //
-        //         /**
-        //          * Fetch the status of the exiting pid.
-        //          * If the pid is 0 then use the idles perf_hash
-        //          */
-        //         if(pid == 0) {
-        //                 ret = bpf_probe_read(&status_old, sizeof(status_old), idles.lookup(&(processor_id)));
-        //         } else {
-        //                 ret = bpf_probe_read(&status_old, sizeof(status_old), pids.lookup(&(pid)));
-        //         }
-        //
-        //         if(ret == 0) {
-        //
-        //                 // do the summation for all the sockets when the data
-        //                 // for a given socket are updated
-        //
-        //                 #pragma clang loop unroll(full)
-        //                 for(int array_index = 0; array_index<NUM_SLOTS; array_index++) {
-        //                         if(array_index % SELECTOR_DIM == bpf_selector) {
-        //                                 u64 last_ts_pid_in = status_old.ts[array_index];
-        //                                 u64 last_ts_tgid_in = tg_status.ts[array_index];
-        //
-        //                                 if(last_ts_tgid_in + step > ts) {
-        //                                         if(last_ts_pid_in + step > ts){
-        //                                                 tg_status.ts[array_index] = ts;
-        //                                                 tg_status.cycles[array_index] += status_old.cycles[array_index];
-        //                                                 tg_status.weighted_cycles[array_index] += status_old.weighted_cycles[array_index];
-        //                                                 tg_status.instruction_retired[array_index] += status_old.instruction_retired[array_index];
-        //                                                 tg_status.time_ns[array_index] += status_old.time_ns[array_index];
-        //                                                 tg_status.bpf_selector = bpf_selector;
-        //                                         }
-        //                                 } else {
-        //                                         if(last_ts_pid_in + step > ts){
-        //                                                 tg_status.ts[array_index] = ts;
-        //                                                 tg_status.cycles[array_index] = status_old.cycles[array_index];
-        //                                                 tg_status.weighted_cycles[array_index] = status_old.weighted_cycles[array_index];
-        //                                                 tg_status.instruction_retired[array_index] = status_old.instruction_retired[array_index];
-        //                                                 tg_status.time_ns[array_index] = status_old.time_ns[array_index];
-        //                                                 tg_status.bpf_selector = bpf_selector;
-        //                                         }
-        //                                 }
-        //                         }
-        //                 }
-        //
-        //                 if(tgid == 0) {
-        //                         idles.update(&processor_id, &tg_status);
-        //                 } else {
-        //                         pids.update(&tgid, &tg_status);
-        //                 }
-        //         }
-        // }
+        // Binary selector to avoid event overwriting
+        unsigned int bpf_selector = 0;
+        unsigned int step = 1000000000;
+        int ret = 0;
+        ret = bpf_probe_read(&bpf_selector, sizeof(bpf_selector), conf.lookup(&selector_key));
+        if (ret == 0 && bpf_selector <= 1) {
+                ret = bpf_probe_read(&step, sizeof(step), conf.lookup(&step_key));
+        } else {
+                ret = -1;
+        }
 
-        //send_error(ctx, tgid);
-        //send_error(ctx, pid);
+#ifdef PERFORMANCE_COUNTERS
+        u64 thread_cycles_sample = cycles_thread.perf_read(processor_id);
+        u64 core_cycles_sample = cycles_core.perf_read(processor_id);
+        u64 instruction_retired_thread = instr_thread.perf_read(processor_id);
+        u64 cache_misses_thread = cache_misses.perf_read(processor_id);
+        u64 cache_refs_thread = cache_refs.perf_read(processor_id);
+#endif
 
-        //remove the pid from the table if there
-        pids.delete(&pid);
+        /**
+         * The exiting thread is still the one running on this processor,
+         * account its last slice of execution before harvesting its counters
+         */
+        if (ret == 0 && step >= STEP_MIN && step <= STEP_MAX) {
+#ifdef PERFORMANCE_COUNTERS
+                update_cycles_count(ctx, pid, bpf_selector, step, processor_id, thread_cycles_sample, core_cycles_sample, instruction_retired_thread, cache_misses_thread, cache_refs_thread, ts);
+#else
+                update_cycles_count(ctx, pid, bpf_selector, step, processor_id, ts);
+#endif
+        }
+
+        /**
+         * Move the final counters to exited_pids and remove the pid from the
+         * table. With PERCPU_MAPS other cpus might hold counters of this
+         * thread, so the entry is left in place for the userspace sweep.
+         * With CGROUP_AGGREGATION the counters are already in the cgroup entry,
+         * userspace reads only the pids of exited_pids to forget their container
+         */
+#ifndef PERCPU_MAPS
+        struct pid_status *status = pids.lookup(&pid);
+        if (status != NULL) {
+                add_exited_pid(pid, status, step);
+                pids.delete(&pid);
+        }
+#endif
 
         struct proc_topology topology_info;
         bpf_probe_read(&topology_info, sizeof(topology_info), processors.lookup(&processor_id));
@@ -660,11 +831,11 @@ int trace_exit(struct sched_process_exit_args *ctx) {
         topology_info.running_pid = 0;
         topology_info.ts = ts;
 #ifdef PERFORMANCE_COUNTERS
-        topology_info.cycles_thread = cycles_thread.perf_read(processor_id);
-        topology_info.cycles_core = cycles_core.perf_read(processor_id);
-        topology_info.instruction_thread = instr_thread.perf_read(processor_id);
-        topology_info.cache_misses = cache_misses.perf_read(processor_id);
-        topology_info.cache_refs = cache_refs.perf_read(processor_id);
+        topology_info.cycles_thread = thread_cycles_sample;
+        topology_info.cycles_core = core_cycles_sample;
+        topology_info.instruction_thread = instruction_retired_thread;
+        topology_info.cache_misses = cache_misses_thread;
+        topology_info.cache_refs = cache_refs_thread;
         topology_info.cycles_core_delta_sibling = 0;
 #endif
 
@@ -29,7 +29,6 @@
 #include <linux/netfilter.h>
 #include <net/netfilter/nf_tables.h>
 
-// #define LATENCY_SAMPLES 128
 #define PAYLOAD_LEN 68
 
 #define STATUS_CLIENT -1
@@ -49,8 +48,7 @@
 
 // #define DYN_TCP_CLIENT_PORT_MASKING
 // #define DYN_TCP_CLIENT_PORT_MASKING_THRESHOLD 10
-// #define LATENCY_BUCKET_SIZE 8
-// #define BUCKET_COUNT 32
+// #define LATENCY_MULTIPLIER 3276691
 
 
 //struct used to detect if a connection endpoint is server or client
@@ -135,47 +133,98 @@ struct summary_data_t {
   int16_t status;
 };
 
-struct latency_data_t {
-  u64 latency_vector[LATENCY_BUCKET_SIZE];
-};
-
 struct msg_t {
   struct msghdr *msg;
 };
 
-#define BPF_SELECTOR_INDEX 0
-#define BPF_SELECTOR_ZERO 0
-#define BPF_SELECTOR_ONE 1
-BPF_ARRAY(conf, u32, 2);
-
-BPF_HASH(ipv4_endpoints, struct ipv4_endpoint_key_t, struct endpoint_data_t, 100000);
-BPF_HASH(ipv6_endpoints, struct ipv6_endpoint_key_t, struct endpoint_data_t, 100000);
-BPF_HASH(ipv4_connections, struct ipv4_key_t, struct connection_data_t, 100000);
-BPF_HASH(ipv6_connections, struct ipv6_key_t, struct connection_data_t, 100000);
-
-// selector 0
-BPF_HASH(ipv4_summary, struct ipv4_key_t, struct summary_data_t);
-BPF_HASH(ipv6_summary, struct ipv6_key_t, struct summary_data_t);
-BPF_HASH(ipv4_http_summary, struct ipv4_http_key_t, struct summary_data_t);
-BPF_HASH(ipv6_http_summary, struct ipv6_http_key_t, struct summary_data_t);
-BPF_HASH(ipv4_latency, struct ipv4_key_t, struct latency_data_t, 60000);
-BPF_HASH(ipv6_latency, struct ipv6_key_t, struct latency_data_t, 60000);
-BPF_HASH(ipv4_http_latency, struct ipv4_http_key_t, struct latency_data_t, 60000);
-BPF_HASH(ipv6_http_latency, struct ipv6_http_key_t, struct latency_data_t, 60000);
-
-// selector 1
-BPF_HASH(ipv4_summary_1, struct ipv4_key_t, struct summary_data_t);
-BPF_HASH(ipv6_summary_1, struct ipv6_key_t, struct summary_data_t);
-BPF_HASH(ipv4_http_summary_1, struct ipv4_http_key_t, struct summary_data_t);
-BPF_HASH(ipv6_http_summary_1, struct ipv6_http_key_t, struct summary_data_t);
-BPF_HASH(ipv4_latency_1, struct ipv4_key_t, struct latency_data_t, 60000);
-BPF_HASH(ipv6_latency_1, struct ipv6_key_t, struct latency_data_t, 60000);
-BPF_HASH(ipv4_http_latency_1, struct ipv4_http_key_t, struct latency_data_t, 60000);
-BPF_HASH(ipv6_http_latency_1, struct ipv6_http_key_t, struct latency_data_t, 60000);
-
-
-BPF_HASH(set_state_cache, struct sock *, struct endpoint_data_t);
-BPF_HASH(recv_cache, struct sock *, struct msg_t, 90000);
+
+// Endpoints, connections and the caches of pending sockets are cleaned up by
+// the probes when connections are closed. They are LRU tables, so when they
+// are full new connections evict the least recently used ones instead of
+// not being tracked at all
+#ifndef CONNECTION_TABLE_SIZE
+#define CONNECTION_TABLE_SIZE 100000
+#endif
+
+BPF_TABLE("lru_hash", struct ipv4_endpoint_key_t, struct endpoint_data_t, ipv4_endpoints, CONNECTION_TABLE_SIZE);
+BPF_TABLE("lru_hash", struct ipv6_endpoint_key_t, struct endpoint_data_t, ipv6_endpoints, CONNECTION_TABLE_SIZE);
+BPF_TABLE("lru_hash", struct ipv4_key_t, struct connection_data_t, ipv4_connections, CONNECTION_TABLE_SIZE);
+BPF_TABLE("lru_hash", struct ipv6_key_t, struct connection_data_t, ipv6_connections, CONNECTION_TABLE_SIZE);
+
+// Per-cpu counters of new keys, deleted keys and failed updates of the
+// tables. LRU tables do not report evictions, userspace estimates them from
+// inserts, deletes and the size of the table
+#define MAP_INSERT 0
+#define MAP_DELETE 1
+#define MAP_FAILURE 2
+#define MAP_EVENTS 3
+
+#define IPV4_ENDPOINTS_STATS 0
+#define IPV6_ENDPOINTS_STATS 1
+#define IPV4_CONNECTIONS_STATS 2
+#define IPV6_CONNECTIONS_STATS 3
+#define SET_STATE_CACHE_STATS 4
+#define RECV_CACHE_STATS 5
+#define SUMMARY_STATS 6
+#define LATENCY_STATS 7
+#define MAP_STATS_COUNT 8
+
+BPF_PERCPU_ARRAY(map_stats, u64, MAP_STATS_COUNT * MAP_EVENTS);
+
+static inline void count_map_event(int map, int event) {
+  int index = map * MAP_EVENTS + event;
+  u64 *count = map_stats.lookup(&index);
+  if(count != NULL) {
+    *count += 1;
+  }
+}
+
+// Summaries and latency histograms are double buffered: each outer map holds
+// the two inner maps of its table, and inner_map_selector the index of the
+// ones the probes are writing to. Each probe reads the selector once, so the
+// summary and the latency of a transaction end up in the same buffer. At every
+// sample userspace flips the selector and then reads and empties the inner
+// maps written in the last sample
+BPF_ARRAY(inner_map_selector, int, 1);
+
+static inline int get_inner_map_index() {
+  int zero = 0;
+  int *selector = inner_map_selector.lookup(&zero);
+  if(selector == NULL) {
+    return 0;
+  }
+  return *selector;
+}
+
+BPF_HASH(ipv4_summary_a, struct ipv4_key_t, struct summary_data_t);
+BPF_HASH(ipv4_summary_b, struct ipv4_key_t, struct summary_data_t);
+BPF_HASH(ipv6_summary_a, struct ipv6_key_t, struct summary_data_t);
+BPF_HASH(ipv6_summary_b, struct ipv6_key_t, struct summary_data_t);
+BPF_HASH(ipv4_http_summary_a, struct ipv4_http_key_t, struct summary_data_t);
+BPF_HASH(ipv4_http_summary_b, struct ipv4_http_key_t, struct summary_data_t);
+BPF_HASH(ipv6_http_summary_a, struct ipv6_http_key_t, struct summary_data_t);
+BPF_HASH(ipv6_http_summary_b, struct ipv6_http_key_t, struct summary_data_t);
+BPF_HASH(ipv4_latency_a, struct ipv4_key_t, u64, 100000);
+BPF_HASH(ipv4_latency_b, struct ipv4_key_t, u64, 100000);
+BPF_HASH(ipv6_latency_a, struct ipv6_key_t, u64, 100000);
+BPF_HASH(ipv6_latency_b, struct ipv6_key_t, u64, 100000);
+BPF_HASH(ipv4_http_latency_a, struct ipv4_http_key_t, u64, 100000);
+BPF_HASH(ipv4_http_latency_b, struct ipv4_http_key_t, u64, 100000);
+BPF_HASH(ipv6_http_latency_a, struct ipv6_http_key_t, u64, 100000);
+BPF_HASH(ipv6_http_latency_b, struct ipv6_http_key_t, u64, 100000);
+
+BPF_ARRAY_OF_MAPS(ipv4_summary, "ipv4_summary_a", 2);
+BPF_ARRAY_OF_MAPS(ipv6_summary, "ipv6_summary_a", 2);
+BPF_ARRAY_OF_MAPS(ipv4_http_summary, "ipv4_http_summary_a", 2);
+BPF_ARRAY_OF_MAPS(ipv6_http_summary, "ipv6_http_summary_a", 2);
+BPF_ARRAY_OF_MAPS(ipv4_latency, "ipv4_latency_a", 2);
+BPF_ARRAY_OF_MAPS(ipv6_latency, "ipv6_latency_a", 2);
+BPF_ARRAY_OF_MAPS(ipv4_http_latency, "ipv4_http_latency_a", 2);
+BPF_ARRAY_OF_MAPS(ipv6_http_latency, "ipv6_http_latency_a", 2);
+
+
+BPF_TABLE("lru_hash", struct sock *, struct endpoint_data_t, set_state_cache, CONNECTION_TABLE_SIZE);
+BPF_TABLE("lru_hash", struct sock *, struct msg_t, recv_cache, CONNECTION_TABLE_SIZE);
 
 struct iptables_data_t {
   u32 saddr;
@@ -205,22 +254,67 @@ BPF_HASH(iptables6_rewrite_cache_out, u64, struct iptables6_data_t);
 BPF_HASH(rewritten_rules_6, struct ipv6_endpoint_key_t, struct ipv6_endpoint_key_t);
 
 
-static void safe_array_write(u32 idx, u64* array, u64 value) {
-  #pragma clang loop unroll(full)
-  for(int array_index = 0; array_index<LATENCY_BUCKET_SIZE; array_index++) {
-    if(array_index == idx) {
-      array[array_index] = value;
-    }
+// Latencies are counted in histograms, the slot of the latency keys is the
+// bucket of the latency (in ns) in the LinearlyInterpolatedMapping of
+// DDSketch: ceil((e + s) * multiplier), where latency = 2^e * (1 + s) and
+// s in [0, 1). LATENCY_MULTIPLIER is the multiplier of the mapping in fixed
+// point with 16 fractional bits, (e + s) also has 16 fractional bits
+#define LATENCY_FRAC_BITS 16
+
+static inline u32 msb_index(u64 value) {
+  u32 index = 0;
+  if(value >> 32) { value >>= 32; index += 32; }
+  if(value >> 16) { value >>= 16; index += 16; }
+  if(value >> 8) { value >>= 8; index += 8; }
+  if(value >> 4) { value >>= 4; index += 4; }
+  if(value >> 2) { value >>= 2; index += 2; }
+  if(value >> 1) { index += 1; }
+  return index;
+}
+
+static inline u64 latency_bucket(u64 latency) {
+  if(latency == 0) {
+    latency = 1;
+  }
+  u32 e = msb_index(latency);
+  u64 s = latency - (1ULL << e);
+  if(e >= LATENCY_FRAC_BITS) {
+    s = s >> (e - LATENCY_FRAC_BITS);
+  } else {
+    s = s << (LATENCY_FRAC_BITS - e);
   }
+  u64 log2_approx = ((u64)e << LATENCY_FRAC_BITS) + s;
+  u64 bucket = log2_approx * LATENCY_MULTIPLIER;
+  // ceil, the product has 2 * LATENCY_FRAC_BITS fractional bits
+  return (bucket + (1ULL << (2 * LATENCY_FRAC_BITS)) - 1) >> (2 * LATENCY_FRAC_BITS);
 }
 
-// compute the slot for the latency storage
-static inline u64 row_index(u32 transaction_count) {
-  return transaction_count / LATENCY_BUCKET_SIZE;
+// update the summary of key in summary_map, an inner summary map
+static inline void summary_update(void *summary_map, void *key, struct summary_data_t *summary) {
+  if(bpf_map_update_elem(summary_map, key, summary, BPF_ANY) != 0) {
+    // the summary table of this sample is full
+    count_map_event(SUMMARY_STATS, MAP_FAILURE);
+  }
 }
 
-static inline u8 col_index(u32 transaction_count) {
-  return transaction_count % LATENCY_BUCKET_SIZE;
+// add a transaction to the bucket of key in histogram, an inner latency map
+static inline void histogram_increment(void *histogram, void *key) {
+  if(histogram == NULL) {
+    return;
+  }
+  u64 *count = bpf_map_lookup_elem(histogram, key);
+  if(count == NULL) {
+    u64 zero = 0;
+    // BPF_NOEXIST, another cpu might have added the bucket in the meantime
+    bpf_map_update_elem(histogram, key, &zero, BPF_NOEXIST);
+    count = bpf_map_lookup_elem(histogram, key);
+    if(count == NULL) {
+      // the histogram table of this sample is full
+      count_map_event(LATENCY_STATS, MAP_FAILURE);
+      return;
+    }
+  }
+  lock_xadd(count, 1);
 }
 
 
@@ -248,8 +342,7 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
 
 #endif
 
-  struct latency_data_t latency_zero = {};
-  int write_config = BPF_SELECTOR_INDEX;
+  int inner_map_index = get_inner_map_index();
   u64 ts = bpf_ktime_get_ns();
   //get dport and lport
   int ret;
@@ -268,7 +361,11 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
 
       struct endpoint_data_t endpoint_value = {.status = STATUS_CLIENT, .open_connections = 0};
       // I am a client trying to establish a connection
-      set_state_cache.update(&sk, &endpoint_value);
+      if(set_state_cache.insert(&sk, &endpoint_value) == 0) {
+        count_map_event(SET_STATE_CACHE_STATS, MAP_INSERT);
+      } else if(set_state_cache.update(&sk, &endpoint_value) != 0) {
+        count_map_event(SET_STATE_CACHE_STATS, MAP_FAILURE);
+      }
     }
 
     if(state == TCP_ESTABLISHED) {
@@ -279,7 +376,9 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
       ret = bpf_probe_read(&endpoint_value, sizeof(endpoint_value), set_state_cache.lookup(&sk));
       if(ret == 0) {
         // I was a client
-        set_state_cache.delete(&sk);
+        if(set_state_cache.delete(&sk) == 0) {
+          count_map_event(SET_STATE_CACHE_STATS, MAP_DELETE);
+        }
         endpoint_value.open_connections = 1;
       } else {
         // I was a server
@@ -295,7 +394,11 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
       }
 
       if(ret == 0) {
-        ipv4_endpoints.update(&endpoint_key, &endpoint_value);
+        if(ipv4_endpoints.insert(&endpoint_key, &endpoint_value) == 0) {
+          count_map_event(IPV4_ENDPOINTS_STATS, MAP_INSERT);
+        } else if(ipv4_endpoints.update(&endpoint_key, &endpoint_value) != 0) {
+          count_map_event(IPV4_ENDPOINTS_STATS, MAP_FAILURE);
+        }
 
         // connection established, populate connection hashmap (this happens 2 times if connection between local processes)
         struct ipv4_key_t connection_key = {.saddr = saddr, .lport = lport, .daddr = daddr, .dport = dport};
@@ -311,7 +414,11 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
         connection_data.transaction_flow = T_UNKNOWN;
         connection_data.transaction_state = T_STATUS_OFF;
 
-        ipv4_connections.update(&connection_key, &connection_data);
+        if(ipv4_connections.insert(&connection_key, &connection_data) == 0) {
+          count_map_event(IPV4_CONNECTIONS_STATS, MAP_INSERT);
+        } else if(ipv4_connections.update(&connection_key, &connection_data) != 0) {
+          count_map_event(IPV4_CONNECTIONS_STATS, MAP_FAILURE);
+        }
       }
 
     }
@@ -319,7 +426,9 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
 
     if(state == TCP_FIN_WAIT1 || state == TCP_FIN_WAIT2 || state == TCP_CLOSING || state == TCP_TIME_WAIT || state == TCP_LAST_ACK || state == TCP_CLOSE_WAIT) {
       // delete pending stuff on connection setup if still there
-      set_state_cache.delete(&sk);
+      if(set_state_cache.delete(&sk) == 0) {
+        count_map_event(SET_STATE_CACHE_STATS, MAP_DELETE);
+      }
 
       // socket closed, clean things
       struct ipv4_key_t connection_key = {.saddr = saddr, .lport = lport, .daddr = daddr, .dport = dport};
@@ -350,19 +459,13 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
 #endif
               bpf_probe_read_str(&(http_key.http_payload), sizeof(http_key.http_payload), &(connection_data->http_payload));
 
-              // choose the bpf table depending on the current selector
               struct summary_data_t summary_data;
 
-              unsigned int selector_value = 0;
-              bpf_probe_read(&selector_value, sizeof(selector_value), conf.lookup(&write_config));
-
-              if(selector_value == BPF_SELECTOR_ZERO) {
-                ret = bpf_probe_read(&summary_data, sizeof(summary_data), ipv4_http_summary.lookup(&http_key));
-              } else if(selector_value == BPF_SELECTOR_ONE) {
-                ret = bpf_probe_read(&summary_data, sizeof(summary_data), ipv4_http_summary_1.lookup(&http_key));
-              } else {
+              void *summary_map = ipv4_http_summary.lookup(&inner_map_index);
+              if(summary_map == NULL) {
                 return 0;
               }
+              ret = bpf_probe_read(&summary_data, sizeof(summary_data), bpf_map_lookup_elem(summary_map, &http_key));
 
               // check status and flow correctness
               if(endpoint_data->status == STATUS_SERVER) {
@@ -370,32 +473,11 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
                 summary_data.time += connection_data->first_ts_out - connection_data->last_ts_in;
                 summary_data.status = STATUS_SERVER;
 
-                u8 col = 0;
-                // store latency data in the proper hashmap
-                if(summary_data.transaction_count > LATENCY_SAMPLES) {
-                  u64 slot = bpf_get_prandom_u32() % summary_data.transaction_count;
-                  if (slot < LATENCY_SAMPLES) {
-                    http_key.slot = row_index(slot);
-                    col = col_index(slot);
-                  }
-                } else {
-                  http_key.slot = row_index(summary_data.transaction_count);
-                  col = col_index(summary_data.transaction_count);
-                }
                 u64 delta = (connection_data->first_ts_out - connection_data->last_ts_in);
 
-                // write to the table pointed by the selector
-                if(selector_value == BPF_SELECTOR_ONE) {
-                  struct latency_data_t * row = ipv4_http_latency_1.lookup_or_init(&http_key, &latency_zero);
-                  if(row != NULL) {
-                    safe_array_write(col, row->latency_vector, delta);
-                  }
-                } else {
-                  struct latency_data_t * row = ipv4_http_latency.lookup_or_init(&http_key, &latency_zero);
-                  if(row != NULL) {
-                    safe_array_write(col, row->latency_vector, delta);
-                  }
-                }
+                // count the transaction in the histogram bucket of its latency
+                http_key.slot = latency_bucket(delta);
+                histogram_increment(ipv4_http_latency.lookup(&inner_map_index), &http_key);
                 http_key.slot = 0;
 
               } else if (endpoint_data->status == STATUS_CLIENT){
@@ -403,32 +485,11 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
                 summary_data.time += connection_data->last_ts_in - connection_data->first_ts_out;
                 summary_data.status = STATUS_CLIENT;
 
-                u8 col = 0;
-                // store latency data in the proper hashmap
-                if(summary_data.transaction_count > LATENCY_SAMPLES) {
-                  u64 slot = bpf_get_prandom_u32() % summary_data.transaction_count;
-                  if (slot < LATENCY_SAMPLES) {
-                    http_key.slot = row_index(slot);
-                    col = col_index(slot);
-                  }
-                } else {
-                  http_key.slot = row_index(summary_data.transaction_count);
-                  col = col_index(summary_data.transaction_count);
-                }
                 u64 delta = (connection_data->last_ts_in - connection_data->first_ts_out);
 
-                // write to the table pointed by the selector
-                if(selector_value == BPF_SELECTOR_ONE) {
-                  struct latency_data_t * row = ipv4_http_latency_1.lookup_or_init(&http_key, &latency_zero);
-                  if(row != NULL) {
-                    safe_array_write(col, row->latency_vector, delta);
-                  }
-                } else {
-                  struct latency_data_t * row = ipv4_http_latency.lookup_or_init(&http_key, &latency_zero);
-                  if(row != NULL) {
-                    safe_array_write(col, row->latency_vector, delta);
-                  }
-                }
+                // count the transaction in the histogram bucket of its latency
+                http_key.slot = latency_bucket(delta);
+                histogram_increment(ipv4_http_latency.lookup(&inner_map_index), &http_key);
                 http_key.slot = 0;
 
               }
@@ -437,11 +498,7 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
               summary_data.byte_tx += connection_data->byte_tx;
               summary_data.pid = bpf_get_current_pid_tgid();
 
-              if(selector_value == BPF_SELECTOR_ONE) {
-                ipv4_http_summary_1.update(&http_key, &summary_data);
-              } else {
-                ipv4_http_summary.update(&http_key, &summary_data);
-              }
+              summary_update(summary_map, &http_key, &summary_data);
 
 #ifdef BYPASS
               //
@@ -471,11 +528,7 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
 
                 summary_data.status = STATUS_UNKNOWN;
 
-                if(selector_value == BPF_SELECTOR_ONE) {
-                  ipv4_http_summary_1.update(&http_key, &summary_data);
-                } else {
-                  ipv4_http_summary.update(&http_key, &summary_data);
-                }
+                summary_update(summary_map, &http_key, &summary_data);
 
                 rewritten_rules.delete(&endpoint_key);
               }
@@ -508,11 +561,7 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
 
                 summary_data.status = STATUS_UNKNOWN;
 
-                if(selector_value == BPF_SELECTOR_ONE) {
-                  ipv4_http_summary_1.update(&http_key, &summary_data);
-                } else {
-                  ipv4_http_summary.update(&http_key, &summary_data);
-                }
+                summary_update(summary_map, &http_key, &summary_data);
 
                 rewritten_rules.delete(&endpoint_key);
               }
@@ -535,12 +584,8 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
 
             } else {
 
-              // choose the bpf table depending on the current selector
               struct summary_data_t summary_data = {};
 
-              unsigned int selector_value = 0;
-              bpf_probe_read(&selector_value, sizeof(selector_value), conf.lookup(&write_config));
-
 #ifdef DYN_TCP_CLIENT_PORT_MASKING
               if(connection_data->dyn_port_masking_count < DYN_TCP_CLIENT_PORT_MASKING_THRESHOLD) {
                 if(endpoint_data->status == STATUS_SERVER) {
@@ -551,13 +596,11 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
               }
 #endif
 
-              if(selector_value == BPF_SELECTOR_ZERO) {
-                ret = bpf_probe_read(&summary_data, sizeof(summary_data), ipv4_summary.lookup(&connection_key));
-              } else if(selector_value == BPF_SELECTOR_ONE) {
-                ret = bpf_probe_read(&summary_data, sizeof(summary_data), ipv4_summary_1.lookup(&connection_key));
-              } else {
+              void *summary_map = ipv4_summary.lookup(&inner_map_index);
+              if(summary_map == NULL) {
                 return 0;
               }
+              ret = bpf_probe_read(&summary_data, sizeof(summary_data), bpf_map_lookup_elem(summary_map, &connection_key));
 
 
               // check status and flow correctness
@@ -566,32 +609,11 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
                 summary_data.time += connection_data->first_ts_out - connection_data->last_ts_in;
                 summary_data.status = STATUS_SERVER;
 
-                u8 col = 0;
-                // store latency data in the proper hashmap
-                if(summary_data.transaction_count > LATENCY_SAMPLES) {
-                  u64 slot = bpf_get_prandom_u32() % summary_data.transaction_count;
-                  if (slot < LATENCY_SAMPLES) {
-                    connection_key.slot = row_index(slot);
-                    col = col_index(slot);
-                  }
-                } else {
-                  connection_key.slot = row_index(summary_data.transaction_count);
-                  col = col_index(summary_data.transaction_count);
-                }
                 u64 delta = (connection_data->first_ts_out - connection_data->last_ts_in);
 
-                // write to the table pointed by the selector
-                if(selector_value == BPF_SELECTOR_ONE) {
-                  struct latency_data_t * row = ipv4_latency_1.lookup_or_init(&connection_key, &latency_zero);
-                  if(row != NULL) {
-                    safe_array_write(col, row->latency_vector, delta);
-                  }
-                } else {
-                  struct latency_data_t * row = ipv4_latency.lookup_or_init(&connection_key, &latency_zero);
-                  if(row != NULL) {
-                    safe_array_write(col, row->latency_vector, delta);
-                  }
-                }
+                // count the transaction in the histogram bucket of its latency
+                connection_key.slot = latency_bucket(delta);
+                histogram_increment(ipv4_latency.lookup(&inner_map_index), &connection_key);
                 connection_key.slot = 0;
 
               } else if (endpoint_data->status == STATUS_CLIENT){
@@ -599,32 +621,11 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
                 summary_data.time += connection_data->last_ts_in - connection_data->first_ts_out;
                 summary_data.status = STATUS_CLIENT;
 
-                u8 col = 0;
-                // store latency data in the proper hashmap
-                if(summary_data.transaction_count > LATENCY_SAMPLES) {
-                  u64 slot = bpf_get_prandom_u32() % summary_data.transaction_count;
-                  if (slot < LATENCY_SAMPLES) {
-                    connection_key.slot = row_index(slot);
-                    col = col_index(slot);
-                  }
-                } else {
-                  connection_key.slot = row_index(summary_data.transaction_count);
-                  col = col_index(summary_data.transaction_count);
-                }
                 u64 delta = (connection_data->last_ts_in - connection_data->first_ts_out);
 
-                // write to the table pointed by the selector
-                if(selector_value == BPF_SELECTOR_ONE) {
-                  struct latency_data_t * row = ipv4_latency_1.lookup_or_init(&connection_key, &latency_zero);
-                  if(row != NULL) {
-                    safe_array_write(col, row->latency_vector, delta);
-                  }
-                } else {
-                  struct latency_data_t * row = ipv4_latency.lookup_or_init(&connection_key, &latency_zero);
-                  if(row != NULL) {
-                    safe_array_write(col, row->latency_vector, delta);
-                  }
-                }
+                // count the transaction in the histogram bucket of its latency
+                connection_key.slot = latency_bucket(delta);
+                histogram_increment(ipv4_latency.lookup(&inner_map_index), &connection_key);
                 connection_key.slot = 0;
 
               }
@@ -633,11 +634,7 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
               summary_data.byte_tx += connection_data->byte_tx;
               summary_data.pid = bpf_get_current_pid_tgid();
 
-              if(selector_value == BPF_SELECTOR_ONE) {
-                ipv4_summary_1.update(&connection_key, &summary_data);
-              } else {
-                ipv4_summary.update(&connection_key, &summary_data);
-              }
+              summary_update(summary_map, &connection_key, &summary_data);
 
 #ifdef DYN_TCP_CLIENT_PORT_MASKING
               if(connection_data->dyn_port_masking_count < DYN_TCP_CLIENT_PORT_MASKING_THRESHOLD) {
@@ -671,11 +668,7 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
 
                 summary_data.status = STATUS_UNKNOWN;
 
-                if(selector_value == BPF_SELECTOR_ONE) {
-                  ipv4_summary_1.update(&connection_key, &summary_data);
-                } else {
-                  ipv4_summary.update(&connection_key, &summary_data);
-                }
+                summary_update(summary_map, &connection_key, &summary_data);
 
                 rewritten_rules.delete(&endpoint_key);
               }
@@ -702,11 +695,7 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
 
                 summary_data.status = STATUS_UNKNOWN;
 
-                if(selector_value == BPF_SELECTOR_ONE) {
-                  ipv4_summary_1.update(&connection_key, &summary_data);
-                } else {
-                  ipv4_summary.update(&connection_key, &summary_data);
-                }
+                summary_update(summary_map, &connection_key, &summary_data);
 
                 rewritten_rules.delete(&endpoint_key);
               }
@@ -742,7 +731,9 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
       //ok, here the connection is definitively closed, we can delete
 #ifdef KILL_CONNECTION_DATA
       // delete pending stuff on connection setup if still there
-      set_state_cache.delete(&sk);
+      if(set_state_cache.delete(&sk) == 0) {
+        count_map_event(SET_STATE_CACHE_STATS, MAP_DELETE);
+      }
       // socket closed, clean things
       struct ipv4_key_t connection_key = {.saddr = saddr, .lport = lport, .daddr = daddr, .dport = dport};
       struct connection_data_t * connection_data = ipv4_connections.lookup(&connection_key);
@@ -757,10 +748,14 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
           if(endpoint_data != NULL && endpoint_data->status == STATUS_SERVER && endpoint_data->open_connections > 1) {
             endpoint_data->open_connections -= 1;
           } else {
-            ipv4_endpoints.delete(&endpoint_key);
+            if(ipv4_endpoints.delete(&endpoint_key) == 0) {
+              count_map_event(IPV4_ENDPOINTS_STATS, MAP_DELETE);
+            }
           }
         }
-        ipv4_connections.delete(&connection_key);
+        if(ipv4_connections.delete(&connection_key) == 0) {
+          count_map_event(IPV4_CONNECTIONS_STATS, MAP_DELETE);
+        }
       }
 #endif
     }
@@ -771,7 +766,11 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
 
       struct endpoint_data_t endpoint_value = {.status = STATUS_CLIENT, .open_connections = 0};
       // I am a client trying to establish a connection
-      set_state_cache.update(&sk, &endpoint_value);
+      if(set_state_cache.insert(&sk, &endpoint_value) == 0) {
+        count_map_event(SET_STATE_CACHE_STATS, MAP_INSERT);
+      } else if(set_state_cache.update(&sk, &endpoint_value) != 0) {
+        count_map_event(SET_STATE_CACHE_STATS, MAP_FAILURE);
+      }
     }
 
     if(state == TCP_ESTABLISHED) {
@@ -784,7 +783,9 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
       ret = bpf_probe_read(&endpoint_value, sizeof(endpoint_value), set_state_cache.lookup(&sk));
       if(ret == 0) {
         // I was a client
-        set_state_cache.delete(&sk);
+        if(set_state_cache.delete(&sk) == 0) {
+          count_map_event(SET_STATE_CACHE_STATS, MAP_DELETE);
+        }
         endpoint_value.open_connections = 1;
       } else {
         // I was a server
@@ -800,7 +801,11 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
       }
 
       if(ret == 0) {
-        ipv6_endpoints.update(&endpoint_key, &endpoint_value);
+        if(ipv6_endpoints.insert(&endpoint_key, &endpoint_value) == 0) {
+          count_map_event(IPV6_ENDPOINTS_STATS, MAP_INSERT);
+        } else if(ipv6_endpoints.update(&endpoint_key, &endpoint_value) != 0) {
+          count_map_event(IPV6_ENDPOINTS_STATS, MAP_FAILURE);
+        }
 
         // connection established, populate connection hashmap (this happens 2 times if connection between local processes)
         struct ipv6_key_t connection_key = {.lport = lport, .dport = dport};
@@ -818,14 +823,20 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
         connection_data.transaction_flow = T_UNKNOWN;
         connection_data.transaction_state = T_STATUS_OFF;
 
-        ipv6_connections.update(&connection_key, &connection_data);
+        if(ipv6_connections.insert(&connection_key, &connection_data) == 0) {
+          count_map_event(IPV6_CONNECTIONS_STATS, MAP_INSERT);
+        } else if(ipv6_connections.update(&connection_key, &connection_data) != 0) {
+          count_map_event(IPV6_CONNECTIONS_STATS, MAP_FAILURE);
+        }
       }
 
     }
 
     if(state == TCP_FIN_WAIT1 || state == TCP_FIN_WAIT2 || state == TCP_CLOSING || state == TCP_TIME_WAIT || state == TCP_LAST_ACK || state == TCP_CLOSE_WAIT) {
       // delete pending stuff on connection setup if still there
-      set_state_cache.delete(&sk);
+      if(set_state_cache.delete(&sk) == 0) {
+        count_map_event(SET_STATE_CACHE_STATS, MAP_DELETE);
+      }
 
       // socket closed, clean things
       struct ipv6_key_t connection_key = {.lport = lport, .dport = dport};
@@ -858,19 +869,13 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
 #endif
               bpf_probe_read_str(&(http_key.http_payload), sizeof(http_key.http_payload), &(connection_data->http_payload));
 
-              // choose the bpf table depending on the current selector
               struct summary_data_t summary_data;
 
-              unsigned int selector_value = 0;
-              bpf_probe_read(&selector_value, sizeof(selector_value), conf.lookup(&write_config));
-
-              if(selector_value == BPF_SELECTOR_ZERO) {
-                ret = bpf_probe_read(&summary_data, sizeof(summary_data), ipv6_http_summary.lookup(&http_key));
-              } else if(selector_value == BPF_SELECTOR_ONE) {
-                ret = bpf_probe_read(&summary_data, sizeof(summary_data), ipv6_http_summary_1.lookup(&http_key));
-              } else {
+              void *summary_map = ipv6_http_summary.lookup(&inner_map_index);
+              if(summary_map == NULL) {
                 return 0;
               }
+              ret = bpf_probe_read(&summary_data, sizeof(summary_data), bpf_map_lookup_elem(summary_map, &http_key));
 
 
               // check status and flow correctness
@@ -880,32 +885,11 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
                 summary_data.status = STATUS_SERVER;
 
 
-                u8 col = 0;
-                // store latency data in the proper hashmap
-                if(summary_data.transaction_count > LATENCY_SAMPLES) {
-                  u64 slot = bpf_get_prandom_u32() % summary_data.transaction_count;
-                  if (slot < LATENCY_SAMPLES) {
-                    http_key.slot = row_index(slot);
-                    col = col_index(slot);
-                  }
-                } else {
-                  http_key.slot = row_index(summary_data.transaction_count);
-                  col = col_index(summary_data.transaction_count);
-                }
                 u64 delta = (connection_data->first_ts_out - connection_data->last_ts_in);
 
-                // write to the table pointed by the selector
-                if(selector_value == BPF_SELECTOR_ONE) {
-                  struct latency_data_t * row = ipv6_http_latency_1.lookup_or_init(&http_key, &latency_zero);
-                  if(row != NULL) {
-                    safe_array_write(col, row->latency_vector, delta);
-                  }
-                } else {
-                  struct latency_data_t * row = ipv6_http_latency.lookup_or_init(&http_key, &latency_zero);
-                  if(row != NULL) {
-                    safe_array_write(col, row->latency_vector, delta);
-                  }
-                }
+                // count the transaction in the histogram bucket of its latency
+                http_key.slot = latency_bucket(delta);
+                histogram_increment(ipv6_http_latency.lookup(&inner_map_index), &http_key);
                 http_key.slot = 0;
 
               } else if (endpoint_data->status == STATUS_CLIENT){
@@ -913,32 +897,11 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
                 summary_data.time += connection_data->last_ts_in - connection_data->first_ts_out;
                 summary_data.status = STATUS_CLIENT;
 
-                u8 col = 0;
-                // store latency data in the proper hashmap
-                if(summary_data.transaction_count > LATENCY_SAMPLES) {
-                  u64 slot = bpf_get_prandom_u32() % summary_data.transaction_count;
-                  if (slot < LATENCY_SAMPLES) {
-                    http_key.slot = row_index(slot);
-                    col = col_index(slot);
-                  }
-                } else {
-                  http_key.slot = row_index(summary_data.transaction_count);
-                  col = col_index(summary_data.transaction_count);
-                }
                 u64 delta = (connection_data->last_ts_in - connection_data->first_ts_out);
 
-                // write to the table pointed by the selector
-                if(selector_value == BPF_SELECTOR_ONE) {
-                  struct latency_data_t * row = ipv6_http_latency_1.lookup_or_init(&http_key, &latency_zero);
-                  if(row != NULL) {
-                    safe_array_write(col, row->latency_vector, delta);
-                  }
-                } else {
-                  struct latency_data_t * row = ipv6_http_latency.lookup_or_init(&http_key, &latency_zero);
-                  if(row != NULL) {
-                    safe_array_write(col, row->latency_vector, delta);
-                  }
-                }
+                // count the transaction in the histogram bucket of its latency
+                http_key.slot = latency_bucket(delta);
+                histogram_increment(ipv6_http_latency.lookup(&inner_map_index), &http_key);
                 http_key.slot = 0;
 
               }
@@ -947,11 +910,7 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
               summary_data.byte_tx += connection_data->byte_tx;
               summary_data.pid = bpf_get_current_pid_tgid();
 
-              if(selector_value == BPF_SELECTOR_ONE) {
-                ipv6_http_summary_1.update(&http_key, &summary_data);
-              } else {
-                ipv6_http_summary.update(&http_key, &summary_data);
-              }
+              summary_update(summary_map, &http_key, &summary_data);
 
 #ifdef BYPASS
               //
@@ -982,11 +941,7 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
 
                 summary_data.status = STATUS_UNKNOWN;
 
-                if(selector_value == BPF_SELECTOR_ONE) {
-                  ipv6_http_summary_1.update(&http_key, &summary_data);
-                } else {
-                  ipv6_http_summary.update(&http_key, &summary_data);
-                }
+                summary_update(summary_map, &http_key, &summary_data);
 
                 rewritten_rules_6.delete(&endpoint_key);
               }
@@ -1020,11 +975,7 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
 
                 summary_data.status = STATUS_UNKNOWN;
 
-                if(selector_value == BPF_SELECTOR_ONE) {
-                  ipv6_http_summary_1.update(&http_key, &summary_data);
-                } else {
-                  ipv6_http_summary.update(&http_key, &summary_data);
-                }
+                summary_update(summary_map, &http_key, &summary_data);
 
                 rewritten_rules_6.delete(&endpoint_key);
               }
@@ -1046,12 +997,8 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
 
             } else {
 
-              // choose the bpf table depending on the current selector
               struct summary_data_t summary_data = {};
 
-              unsigned int selector_value = 0;
-              bpf_probe_read(&selector_value, sizeof(selector_value), conf.lookup(&write_config));
-
 #ifdef DYN_TCP_CLIENT_PORT_MASKING
               if(connection_data->dyn_port_masking_count < DYN_TCP_CLIENT_PORT_MASKING_THRESHOLD) {
                 if(endpoint_data->status == STATUS_SERVER) {
@@ -1062,13 +1009,11 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
               }
 #endif
 
-              if(selector_value == BPF_SELECTOR_ZERO) {
-                ret = bpf_probe_read(&summary_data, sizeof(summary_data), ipv6_summary.lookup(&connection_key));
-              } else if(selector_value == BPF_SELECTOR_ONE) {
-                ret = bpf_probe_read(&summary_data, sizeof(summary_data), ipv6_summary_1.lookup(&connection_key));
-              } else {
+              void *summary_map = ipv6_summary.lookup(&inner_map_index);
+              if(summary_map == NULL) {
                 return 0;
               }
+              ret = bpf_probe_read(&summary_data, sizeof(summary_data), bpf_map_lookup_elem(summary_map, &connection_key));
 
               // check status and flow correctness
               if(endpoint_data->status == STATUS_SERVER) {
@@ -1076,32 +1021,11 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
                 summary_data.time += connection_data->first_ts_out - connection_data->last_ts_in;
                 summary_data.status = STATUS_SERVER;
 
-                u8 col = 0;
-                // store latency data in the proper hashmap
-                if(summary_data.transaction_count > LATENCY_SAMPLES) {
-                  u64 slot = bpf_get_prandom_u32() % summary_data.transaction_count;
-                  if (slot < LATENCY_SAMPLES) {
-                    connection_key.slot = row_index(slot);
-                    col = col_index(slot);
-                  }
-                } else {
-                  connection_key.slot = row_index(summary_data.transaction_count);
-                  col = col_index(summary_data.transaction_count);
-                }
                 u64 delta = (connection_data->first_ts_out - connection_data->last_ts_in);
 
-                // write to the table pointed by the selector
-                if(selector_value == BPF_SELECTOR_ONE) {
-                  struct latency_data_t * row = ipv6_latency_1.lookup_or_init(&connection_key, &latency_zero);
-                  if(row != NULL) {
-                    safe_array_write(col, row->latency_vector, delta);
-                  }
-                } else {
-                  struct latency_data_t * row = ipv6_latency.lookup_or_init(&connection_key, &latency_zero);
-                  if(row != NULL) {
-                    safe_array_write(col, row->latency_vector, delta);
-                  }
-                }
+                // count the transaction in the histogram bucket of its latency
+                connection_key.slot = latency_bucket(delta);
+                histogram_increment(ipv6_latency.lookup(&inner_map_index), &connection_key);
                 connection_key.slot = 0;
 
               } else if (endpoint_data->status == STATUS_CLIENT){
@@ -1109,32 +1033,11 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
                 summary_data.time += connection_data->last_ts_in - connection_data->first_ts_out;
                 summary_data.status = STATUS_CLIENT;
 
-                u8 col = 0;
-                // store latency data in the proper hashmap
-                if(summary_data.transaction_count > LATENCY_SAMPLES) {
-                  u64 slot = bpf_get_prandom_u32() % summary_data.transaction_count;
-                  if (slot < LATENCY_SAMPLES) {
-                    connection_key.slot = row_index(slot);
-                    col = col_index(slot);
-                  }
-                } else {
-                  connection_key.slot = row_index(summary_data.transaction_count);
-                  col = col_index(summary_data.transaction_count);
-                }
                 u64 delta = (connection_data->last_ts_in - connection_data->first_ts_out);
 
-                // write to the table pointed by the selector
-                if(selector_value == BPF_SELECTOR_ONE) {
-                  struct latency_data_t * row = ipv6_latency_1.lookup_or_init(&connection_key, &latency_zero);
-                  if(row != NULL) {
-                    safe_array_write(col, row->latency_vector, delta);
-                  }
-                } else {
-                  struct latency_data_t * row = ipv6_latency.lookup_or_init(&connection_key, &latency_zero);
-                  if(row != NULL) {
-                    safe_array_write(col, row->latency_vector, delta);
-                  }
-                }
+                // count the transaction in the histogram bucket of its latency
+                connection_key.slot = latency_bucket(delta);
+                histogram_increment(ipv6_latency.lookup(&inner_map_index), &connection_key);
                 connection_key.slot = 0;
 
               }
@@ -1143,11 +1046,7 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
               summary_data.byte_tx += connection_data->byte_tx;
               summary_data.pid = bpf_get_current_pid_tgid();
 
-              if(selector_value == BPF_SELECTOR_ONE) {
-                ipv6_summary_1.update(&connection_key, &summary_data);
-              } else {
-                ipv6_summary.update(&connection_key, &summary_data);
-              }
+              summary_update(summary_map, &connection_key, &summary_data);
 
 #ifdef DYN_TCP_CLIENT_PORT_MASKING
               if(connection_data->dyn_port_masking_count < DYN_TCP_CLIENT_PORT_MASKING_THRESHOLD) {
@@ -1179,11 +1078,7 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
                 }
                 summary_data.status = STATUS_UNKNOWN;
 
-                if(selector_value == BPF_SELECTOR_ONE) {
-                  ipv6_summary_1.update(&connection_key, &summary_data);
-                } else {
-                  ipv6_summary.update(&connection_key, &summary_data);
-                }
+                summary_update(summary_map, &connection_key, &summary_data);
 
                 rewritten_rules_6.delete(&endpoint_key);
               }
@@ -1209,11 +1104,7 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
                 }
                 summary_data.status = STATUS_UNKNOWN;
 
-                if(selector_value == BPF_SELECTOR_ONE) {
-                  ipv6_summary_1.update(&connection_key, &summary_data);
-                } else {
-                  ipv6_summary.update(&connection_key, &summary_data);
-                }
+                summary_update(summary_map, &connection_key, &summary_data);
 
                 rewritten_rules_6.delete(&endpoint_key);
               }
@@ -1250,7 +1141,9 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
 #ifdef KILL_CONNECTION_DATA
 
       // delete pending stuff on connection setup if still there
-      set_state_cache.delete(&sk);
+      if(set_state_cache.delete(&sk) == 0) {
+        count_map_event(SET_STATE_CACHE_STATS, MAP_DELETE);
+      }
 
       // socket closed, clean things
       struct ipv6_key_t connection_key = {.lport = lport, .dport = dport};
@@ -1268,9 +1161,13 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
         if(endpoint_data != NULL && endpoint_data->status == STATUS_SERVER && endpoint_data->open_connections > 1) {
           endpoint_data->open_connections -= 1;
         } else {
-          ipv6_endpoints.delete(&endpoint_key);
+          if(ipv6_endpoints.delete(&endpoint_key) == 0) {
+            count_map_event(IPV6_ENDPOINTS_STATS, MAP_DELETE);
+          }
+        }
+        if(ipv6_connections.delete(&connection_key) == 0) {
+          count_map_event(IPV6_CONNECTIONS_STATS, MAP_DELETE);
         }
-        ipv6_connections.delete(&connection_key);
       }
 #endif
     }
@@ -1287,8 +1184,7 @@ TRACEPOINT_PROBE(sock, inet_sock_set_state) {
 
 int kprobe__tcp_sendmsg(struct pt_regs *ctx, struct sock *sk, struct msghdr *msg, size_t size) {
   u64 ts = bpf_ktime_get_ns();
-  struct latency_data_t latency_zero = {};
-  int write_config = BPF_SELECTOR_INDEX;
+  int inner_map_index = get_inner_map_index();
 
   u16 lport = sk->__sk_common.skc_num;
   u16 dport = sk->__sk_common.skc_dport;
@@ -1363,48 +1259,21 @@ int kprobe__tcp_sendmsg(struct pt_regs *ctx, struct sock *sk, struct msghdr *msg
 #endif
               bpf_probe_read_str(&(http_key.http_payload), sizeof(http_key.http_payload), &(connection_data->http_payload));
 
-              // choose the bpf table depending on the current selector
               struct summary_data_t summary_data;
 
-              unsigned int selector_value = 0;
-              bpf_probe_read(&selector_value, sizeof(selector_value), conf.lookup(&write_config));
-
-              if(selector_value == BPF_SELECTOR_ZERO) {
-                bpf_probe_read(&summary_data, sizeof(summary_data), ipv4_http_summary.lookup(&http_key));
-              } else if(selector_value == BPF_SELECTOR_ONE) {
-                bpf_probe_read(&summary_data, sizeof(summary_data), ipv4_http_summary_1.lookup(&http_key));
-              } else {
+              void *summary_map = ipv4_http_summary.lookup(&inner_map_index);
+              if(summary_map == NULL) {
                 return 0;
               }
+              bpf_probe_read(&summary_data, sizeof(summary_data), bpf_map_lookup_elem(summary_map, &http_key));
 
               summary_data.time += connection_data->last_ts_in - connection_data->first_ts_out;
 
-              u8 col = 0;
-              // store latency data in the proper hashmap
-              if(summary_data.transaction_count > LATENCY_SAMPLES) {
-                u64 slot = bpf_get_prandom_u32() % summary_data.transaction_count;
-                if (slot < LATENCY_SAMPLES) {
-                  http_key.slot = row_index(slot);
-                  col = col_index(slot);
-                }
-              } else {
-                http_key.slot = row_index(summary_data.transaction_count);
-                col = col_index(summary_data.transaction_count);
-              }
               u64 delta = (connection_data->last_ts_in - connection_data->first_ts_out);
 
-              // write to the table pointed by the selector
-              if(selector_value == BPF_SELECTOR_ONE) {
-                struct latency_data_t * row = ipv4_http_latency_1.lookup_or_init(&http_key, &latency_zero);
-                if(row != NULL) {
-                  safe_array_write(col, row->latency_vector, delta);
-                }
-              } else {
-                struct latency_data_t * row = ipv4_http_latency.lookup_or_init(&http_key, &latency_zero);
-                if(row != NULL) {
-                  safe_array_write(col, row->latency_vector, delta);
-                }
-              }
+              // count the transaction in the histogram bucket of its latency
+              http_key.slot = latency_bucket(delta);
+              histogram_increment(ipv4_http_latency.lookup(&inner_map_index), &http_key);
               http_key.slot = 0;
 
               // measuring overall transaction time for client
@@ -1414,11 +1283,7 @@ int kprobe__tcp_sendmsg(struct pt_regs *ctx, struct sock *sk, struct msghdr *msg
               summary_data.status = STATUS_CLIENT;
               summary_data.pid = bpf_get_current_pid_tgid();
 
-              if(selector_value == BPF_SELECTOR_ONE) {
-                ipv4_http_summary_1.update(&http_key, &summary_data);
-              } else {
-                ipv4_http_summary.update(&http_key, &summary_data);
-              }
+              summary_update(summary_map, &http_key, &summary_data);
 
 #ifdef BYPASS
               //
@@ -1437,11 +1302,7 @@ int kprobe__tcp_sendmsg(struct pt_regs *ctx, struct sock *sk, struct msghdr *msg
                 http_key.daddr = nat_data->addr;
                 summary_data.status = STATUS_UNKNOWN;
 
-                if(selector_value == BPF_SELECTOR_ONE) {
-                  ipv4_http_summary_1.update(&http_key, &summary_data);
-                } else {
-                  ipv4_http_summary.update(&http_key, &summary_data);
-                }
+                summary_update(summary_map, &http_key, &summary_data);
               }
 
               endpoint_key.addr = connection_key.daddr;
@@ -1455,11 +1316,7 @@ int kprobe__tcp_sendmsg(struct pt_regs *ctx, struct sock *sk, struct msghdr *msg
                 http_key.dport = endpoint_key.port;
                 summary_data.status = STATUS_UNKNOWN;
 
-                if(selector_value == BPF_SELECTOR_ONE) {
-                  ipv4_http_summary_1.update(&http_key, &summary_data);
-                } else {
-                  ipv4_http_summary.update(&http_key, &summary_data);
-                }
+                summary_update(summary_map, &http_key, &summary_data);
               }
 
               //remember to restore endpoint key!!!
@@ -1468,55 +1325,28 @@ int kprobe__tcp_sendmsg(struct pt_regs *ctx, struct sock *sk, struct msghdr *msg
 #endif //BYPASS
             } else {
 
-              // choose the bpf table depending on the current selector
               struct summary_data_t summary_data;
 
-              unsigned int selector_value = 0;
-              bpf_probe_read(&selector_value, sizeof(selector_value), conf.lookup(&write_config));
-
 #ifdef DYN_TCP_CLIENT_PORT_MASKING
               if(connection_data->dyn_port_masking_count < DYN_TCP_CLIENT_PORT_MASKING_THRESHOLD) {
                 connection_key.lport = 0;
               }
 #endif
 
-              if(selector_value == BPF_SELECTOR_ZERO) {
-                bpf_probe_read(&summary_data, sizeof(summary_data), ipv4_summary.lookup(&connection_key));
-              } else if(selector_value == BPF_SELECTOR_ONE) {
-                bpf_probe_read(&summary_data, sizeof(summary_data), ipv4_summary_1.lookup(&connection_key));
-              } else {
+              void *summary_map = ipv4_summary.lookup(&inner_map_index);
+              if(summary_map == NULL) {
                 return 0;
               }
+              bpf_probe_read(&summary_data, sizeof(summary_data), bpf_map_lookup_elem(summary_map, &connection_key));
 
 
               summary_data.time += connection_data->last_ts_in - connection_data->first_ts_out;
 
-              u8 col = 0;
-              // store latency data in the proper hashmap
-              if(summary_data.transaction_count > LATENCY_SAMPLES) {
-                u64 slot = bpf_get_prandom_u32() % summary_data.transaction_count;
-                if (slot < LATENCY_SAMPLES) {
-                  connection_key.slot = row_index(slot);
-                  col = col_index(slot);
-                }
-              } else {
-                connection_key.slot = row_index(summary_data.transaction_count);
-                col = col_index(summary_data.transaction_count);
-              }
               u64 delta = (connection_data->last_ts_in - connection_data->first_ts_out);
 
-              // write to the table pointed by the selector
-              if(selector_value == BPF_SELECTOR_ONE) {
-                struct latency_data_t * row = ipv4_latency_1.lookup_or_init(&connection_key, &latency_zero);
-                if(row != NULL) {
-                  safe_array_write(col, row->latency_vector, delta);
-                }
-              } else {
-                struct latency_data_t * row = ipv4_latency.lookup_or_init(&connection_key, &latency_zero);
-                if(row != NULL) {
-                  safe_array_write(col, row->latency_vector, delta);
-                }
-              }
+              // count the transaction in the histogram bucket of its latency
+              connection_key.slot = latency_bucket(delta);
+              histogram_increment(ipv4_latency.lookup(&inner_map_index), &connection_key);
               connection_key.slot = 0;
 
               // measuring overall transaction time for client
@@ -1526,11 +1356,7 @@ int kprobe__tcp_sendmsg(struct pt_regs *ctx, struct sock *sk, struct msghdr *msg
               summary_data.status = STATUS_CLIENT;
               summary_data.pid = bpf_get_current_pid_tgid();
 
-              if(selector_value == BPF_SELECTOR_ONE) {
-                ipv4_summary_1.update(&connection_key, &summary_data);
-              } else {
-                ipv4_summary.update(&connection_key, &summary_data);
-              }
+              summary_update(summary_map, &connection_key, &summary_data);
 
 #ifdef DYN_TCP_CLIENT_PORT_MASKING
               if(connection_data->dyn_port_masking_count < DYN_TCP_CLIENT_PORT_MASKING_THRESHOLD) {
@@ -1549,11 +1375,7 @@ int kprobe__tcp_sendmsg(struct pt_regs *ctx, struct sock *sk, struct msghdr *msg
                 connection_key.dport = nat_data->port;
                 summary_data.status = STATUS_UNKNOWN;
 
-                if(selector_value == BPF_SELECTOR_ONE) {
-                  ipv4_summary_1.update(&connection_key, &summary_data);
-                } else {
-                  ipv4_summary.update(&connection_key, &summary_data);
-                }
+                summary_update(summary_map, &connection_key, &summary_data);
               }
 
               endpoint_key.addr = daddr;
@@ -1567,11 +1389,7 @@ int kprobe__tcp_sendmsg(struct pt_regs *ctx, struct sock *sk, struct msghdr *msg
                 connection_key.dport = endpoint_key.port;
                 summary_data.status = STATUS_UNKNOWN;
 
-                if(selector_value == BPF_SELECTOR_ONE) {
-                  ipv4_summary_1.update(&connection_key, &summary_data);
-                } else {
-                  ipv4_summary.update(&connection_key, &summary_data);
-                }
+                summary_update(summary_map, &connection_key, &summary_data);
               }
 
               //remember to restore endpoint and connection key!!!
@@ -1647,10 +1465,12 @@ int kprobe__tcp_sendmsg(struct pt_regs *ctx, struct sock *sk, struct msghdr *msg
           // here we are! retrieve the connection and upload the String
           bpf_probe_read_str(connection_data->http_payload, sizeof(connection_data->http_payload), data_to_be_read.iov_base);
 
+          // cut query string and fragment, path segments are templated
+          // in userspace
           u8 clear = 0;
           #pragma clang loop unroll(full)
           for(int array_index = 0; array_index<PAYLOAD_LEN; array_index++) {
-            if(connection_data->http_payload[array_index] == '?' || connection_data->http_payload[array_index] == '\r' || clear == 1) {
+            if(connection_data->http_payload[array_index] == '?' || connection_data->http_payload[array_index] == '#' || connection_data->http_payload[array_index] == '\r' || clear == 1) {
               connection_data->http_payload[array_index] = '\0';
               clear = 1;
             }
@@ -1736,48 +1556,21 @@ int kprobe__tcp_sendmsg(struct pt_regs *ctx, struct sock *sk, struct msghdr *msg
 #endif
               bpf_probe_read_str(&(http_key.http_payload), sizeof(http_key.http_payload), &(connection_data->http_payload));
 
-              // choose the bpf table depending on the current selector
               struct summary_data_t summary_data;
 
-              unsigned int selector_value = 0;
-              bpf_probe_read(&selector_value, sizeof(selector_value), conf.lookup(&write_config));
-
-              if(selector_value == BPF_SELECTOR_ZERO) {
-                bpf_probe_read(&summary_data, sizeof(summary_data), ipv6_http_summary.lookup(&http_key));
-              } else if(selector_value == BPF_SELECTOR_ONE) {
-                bpf_probe_read(&summary_data, sizeof(summary_data), ipv6_http_summary_1.lookup(&http_key));
-              } else {
+              void *summary_map = ipv6_http_summary.lookup(&inner_map_index);
+              if(summary_map == NULL) {
                 return 0;
               }
+              bpf_probe_read(&summary_data, sizeof(summary_data), bpf_map_lookup_elem(summary_map, &http_key));
 
               summary_data.time += connection_data->last_ts_in - connection_data->first_ts_out;
 
-              u8 col = 0;
-              // store latency data in the proper hashmap
-              if(summary_data.transaction_count > LATENCY_SAMPLES) {
-                u64 slot = bpf_get_prandom_u32() % summary_data.transaction_count;
-                if (slot < LATENCY_SAMPLES) {
-                  http_key.slot = row_index(slot);
-                  col = col_index(slot);
-                }
-              } else {
-                http_key.slot = row_index(summary_data.transaction_count);
-                col = col_index(summary_data.transaction_count);
-              }
               u64 delta = (connection_data->last_ts_in - connection_data->first_ts_out);
 
-              // write to the table pointed by the selector
-              if(selector_value == BPF_SELECTOR_ONE) {
-                struct latency_data_t * row = ipv6_http_latency_1.lookup_or_init(&http_key, &latency_zero);
-                if(row != NULL) {
-                  safe_array_write(col, row->latency_vector, delta);
-                }
-              } else {
-                struct latency_data_t * row = ipv6_http_latency.lookup_or_init(&http_key, &latency_zero);
-                if(row != NULL) {
-                  safe_array_write(col, row->latency_vector, delta);
-                }
-              }
+              // count the transaction in the histogram bucket of its latency
+              http_key.slot = latency_bucket(delta);
+              histogram_increment(ipv6_http_latency.lookup(&inner_map_index), &http_key);
               http_key.slot = 0;
 
               // measuring overall transaction time for client
@@ -1787,11 +1580,7 @@ int kprobe__tcp_sendmsg(struct pt_regs *ctx, struct sock *sk, struct msghdr *msg
               summary_data.status = STATUS_CLIENT;
               summary_data.pid = bpf_get_current_pid_tgid();
 
-              if(selector_value == BPF_SELECTOR_ONE) {
-                ipv6_http_summary_1.update(&http_key, &summary_data);
-              } else {
-                ipv6_http_summary.update(&http_key, &summary_data);
-              }
+              summary_update(summary_map, &http_key, &summary_data);
 
 #ifdef BYPASS
               //
@@ -1810,11 +1599,7 @@ int kprobe__tcp_sendmsg(struct pt_regs *ctx, struct sock *sk, struct msghdr *msg
                 http_key.daddr = nat_data->addr;
                 summary_data.status = STATUS_UNKNOWN;
 
-                if(selector_value == BPF_SELECTOR_ONE) {
-                  ipv6_http_summary_1.update(&http_key, &summary_data);
-                } else {
-                  ipv6_http_summary.update(&http_key, &summary_data);
-                }
+                summary_update(summary_map, &http_key, &summary_data);
               }
 
               endpoint_key.addr = connection_key.daddr;
@@ -1828,11 +1613,7 @@ int kprobe__tcp_sendmsg(struct pt_regs *ctx, struct sock *sk, struct msghdr *msg
                 http_key.dport = endpoint_key.port;
                 summary_data.status = STATUS_UNKNOWN;
 
-                if(selector_value == BPF_SELECTOR_ONE) {
-                  ipv6_http_summary_1.update(&http_key, &summary_data);
-                } else {
-                  ipv6_http_summary.update(&http_key, &summary_data);
-                }
+                summary_update(summary_map, &http_key, &summary_data);
               }
 
               //remember to restore endpoint key!!!
@@ -1841,56 +1622,29 @@ int kprobe__tcp_sendmsg(struct pt_regs *ctx, struct sock *sk, struct msghdr *msg
 #endif //BYPASS
             } else {
 
-              // choose the bpf table depending on the current selector
               struct summary_data_t summary_data;
 
-              unsigned int selector_value = 0;
-              bpf_probe_read(&selector_value, sizeof(selector_value), conf.lookup(&write_config));
-
 #ifdef DYN_TCP_CLIENT_PORT_MASKING
               if(connection_data->dyn_port_masking_count < DYN_TCP_CLIENT_PORT_MASKING_THRESHOLD) {
                 connection_key.lport = 0;
               }
 #endif
 
-              if(selector_value == BPF_SELECTOR_ZERO) {
-                bpf_probe_read(&summary_data, sizeof(summary_data), ipv6_summary.lookup(&connection_key));
-              } else if(selector_value == BPF_SELECTOR_ONE) {
-                bpf_probe_read(&summary_data, sizeof(summary_data), ipv6_summary_1.lookup(&connection_key));
-              } else {
+              void *summary_map = ipv6_summary.lookup(&inner_map_index);
+              if(summary_map == NULL) {
                 return 0;
               }
+              bpf_probe_read(&summary_data, sizeof(summary_data), bpf_map_lookup_elem(summary_map, &connection_key));
 
 
               summary_data.time += connection_data->last_ts_in - connection_data->first_ts_out;
 
 
-              u8 col = 0;
-              // store latency data in the proper hashmap
-              if(summary_data.transaction_count > LATENCY_SAMPLES) {
-                u64 slot = bpf_get_prandom_u32() % summary_data.transaction_count;
-                if (slot < LATENCY_SAMPLES) {
-                  connection_key.slot = row_index(slot);
-                  col = col_index(slot);
-                }
-              } else {
-                connection_key.slot = row_index(summary_data.transaction_count);
-                col = col_index(summary_data.transaction_count);
-              }
               u64 delta = (connection_data->last_ts_in - connection_data->first_ts_out);
 
-              // write to the table pointed by the selector
-              if(selector_value == BPF_SELECTOR_ONE) {
-                struct latency_data_t * row = ipv6_latency_1.lookup_or_init(&connection_key, &latency_zero);
-                if(row != NULL) {
-                  safe_array_write(col, row->latency_vector, delta);
-                }
-              } else {
-                struct latency_data_t * row = ipv6_latency.lookup_or_init(&connection_key, &latency_zero);
-                if(row != NULL) {
-                  safe_array_write(col, row->latency_vector, delta);
-                }
-              }
+              // count the transaction in the histogram bucket of its latency
+              connection_key.slot = latency_bucket(delta);
+              histogram_increment(ipv6_latency.lookup(&inner_map_index), &connection_key);
               connection_key.slot = 0;
 
               //measuring overall transaction time for client
@@ -1900,11 +1654,7 @@ int kprobe__tcp_sendmsg(struct pt_regs *ctx, struct sock *sk, struct msghdr *msg
               summary_data.status = STATUS_CLIENT;
               summary_data.pid = bpf_get_current_pid_tgid();
 
-              if(selector_value == BPF_SELECTOR_ONE) {
-                ipv6_summary_1.update(&connection_key, &summary_data);
-              } else {
-                ipv6_summary.update(&connection_key, &summary_data);
-              }
+              summary_update(summary_map, &connection_key, &summary_data);
 
 #ifdef DYN_TCP_CLIENT_PORT_MASKING
               if(connection_data->dyn_port_masking_count < DYN_TCP_CLIENT_PORT_MASKING_THRESHOLD) {
@@ -1924,11 +1674,7 @@ int kprobe__tcp_sendmsg(struct pt_regs *ctx, struct sock *sk, struct msghdr *msg
                 connection_key.dport = nat_data->port;
                 summary_data.status = STATUS_UNKNOWN;
 
-                if(selector_value == BPF_SELECTOR_ONE) {
-                  ipv6_summary_1.update(&connection_key, &summary_data);
-                } else {
-                  ipv6_summary.update(&connection_key, &summary_data);
-                }
+                summary_update(summary_map, &connection_key, &summary_data);
               }
 
               bpf_probe_read(&endpoint_key.addr, sizeof(endpoint_key.addr), sk->__sk_common.skc_v6_daddr.in6_u.u6_addr32);
@@ -1942,11 +1688,7 @@ int kprobe__tcp_sendmsg(struct pt_regs *ctx, struct sock *sk, struct msghdr *msg
                 connection_key.dport = endpoint_key.port;
                 summary_data.status = STATUS_UNKNOWN;
 
-                if(selector_value == BPF_SELECTOR_ONE) {
-                  ipv6_summary_1.update(&connection_key, &summary_data);
-                } else {
-                  ipv6_summary.update(&connection_key, &summary_data);
-                }
+                summary_update(summary_map, &connection_key, &summary_data);
               }
 
               //remember to restore endpoint and connection key!!!
@@ -2022,10 +1764,12 @@ int kprobe__tcp_sendmsg(struct pt_regs *ctx, struct sock *sk, struct msghdr *msg
           // here we are! retrieve the connection and upload the String
           bpf_probe_read(connection_data->http_payload, sizeof(connection_data->http_payload), data_to_be_read.iov_base);
 
+          // cut query string and fragment, path segments are templated
+          // in userspace
           u8 clear = 0;
           #pragma clang loop unroll(full)
           for(int array_index = 0; array_index<PAYLOAD_LEN; array_index++) {
-            if(connection_data->http_payload[array_index] == '?' || connection_data->http_payload[array_index] == '\r' || clear == 1) {
+            if(connection_data->http_payload[array_index] == '?' || connection_data->http_payload[array_index] == '#' || connection_data->http_payload[array_index] == '\r' || clear == 1) {
               connection_data->http_payload[array_index] = '\0';
               clear = 1;
             }
@@ -2051,20 +1795,25 @@ int kprobe__tcp_sendmsg(struct pt_regs *ctx, struct sock *sk, struct msghdr *msg
 
 int kprobe__tcp_recvmsg(struct pt_regs *ctx, struct sock *sk, struct msghdr *msg, size_t len, int nonblock, int flags, int *addr_len) {
   struct msg_t cache_item = {.msg = msg};
-  recv_cache.update(&sk, &cache_item);
+  if(recv_cache.insert(&sk, &cache_item) == 0) {
+    count_map_event(RECV_CACHE_STATS, MAP_INSERT);
+  } else if(recv_cache.update(&sk, &cache_item) != 0) {
+    count_map_event(RECV_CACHE_STATS, MAP_FAILURE);
+  }
   return 0;
 }
 
 int kprobe__tcp_cleanup_rbuf(struct pt_regs *ctx, struct sock *sk, int copied) {
-  struct latency_data_t latency_zero = {};
   struct msg_t * cache_item = recv_cache.lookup(&sk);
   if(cache_item == NULL) {
     return 0;
   }
   struct msghdr * msg = cache_item->msg;
-  recv_cache.delete(&sk);
+  if(recv_cache.delete(&sk) == 0) {
+    count_map_event(RECV_CACHE_STATS, MAP_DELETE);
+  }
 
-  int write_config = BPF_SELECTOR_INDEX;
+  int inner_map_index = get_inner_map_index();
 
   u64 pid = bpf_get_current_pid_tgid();
   u64 ts = bpf_ktime_get_ns();
@@ -2126,48 +1875,21 @@ int kprobe__tcp_cleanup_rbuf(struct pt_regs *ctx, struct sock *sk, int copied) {
 #endif
               bpf_probe_read_str(&(http_key.http_payload), sizeof(http_key.http_payload), &(connection_data->http_payload));
 
-              // choose the bpf table depending on the current selector
               struct summary_data_t summary_data;
 
-              unsigned int selector_value = 0;
-              bpf_probe_read(&selector_value, sizeof(selector_value), conf.lookup(&write_config));
-
-              if(selector_value == BPF_SELECTOR_ZERO) {
-                bpf_probe_read(&summary_data, sizeof(summary_data), ipv4_http_summary.lookup(&http_key));
-              } else if(selector_value == BPF_SELECTOR_ONE) {
-                bpf_probe_read(&summary_data, sizeof(summary_data), ipv4_http_summary_1.lookup(&http_key));
-              } else {
+              void *summary_map = ipv4_http_summary.lookup(&inner_map_index);
+              if(summary_map == NULL) {
                 return 0;
               }
+              bpf_probe_read(&summary_data, sizeof(summary_data), bpf_map_lookup_elem(summary_map, &http_key));
 
               summary_data.time += connection_data->first_ts_out - connection_data->last_ts_in;
 
-              u8 col = 0;
-              // store latency data in the proper hashmap
-              if(summary_data.transaction_count > LATENCY_SAMPLES) {
-                u64 slot = bpf_get_prandom_u32() % summary_data.transaction_count;
-                if (slot < LATENCY_SAMPLES) {
-                  http_key.slot = row_index(slot);
-                  col = col_index(slot);
-                }
-              } else {
-                http_key.slot = row_index(summary_data.transaction_count);
-                col = col_index(summary_data.transaction_count);
-              }
               u64 delta = (connection_data->first_ts_out - connection_data->last_ts_in);
 
-              // write to the table pointed by the selector
-              if(selector_value == BPF_SELECTOR_ONE) {
-                struct latency_data_t * row = ipv4_http_latency_1.lookup_or_init(&http_key, &latency_zero);
-                if(row != NULL) {
-                  safe_array_write(col, row->latency_vector, delta);
-                }
-              } else {
-                struct latency_data_t * row = ipv4_http_latency.lookup_or_init(&http_key, &latency_zero);
-                if(row != NULL) {
-                  safe_array_write(col, row->latency_vector, delta);
-                }
-              }
+              // count the transaction in the histogram bucket of its latency
+              http_key.slot = latency_bucket(delta);
+              histogram_increment(ipv4_http_latency.lookup(&inner_map_index), &http_key);
               http_key.slot = 0;
 
               // measuring overall transaction time for client
@@ -2177,11 +1899,7 @@ int kprobe__tcp_cleanup_rbuf(struct pt_regs *ctx, struct sock *sk, int copied) {
               summary_data.status = STATUS_SERVER;
               summary_data.pid = bpf_get_current_pid_tgid();
 
-              if(selector_value == BPF_SELECTOR_ONE) {
-                ipv4_http_summary_1.update(&http_key, &summary_data);
-              } else {
-                ipv4_http_summary.update(&http_key, &summary_data);
-              }
+              summary_update(summary_map, &http_key, &summary_data);
 
 #ifdef BYPASS
               //
@@ -2195,11 +1913,7 @@ int kprobe__tcp_cleanup_rbuf(struct pt_regs *ctx, struct sock *sk, int copied) {
                 http_key.dport = endpoint_key.port;
                 summary_data.status = STATUS_UNKNOWN;
 
-                if(selector_value == BPF_SELECTOR_ONE) {
-                  ipv4_http_summary_1.update(&http_key, &summary_data);
-                } else {
-                  ipv4_http_summary.update(&http_key, &summary_data);
-                }
+                summary_update(summary_map, &http_key, &summary_data);
               }
 
               endpoint_key.addr = connection_key.daddr;
@@ -2218,11 +1932,7 @@ int kprobe__tcp_cleanup_rbuf(struct pt_regs *ctx, struct sock *sk, int copied) {
 #endif
                 summary_data.status = STATUS_UNKNOWN;
 
-                if(selector_value == BPF_SELECTOR_ONE) {
-                  ipv4_http_summary_1.update(&http_key, &summary_data);
-                } else {
-                  ipv4_http_summary.update(&http_key, &summary_data);
-                }
+                summary_update(summary_map, &http_key, &summary_data);
               }
 
               //remember to restore endpoint key!!!
@@ -2230,54 +1940,27 @@ int kprobe__tcp_cleanup_rbuf(struct pt_regs *ctx, struct sock *sk, int copied) {
               endpoint_key.port = connection_key.lport;
 #endif //BYPASS
             } else {
-              // choose the bpf table depending on the current selector
               struct summary_data_t summary_data = {};
 
-              unsigned int selector_value = 0;
-              bpf_probe_read(&selector_value, sizeof(selector_value), conf.lookup(&write_config));
-
 #ifdef DYN_TCP_CLIENT_PORT_MASKING
               if(connection_data->dyn_port_masking_count < DYN_TCP_CLIENT_PORT_MASKING_THRESHOLD) {
                 connection_key.dport = 0;
               }
 #endif
 
-              if(selector_value == BPF_SELECTOR_ZERO) {
-                bpf_probe_read(&summary_data, sizeof(summary_data), ipv4_summary.lookup(&connection_key));
-              } else if(selector_value == BPF_SELECTOR_ONE) {
-                bpf_probe_read(&summary_data, sizeof(summary_data), ipv4_summary_1.lookup(&connection_key));
-              } else {
+              void *summary_map = ipv4_summary.lookup(&inner_map_index);
+              if(summary_map == NULL) {
                 return 0;
               }
+              bpf_probe_read(&summary_data, sizeof(summary_data), bpf_map_lookup_elem(summary_map, &connection_key));
 
               summary_data.time += connection_data->first_ts_out - connection_data->last_ts_in;
 
-              u8 col = 0;
-              // store latency data in the proper hashmap
-              if(summary_data.transaction_count > LATENCY_SAMPLES) {
-                u64 slot = bpf_get_prandom_u32() % summary_data.transaction_count;
-                if (slot < LATENCY_SAMPLES) {
-                  connection_key.slot = row_index(slot);
-                  col = col_index(slot);
-                }
-              } else {
-                connection_key.slot = row_index(summary_data.transaction_count);
-                col = col_index(summary_data.transaction_count);
-              }
               u64 delta = (connection_data->first_ts_out - connection_data->last_ts_in);
 
-              // write to the table pointed by the selector
-              if(selector_value == BPF_SELECTOR_ONE) {
-                struct latency_data_t * row = ipv4_latency_1.lookup_or_init(&connection_key, &latency_zero);
-                if(row != NULL) {
-                  safe_array_write(col, row->latency_vector, delta);
-                }
-              } else {
-                struct latency_data_t * row = ipv4_latency.lookup_or_init(&connection_key, &latency_zero);
-                if(row != NULL) {
-                  safe_array_write(col, row->latency_vector, delta);
-                }
-              }
+              // count the transaction in the histogram bucket of its latency
+              connection_key.slot = latency_bucket(delta);
+              histogram_increment(ipv4_latency.lookup(&inner_map_index), &connection_key);
               connection_key.slot = 0;
 
               //measuring just response time for server
@@ -2287,11 +1970,7 @@ int kprobe__tcp_cleanup_rbuf(struct pt_regs *ctx, struct sock *sk, int copied) {
               summary_data.status = STATUS_SERVER;
               summary_data.pid = pid;
 
-              if(selector_value == BPF_SELECTOR_ONE) {
-                ipv4_summary_1.update(&connection_key, &summary_data);
-              } else {
-                ipv4_summary.update(&connection_key, &summary_data);
-              }
+              summary_update(summary_map, &connection_key, &summary_data);
 
 #ifdef DYN_TCP_CLIENT_PORT_MASKING
               if(connection_data->dyn_port_masking_count < DYN_TCP_CLIENT_PORT_MASKING_THRESHOLD) {
@@ -2311,11 +1990,7 @@ int kprobe__tcp_cleanup_rbuf(struct pt_regs *ctx, struct sock *sk, int copied) {
                 connection_key.dport = endpoint_key.port;
                 summary_data.status = STATUS_UNKNOWN;
 
-                if(selector_value == BPF_SELECTOR_ONE) {
-                  ipv4_summary_1.update(&connection_key, &summary_data);
-                } else {
-                  ipv4_summary.update(&connection_key, &summary_data);
-                }
+                summary_update(summary_map, &connection_key, &summary_data);
               }
 
               endpoint_key.addr = connection_key.daddr;
@@ -2329,11 +2004,7 @@ int kprobe__tcp_cleanup_rbuf(struct pt_regs *ctx, struct sock *sk, int copied) {
                 connection_key.lport = endpoint_key.port;
                 summary_data.status = STATUS_UNKNOWN;
 
-                if(selector_value == BPF_SELECTOR_ONE) {
-                  ipv4_summary_1.update(&connection_key, &summary_data);
-                } else {
-                  ipv4_summary.update(&connection_key, &summary_data);
-                }
+                summary_update(summary_map, &connection_key, &summary_data);
               }
 
               //remember to restore endpoint and connection key!!!
@@ -2432,10 +2103,12 @@ int kprobe__tcp_cleanup_rbuf(struct pt_regs *ctx, struct sock *sk, int copied) {
           // here we are! retrieve the connection and upload the String
           bpf_probe_read(connection_data->http_payload, sizeof(connection_data->http_payload), data_to_be_read.iov_base);
 
+          // cut query string and fragment, path segments are templated
+          // in userspace
           u8 clear = 0;
           #pragma clang loop unroll(full)
           for(int array_index = 0; array_index<PAYLOAD_LEN; array_index++) {
-            if(connection_data->http_payload[array_index] == '?' || connection_data->http_payload[array_index] == '\r' || clear == 1) {
+            if(connection_data->http_payload[array_index] == '?' || connection_data->http_payload[array_index] == '#' || connection_data->http_payload[array_index] == '\r' || clear == 1) {
               connection_data->http_payload[array_index] = '\0';
               clear = 1;
             }
@@ -2500,48 +2173,21 @@ int kprobe__tcp_cleanup_rbuf(struct pt_regs *ctx, struct sock *sk, int copied) {
 #endif
               bpf_probe_read_str(&(http_key.http_payload), sizeof(http_key.http_payload), &(connection_data->http_payload));
 
-              // choose the bpf table depending on the current selector
               struct summary_data_t summary_data;
 
-              unsigned int selector_value = 0;
-              bpf_probe_read(&selector_value, sizeof(selector_value), conf.lookup(&write_config));
-
-              if(selector_value == BPF_SELECTOR_ZERO) {
-                bpf_probe_read(&summary_data, sizeof(summary_data), ipv6_http_summary.lookup(&http_key));
-              } else if(selector_value == BPF_SELECTOR_ONE) {
-                bpf_probe_read(&summary_data, sizeof(summary_data), ipv6_http_summary_1.lookup(&http_key));
-              } else {
+              void *summary_map = ipv6_http_summary.lookup(&inner_map_index);
+              if(summary_map == NULL) {
                 return 0;
               }
+              bpf_probe_read(&summary_data, sizeof(summary_data), bpf_map_lookup_elem(summary_map, &http_key));
 
               summary_data.time += connection_data->first_ts_out - connection_data->last_ts_in;
 
-              u8 col = 0;
-              // store latency data in the proper hashmap
-              if(summary_data.transaction_count > LATENCY_SAMPLES) {
-                u64 slot = bpf_get_prandom_u32() % summary_data.transaction_count;
-                if (slot < LATENCY_SAMPLES) {
-                  http_key.slot = row_index(slot);
-                  col = col_index(slot);
-                }
-              } else {
-                http_key.slot = row_index(summary_data.transaction_count);
-                col = col_index(summary_data.transaction_count);
-              }
               u64 delta = (connection_data->first_ts_out - connection_data->last_ts_in);
 
-              // write to the table pointed by the selector
-              if(selector_value == BPF_SELECTOR_ONE) {
-                struct latency_data_t * row = ipv6_http_latency_1.lookup_or_init(&http_key, &latency_zero);
-                if(row != NULL) {
-                  safe_array_write(col, row->latency_vector, delta);
-                }
-              } else {
-                struct latency_data_t * row = ipv6_http_latency.lookup_or_init(&http_key, &latency_zero);
-                if(row != NULL) {
-                  safe_array_write(col, row->latency_vector, delta);
-                }
-              }
+              // count the transaction in the histogram bucket of its latency
+              http_key.slot = latency_bucket(delta);
+              histogram_increment(ipv6_http_latency.lookup(&inner_map_index), &http_key);
               http_key.slot = 0;
 
               // measuring overall transaction time for client
@@ -2551,11 +2197,7 @@ int kprobe__tcp_cleanup_rbuf(struct pt_regs *ctx, struct sock *sk, int copied) {
               summary_data.status = STATUS_SERVER;
               summary_data.pid = pid;
 
-              if(selector_value == BPF_SELECTOR_ONE) {
-                ipv6_http_summary_1.update(&http_key, &summary_data);
-              } else {
-                ipv6_http_summary.update(&http_key, &summary_data);
-              }
+              summary_update(summary_map, &http_key, &summary_data);
 
 #ifdef BYPASS
               //If there is a NAT in between, create an unknown transaction info with the mappings and the same key/value pairs
@@ -2567,11 +2209,7 @@ int kprobe__tcp_cleanup_rbuf(struct pt_regs *ctx, struct sock *sk, int copied) {
                 http_key.dport = endpoint_key.port;
                 summary_data.status = STATUS_UNKNOWN;
 
-                if(selector_value == BPF_SELECTOR_ONE) {
-                  ipv6_http_summary_1.update(&http_key, &summary_data);
-                } else {
-                  ipv6_http_summary.update(&http_key, &summary_data);
-                }
+                summary_update(summary_map, &http_key, &summary_data);
               }
 
               endpoint_key.addr = connection_key.daddr;
@@ -2590,11 +2228,7 @@ int kprobe__tcp_cleanup_rbuf(struct pt_regs *ctx, struct sock *sk, int copied) {
 #endif
                 summary_data.status = STATUS_UNKNOWN;
 
-                if(selector_value == BPF_SELECTOR_ONE) {
-                  ipv6_http_summary_1.update(&http_key, &summary_data);
-                } else {
-                  ipv6_http_summary.update(&http_key, &summary_data);
-                }
+                summary_update(summary_map, &http_key, &summary_data);
               }
 
               //remember to restore endpoint key!!!
@@ -2602,54 +2236,27 @@ int kprobe__tcp_cleanup_rbuf(struct pt_regs *ctx, struct sock *sk, int copied) {
               endpoint_key.port = connection_key.lport;
 #endif //BYPASS
             } else {
-              // choose the bpf table depending on the current selector
               struct summary_data_t summary_data = {};
 
-              unsigned int selector_value = 0;
-              bpf_probe_read(&selector_value, sizeof(selector_value), conf.lookup(&write_config));
-
 #ifdef DYN_TCP_CLIENT_PORT_MASKING
               if(connection_data->dyn_port_masking_count < DYN_TCP_CLIENT_PORT_MASKING_THRESHOLD) {
                 connection_key.dport = 0;
               }
 #endif
 
-              if(selector_value == BPF_SELECTOR_ZERO) {
-                bpf_probe_read(&summary_data, sizeof(summary_data), ipv6_summary.lookup(&connection_key));
-              } else if(selector_value == BPF_SELECTOR_ONE) {
-                bpf_probe_read(&summary_data, sizeof(summary_data), ipv6_summary_1.lookup(&connection_key));
-              } else {
+              void *summary_map = ipv6_summary.lookup(&inner_map_index);
+              if(summary_map == NULL) {
                 return 0;
               }
+              bpf_probe_read(&summary_data, sizeof(summary_data), bpf_map_lookup_elem(summary_map, &connection_key));
 
               summary_data.time += connection_data->first_ts_out - connection_data->last_ts_in;
 
-              u8 col = 0;
-              // store latency data in the proper hashmap
-              if(summary_data.transaction_count > LATENCY_SAMPLES) {
-                u64 slot = bpf_get_prandom_u32() % summary_data.transaction_count;
-                if (slot < LATENCY_SAMPLES) {
-                  connection_key.slot = row_index(slot);
-                  col = col_index(slot);
-                }
-              } else {
-                connection_key.slot = row_index(summary_data.transaction_count);
-                col = col_index(summary_data.transaction_count);
-              }
               u64 delta = (connection_data->first_ts_out - connection_data->last_ts_in);
 
-              // write to the table pointed by the selector
-              if(selector_value == BPF_SELECTOR_ONE) {
-                struct latency_data_t * row = ipv6_latency_1.lookup_or_init(&connection_key, &latency_zero);
-                if(row != NULL) {
-                  safe_array_write(col, row->latency_vector, delta);
-                }
-              } else {
-                struct latency_data_t * row = ipv6_latency.lookup_or_init(&connection_key, &latency_zero);
-                if(row != NULL) {
-                  safe_array_write(col, row->latency_vector, delta);
-                }
-              }
+              // count the transaction in the histogram bucket of its latency
+              connection_key.slot = latency_bucket(delta);
+              histogram_increment(ipv6_latency.lookup(&inner_map_index), &connection_key);
               connection_key.slot = 0;
 
               //measuring just response time for server transaction
@@ -2659,11 +2266,7 @@ int kprobe__tcp_cleanup_rbuf(struct pt_regs *ctx, struct sock *sk, int copied) {
               summary_data.status = STATUS_SERVER;
               summary_data.pid = bpf_get_current_pid_tgid();
 
-              if(selector_value == BPF_SELECTOR_ONE) {
-                ipv6_summary_1.update(&connection_key, &summary_data);
-              } else {
-                ipv6_summary.update(&connection_key, &summary_data);
-              }
+              summary_update(summary_map, &connection_key, &summary_data);
 
 #ifdef DYN_TCP_CLIENT_PORT_MASKING
               if(connection_data->dyn_port_masking_count < DYN_TCP_CLIENT_PORT_MASKING_THRESHOLD) {
@@ -2683,11 +2286,7 @@ int kprobe__tcp_cleanup_rbuf(struct pt_regs *ctx, struct sock *sk, int copied) {
                 connection_key.dport = endpoint_key.port;
                 summary_data.status = STATUS_UNKNOWN;
 
-                if(selector_value == BPF_SELECTOR_ONE) {
-                  ipv6_summary_1.update(&connection_key, &summary_data);
-                } else {
-                  ipv6_summary.update(&connection_key, &summary_data);
-                }
+                summary_update(summary_map, &connection_key, &summary_data);
               }
 
               endpoint_key.addr = connection_key.daddr;
@@ -2701,11 +2300,7 @@ int kprobe__tcp_cleanup_rbuf(struct pt_regs *ctx, struct sock *sk, int copied) {
                 connection_key.lport = endpoint_key.port;
                 summary_data.status = STATUS_UNKNOWN;
 
-                if(selector_value == BPF_SELECTOR_ONE) {
-                  ipv6_summary_1.update(&connection_key, &summary_data);
-                } else {
-                  ipv6_summary.update(&connection_key, &summary_data);
-                }
+                summary_update(summary_map, &connection_key, &summary_data);
               }
 
               //remember to restore endpoint and connection key!!!
@@ -2805,10 +2400,12 @@ int kprobe__tcp_cleanup_rbuf(struct pt_regs *ctx, struct sock *sk, int copied) {
           // here we are! retrieve the connection and upload the String
           bpf_probe_read(connection_data->http_payload, sizeof(connection_data->http_payload), data_to_be_read.iov_base);
 
+          // cut query string and fragment, path segments are templated
+          // in userspace
           u8 clear = 0;
           #pragma clang loop unroll(full)
           for(int array_index = 0; array_index<PAYLOAD_LEN; array_index++) {
-            if(connection_data->http_payload[array_index] == '?' || connection_data->http_payload[array_index] == '\r' || clear == 1) {
+            if(connection_data->http_payload[array_index] == '?' || connection_data->http_payload[array_index] == '#' || connection_data->http_payload[array_index] == '\r' || clear == 1) {
               connection_data->http_payload[array_index] = '\0';
               clear = 1;
             }
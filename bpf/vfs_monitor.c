@@ -25,14 +25,30 @@
 #include <linux/blkdev.h>
 #include <linux/dcache.h>
 #include <linux/mount.h>
+#include <uapi/linux/magic.h>
+
+/**
+ * counts_by_file is an LRU map: when it is full the least recently
+ * updated files are evicted, userspace only reports the top files anyway
+ */
+#ifndef FILE_TABLE_SIZE
+#define FILE_TABLE_SIZE 10240
+#endif
+
+/**
+ * Number of path components (the file name and its parent directories)
+ * copied when a file is added to counts_by_file
+ */
+#ifndef FILE_PATH_DEPTH
+#define FILE_PATH_DEPTH 4
+#endif
 
 struct val_t {
     u32 sz;
     u64 ts;
-    u32 name_len;
-    char name[DNAME_INLINE_LEN];
-    char parent1[DNAME_INLINE_LEN];
-    char parent2[DNAME_INLINE_LEN];
+    u64 dev;
+    u64 ino;
+    struct dentry *de;
 };
 
 struct val_pid_t {
@@ -44,24 +60,164 @@ struct val_pid_t {
     u64 sum_ts_deltas;
 };
 
+/**
+ * Files are identified by device and inode, userspace resolves the full
+ * path of the files it reports through the open fds of tgid. The names of
+ * the file and of its parents (leaf first) are copied only when the file is
+ * added to the map, and they are used when the file is no longer open.
+ * root is set when the names reach the root of the filesystem
+ */
 struct val_file_t {
     u64 num_r;
     u64 num_w;
     u64 bytes_r;
     u64 bytes_w;
+    u32 tgid;
+    u8 root;
+    char name[FILE_PATH_DEPTH][DNAME_INLINE_LEN];
 };
 
 struct key_file_t {
-    char name[DNAME_INLINE_LEN];
-    char parent1[DNAME_INLINE_LEN];
-    char parent2[DNAME_INLINE_LEN];
+    u64 dev;
+    u64 ino;
 };
 
 
 BPF_HASH(counts_by_pid, pid_t, struct val_pid_t);
-BPF_HASH(counts_by_file, struct key_file_t, struct val_file_t);
+BPF_TABLE("lru_hash", struct key_file_t, struct val_file_t, counts_by_file, FILE_TABLE_SIZE);
+#ifdef VFS_FEXIT
+BPF_HASH(entry_ts, pid_t, u64);
+#else
 BPF_HASH(entryinfo, pid_t, struct val_t);
+#endif
+
+/**
+ * Files renamed or deleted since the last sample, userspace drops their
+ * cached paths
+ */
+BPF_TABLE("lru_hash", struct key_file_t, u8, invalidated_files, 1024);
+
+/**
+ * Pseudo filesystems do not do any disk I/O, skip them
+ */
+static inline int is_pseudo_fs(unsigned long magic) {
+    return magic == PROC_SUPER_MAGIC || magic == SYSFS_MAGIC ||
+        magic == CGROUP_SUPER_MAGIC || magic == CGROUP2_SUPER_MAGIC ||
+        magic == DEBUGFS_MAGIC || magic == TRACEFS_MAGIC ||
+        magic == SECURITYFS_MAGIC || magic == BPF_FS_MAGIC;
+}
+
+/**
+ * Add a read (type 0) or write (type 1) of sz bytes to the counters of the
+ * pid and of the file
+ */
+static inline int account_rw(u32 pid, int type, u64 sz, u64 delta_us,
+        u64 dev, u64 ino, struct dentry *de) {
+
+    struct val_pid_t *val_pid, zero_pid = {};
+    val_pid = counts_by_pid.lookup_or_init(&pid, &zero_pid);
+    if (val_pid) {
+        if (type == 0) {
+            val_pid->num_r++;
+            val_pid->bytes_r += sz;
+        } else {
+            val_pid->num_w++;
+            val_pid->bytes_w += sz;
+        }
+        val_pid->sum_ts_deltas += delta_us;
+        val_pid->pid = pid;
+    }
+
+    struct key_file_t file_key = {};
+    file_key.dev = dev;
+    file_key.ino = ino;
+
+    struct val_file_t *val_file = counts_by_file.lookup(&file_key);
+    if (val_file == NULL) {
+        struct val_file_t zero_file = {};
+        struct qstr d_name = {};
+        struct dentry *parent = NULL;
+        #pragma clang loop unroll(full)
+        for (int i = 0; i < FILE_PATH_DEPTH; i++) {
+            bpf_probe_read(&d_name, sizeof(d_name), &de->d_name);
+            bpf_probe_read(&zero_file.name[i], DNAME_INLINE_LEN, d_name.name);
+            bpf_probe_read(&parent, sizeof(parent), &de->d_parent);
+            if (parent == NULL || parent == de) {
+                // the root of a filesystem is its own parent
+                zero_file.root = 1;
+                break;
+            }
+            de = parent;
+        }
+        counts_by_file.update(&file_key, &zero_file);
+        val_file = counts_by_file.lookup(&file_key);
+    }
+
+    if (val_file) {
+        val_file->tgid = bpf_get_current_pid_tgid() >> 32;
+        if (type == 0) {
+            val_file->num_r++;
+            val_file->bytes_r += sz;
+        } else {
+            val_file->num_w++;
+            val_file->bytes_w += sz;
+        }
+    }
+    return 0;
+}
+
+#ifdef VFS_FEXIT
+/**
+ * fexit programs see the arguments and the return value of the function
+ * at once, the bytes actually transferred are accounted. fentry only
+ * stores the timestamp of the call by pid to measure latency
+ */
+static inline int is_traced_file(struct file *file) {
+    int mode = file->f_inode->i_mode;
+    if (file->f_path.dentry->d_name.len == 0 || !S_ISREG(mode))
+        return 0;
+    return !is_pseudo_fs(file->f_inode->i_sb->s_magic);
+}
+
+static inline int trace_rw_start(struct file *file) {
+    if (!is_traced_file(file))
+        return 0;
+    u32 pid = bpf_get_current_pid_tgid();
+    u64 ts = bpf_ktime_get_ns();
+    entry_ts.update(&pid, &ts);
+    return 0;
+}
+
+static inline int trace_rw_exit(struct file *file, ssize_t ret, int type) {
+    if (!is_traced_file(file))
+        return 0;
 
+    u32 pid = bpf_get_current_pid_tgid();
+    u64 *tsp = entry_ts.lookup(&pid);
+    if (tsp == 0)
+        return 0;
+    u64 delta_us = (bpf_ktime_get_ns() - *tsp) / 1000;
+    entry_ts.delete(&pid);
+    if (ret <= 0)
+        return 0;
+
+    return account_rw(pid, type, ret, delta_us, file->f_inode->i_sb->s_dev,
+        file->f_inode->i_ino, file->f_path.dentry);
+}
+
+KFUNC_PROBE(vfs_read, struct file *file, char *buf, size_t count, loff_t *pos) {
+    return trace_rw_start(file);
+}
+KFUNC_PROBE(vfs_write, struct file *file, const char *buf, size_t count, loff_t *pos) {
+    return trace_rw_start(file);
+}
+KRETFUNC_PROBE(vfs_read, struct file *file, char *buf, size_t count, loff_t *pos, ssize_t ret) {
+    return trace_rw_exit(file, ret, 0);
+}
+KRETFUNC_PROBE(vfs_write, struct file *file, const char *buf, size_t count, loff_t *pos, ssize_t ret) {
+    return trace_rw_exit(file, ret, 1);
+}
+#else
 int trace_rw_entry(struct pt_regs *ctx, struct file *file, char __user *buf, size_t count) {
     u32 tgid = bpf_get_current_pid_tgid() >> 32;
     u32 pid = bpf_get_current_pid_tgid();
@@ -69,25 +225,15 @@ int trace_rw_entry(struct pt_regs *ctx, struct file *file, char __user *buf, siz
     struct dentry *de = file->f_path.dentry;
     if (de->d_name.len == 0 || !S_ISREG(mode))
         return 0;
-    // store size and timestamp by pid
+    if (is_pseudo_fs(file->f_inode->i_sb->s_magic))
+        return 0;
+    // store size, timestamp and file by pid
     struct val_t val = {};
     val.sz = count;
     val.ts = bpf_ktime_get_ns();
-    struct qstr d_name = de->d_name;
-    val.name_len = d_name.len;
-
-    bpf_probe_read(&val.name, sizeof(val.name), d_name.name);
-
-    struct dentry *parent = de->d_parent;
-    if (parent) {
-        struct qstr parent_name = parent->d_name;
-        bpf_probe_read(&val.parent1, sizeof(val.parent1), parent_name.name);
-
-        struct dentry *second_parent = parent->d_parent;
-
-        struct qstr second_parent_name = second_parent->d_name;
-        bpf_probe_read(&val.parent2, sizeof(val.parent2), second_parent_name.name);
-    }
+    val.dev = file->f_inode->i_sb->s_dev;
+    val.ino = file->f_inode->i_ino;
+    val.de = de;
 
     entryinfo.update(&pid, &val);
     return 0;
@@ -105,45 +251,194 @@ static int trace_rw_return(struct pt_regs *ctx, int type) {
 
     //calculates delta and removes key
     u64 delta_us = (bpf_ktime_get_ns() - valp->ts) / 1000;
+    struct val_t val = *valp;
     entryinfo.delete(&pid);
 
-    struct val_pid_t *val_pid, zero_pid = {};
-    val_pid = counts_by_pid.lookup_or_init(&pid, &zero_pid);
-    if (val_pid) {
-        if (type == 0) {
-            val_pid->num_r++;
-            val_pid->bytes_r += valp->sz;
-        } else {
-            val_pid->num_w++;
-            val_pid->bytes_w += valp->sz;
-        }
-        val_pid->sum_ts_deltas += delta_us;
-        val_pid->pid = pid;
-    }
+    return account_rw(pid, type, val.sz, delta_us, val.dev, val.ino, val.de);
+}
+
+int trace_read_return(struct pt_regs *ctx) {
+    return trace_rw_return(ctx, 0);
+}
+int trace_write_return(struct pt_regs *ctx) {
+    return trace_rw_return(ctx, 1);
+}
+#endif
+
+static inline int invalidate_file(struct dentry *de) {
+    struct inode *inode = NULL;
+    bpf_probe_read(&inode, sizeof(inode), &de->d_inode);
+    if (inode == NULL)
+        return 0;
+    umode_t mode = 0;
+    bpf_probe_read(&mode, sizeof(mode), &inode->i_mode);
+    if (!S_ISREG(mode))
+        return 0;
+
+    struct super_block *sb = NULL;
+    bpf_probe_read(&sb, sizeof(sb), &inode->i_sb);
+    dev_t dev = 0;
+    bpf_probe_read(&dev, sizeof(dev), &sb->s_dev);
 
     struct key_file_t file_key = {};
-    bpf_probe_read(&file_key.name, sizeof(file_key.name), valp->name);
-    bpf_probe_read(&file_key.parent1, sizeof(file_key.parent1), valp->parent1);
-    bpf_probe_read(&file_key.parent2, sizeof(file_key.parent2), valp->parent2);
+    file_key.dev = dev;
+    bpf_probe_read(&file_key.ino, sizeof(file_key.ino), &inode->i_ino);
+    u8 one = 1;
+    invalidated_files.update(&file_key, &one);
+    return 0;
+}
 
-    struct val_file_t *val_file, zero_file = {};
-    val_file = counts_by_file.lookup_or_init(&file_key, &zero_file);
+/**
+ * A rename moves dentry and, if the destination existed, drops the file
+ * of target
+ */
+int trace_d_move(struct pt_regs *ctx, struct dentry *dentry, struct dentry *target) {
+    invalidate_file(dentry);
+    return invalidate_file(target);
+}
+int trace_d_delete(struct pt_regs *ctx, struct dentry *dentry) {
+    return invalidate_file(dentry);
+}
 
-    if (val_file) {
-        if (type == 0) {
-            val_file->num_r++;
-            val_file->bytes_r += valp->sz;
+#ifdef BLOCK_IO
+/**
+ * Block layer I/O: requests are timed from issue to completion, so page
+ * cache hits are not counted. Latencies go in log2 histograms (slots of
+ * bpf_log2l(us)) keyed by cgroup and device, bytes and counts are kept per
+ * cgroup and device in block_counts (slot 0). With BIO_BLKG the cgroup is
+ * the one the bio is charged to, so writeback is charged to the cgroup that
+ * dirtied the pages. Otherwise, and for bios without a blkg, it is the
+ * cgroup of the task that issues the request
+ */
+#include <linux/blk-mq.h>
+#ifdef BIO_BLKG
+#include <linux/blk-cgroup.h>
+#endif
+
+struct block_start_t {
+    u64 ts;
+    u64 cgroup_id;
+    u32 len;
+    u32 cmd_flags;
+};
+
+struct block_key_t {
+    u64 cgroup_id;
+    u32 dev;
+    u32 slot;
+};
+
+struct block_val_t {
+    u64 num_r;
+    u64 num_w;
+    u64 bytes_r;
+    u64 bytes_w;
+};
+
+BPF_HASH(block_start, struct request *, struct block_start_t, 10240);
+BPF_HASH(block_latency, struct block_key_t, u64);
+BPF_HASH(block_counts, struct block_key_t, struct block_val_t);
+
+static inline u64 request_cgroup_id(struct request *rq) {
+#ifdef BIO_BLKG
+    struct bio *bio = NULL;
+    struct blkcg_gq *blkg = NULL;
+    struct blkcg *blkcg = NULL;
+    struct cgroup *cgrp = NULL;
+    struct kernfs_node *kn = NULL;
+    u64 id = 0;
+    bpf_probe_read(&bio, sizeof(bio), &rq->bio);
+    if (bio != NULL)
+        bpf_probe_read(&blkg, sizeof(blkg), &bio->bi_blkg);
+    if (blkg != NULL)
+        bpf_probe_read(&blkcg, sizeof(blkcg), &blkg->blkcg);
+    if (blkcg != NULL)
+        bpf_probe_read(&cgrp, sizeof(cgrp), &blkcg->css.cgroup);
+    if (cgrp != NULL)
+        bpf_probe_read(&kn, sizeof(kn), &cgrp->kn);
+    // kn->id is a u64 from linux 5.5, before it is a union whose u64 is
+    // the same value returned by bpf_get_current_cgroup_id
+    if (kn != NULL)
+        bpf_probe_read(&id, sizeof(id), &kn->id);
+    if (id != 0)
+        return id;
+#endif
+    return bpf_get_current_cgroup_id();
+}
+
+static inline int block_io_start(struct request *rq) {
+    struct block_start_t start = {};
+    start.ts = bpf_ktime_get_ns();
+    start.cgroup_id = request_cgroup_id(rq);
+    // bytes are read now, at completion __data_len is already 0
+    bpf_probe_read(&start.len, sizeof(start.len), &rq->__data_len);
+    bpf_probe_read(&start.cmd_flags, sizeof(start.cmd_flags), &rq->cmd_flags);
+    block_start.update(&rq, &start);
+    return 0;
+}
+
+static inline int block_io_done(struct request *rq) {
+    struct block_start_t *startp = block_start.lookup(&rq);
+    if (startp == NULL)
+        return 0;
+    struct block_start_t start = *startp;
+    block_start.delete(&rq);
+
+    // discard, flush and other requests that do not move data
+    u32 op = start.cmd_flags & REQ_OP_MASK;
+    if (op != REQ_OP_READ && op != REQ_OP_WRITE)
+        return 0;
+
+    struct gendisk *disk = NULL;
+#ifdef RQ_DISK
+    bpf_probe_read(&disk, sizeof(disk), &rq->rq_disk);
+#else
+    struct request_queue *q = NULL;
+    bpf_probe_read(&q, sizeof(q), &rq->q);
+    bpf_probe_read(&disk, sizeof(disk), &q->disk);
+#endif
+    int major = 0;
+    int first_minor = 0;
+    if (disk != NULL) {
+        bpf_probe_read(&major, sizeof(major), &disk->major);
+        bpf_probe_read(&first_minor, sizeof(first_minor), &disk->first_minor);
+    }
+
+    struct block_key_t key = {};
+    key.cgroup_id = start.cgroup_id;
+    // same encoding of s_dev
+    key.dev = major << 20 | first_minor;
+
+    struct block_val_t *val, zero = {};
+    val = block_counts.lookup_or_init(&key, &zero);
+    if (val) {
+        if (op == REQ_OP_READ) {
+            lock_xadd(&val->num_r, 1);
+            lock_xadd(&val->bytes_r, start.len);
         } else {
-            val_file->num_w++;
-            val_file->bytes_w += valp->sz;
+            lock_xadd(&val->num_w, 1);
+            lock_xadd(&val->bytes_w, start.len);
         }
     }
+
+    key.slot = bpf_log2l((bpf_ktime_get_ns() - start.ts) / 1000);
+    block_latency.increment(key);
     return 0;
 }
 
-int trace_read_return(struct pt_regs *ctx) {
-    return trace_rw_return(ctx, 0);
+#ifdef BLOCK_IO_TRACEPOINTS
+RAW_TRACEPOINT_PROBE(block_io_start) {
+    return block_io_start((struct request *)ctx->args[0]);
 }
-int trace_write_return(struct pt_regs *ctx) {
-    return trace_rw_return(ctx, 1);
+RAW_TRACEPOINT_PROBE(block_io_done) {
+    return block_io_done((struct request *)ctx->args[0]);
+}
+#else
+int trace_block_start(struct pt_regs *ctx, struct request *rq) {
+    return block_io_start(rq);
+}
+int trace_block_done(struct pt_regs *ctx, struct request *rq) {
+    return block_io_done(rq);
 }
+#endif
+#endif
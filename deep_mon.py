@@ -61,8 +61,17 @@ CONTEXT_SETTINGS = dict(
 @click.option('--memory_measure')
 @click.option('--disk_measure')
 @click.option('--file_measure')
-def main(window_mode, output_format, debug_mode, net_monitor, nat_trace, print_net_details, dynamic_tcp_client_port_masking, power_measure, memory_measure, disk_measure, file_measure):
-    monitor = MonitorMain(output_format, window_mode, debug_mode, net_monitor, nat_trace, print_net_details, dynamic_tcp_client_port_masking, power_measure, memory_measure, disk_measure, file_measure)
+@click.option('--columnar_sample')
+@click.option('--power_model')
+@click.option('--percpu_maps')
+@click.option('--cgroup_aggregation')
+@click.option('--memory_mode')
+@click.option('--vfs_probe_mode')
+@click.option('--net_table_size')
+@click.option('--http_path_templating')
+@click.option('--http_path_limit')
+def main(window_mode, output_format, debug_mode, net_monitor, nat_trace, print_net_details, dynamic_tcp_client_port_masking, power_measure, memory_measure, disk_measure, file_measure, columnar_sample, power_model, percpu_maps, cgroup_aggregation, memory_mode, vfs_probe_mode, net_table_size, http_path_templating, http_path_limit):
+    monitor = MonitorMain(output_format, window_mode, debug_mode, net_monitor, nat_trace, print_net_details, dynamic_tcp_client_port_masking, power_measure, memory_measure, disk_measure, file_measure, columnar_sample, power_model, percpu_maps, cgroup_aggregation, memory_mode, vfs_probe_mode, net_table_size, http_path_templating, http_path_limit)
     if output_format == 'curses':
         curse = Curse(monitor, power_measure, net_monitor, memory_measure, disk_measure, file_measure)
         curse.start()
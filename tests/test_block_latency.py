@@ -0,0 +1,45 @@
+"""
+    DEEP-mon
+    Copyright (C) 2020  Brondolin Rolando
+
+    This file is part of DEEP-mon
+
+    DEEP-mon is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DEEP-mon is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from userspace.block_latency import get_log2_percentile
+
+
+def test_empty_histogram():
+    assert get_log2_percentile({}, 50) == 0
+    assert get_log2_percentile({}, 99) == 0
+
+
+def test_single_slot_returns_its_upper_bound():
+    # slot 10 counts the latencies in [512, 1024) us
+    assert get_log2_percentile({10: 7}, 50) == 1.023
+    assert get_log2_percentile({10: 7}, 99) == 1.023
+
+
+def test_percentiles_of_a_spread_histogram():
+    histogram = {3: 50, 6: 40, 12: 9, 20: 1}
+    assert get_log2_percentile(histogram, 50) == 0.007
+    assert get_log2_percentile(histogram, 90) == 0.063
+    assert get_log2_percentile(histogram, 99) == 4.095
+    assert get_log2_percentile(histogram, 100) == 1048.575
+
+
+def test_slots_are_read_in_order():
+    assert get_log2_percentile({20: 1, 1: 99}, 50) == 0.001
+    assert get_log2_percentile({20: 1, 1: 99}, 99.5) == 1048.575
@@ -0,0 +1,92 @@
+"""
+    DEEP-mon
+    Copyright (C) 2020  Brondolin Rolando
+
+    This file is part of DEEP-mon
+
+    DEEP-mon is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DEEP-mon is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import random
+import pytest
+
+from userspace.container_info import ContainerInfo
+
+
+def incremental_weighted_threads(cpu_usages):
+    # estimate recomputed after every thread, as add_weighted_cpu_usage did
+    weighted_cpus = []
+    weighted_threads = 0
+    for cpu_usage in cpu_usages:
+        weighted_cpus.append(cpu_usage)
+        max = 0
+        for usage in weighted_cpus:
+            if max < usage:
+                max = usage
+        maxes = 0
+        bin = 0
+        for usage in weighted_cpus:
+            bin = bin + usage
+            if bin >= max:
+                maxes = maxes + 1
+                bin = bin - max
+        weighted_threads = maxes
+    return weighted_threads
+
+
+def random_usages(rnd, count):
+    return [rnd.choice([0, 0.0, 50.0, rnd.random() * 100]) for _ in range(count)]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_weighted_threads_match_incremental_computation(seed):
+    rnd = random.Random(seed)
+    for count in list(range(0, 30)) + [300]:
+        usages = random_usages(rnd, count)
+        container = ContainerInfo("container")
+        for pid, usage in enumerate(usages):
+            container.add_pid(pid)
+            container.set_weighted_cpu_usage(pid, usage)
+        assert container.get_weighted_threads() == incremental_weighted_threads(usages)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_weighted_threads_count_idle_pids(seed):
+    # pids without cpu usage in the sample were added with zero usage
+    rnd = random.Random(seed)
+    for count in range(0, 30):
+        usages = random_usages(rnd, count)
+        idle_pids = rnd.randint(0, 5)
+        container = ContainerInfo("container")
+        for pid, usage in enumerate(usages):
+            container.add_pid(pid)
+            container.set_weighted_cpu_usage(pid, usage)
+        for pid in range(count, count + idle_pids):
+            container.add_pid(pid)
+        expected = incremental_weighted_threads(usages + [0] * idle_pids)
+        assert container.get_weighted_threads() == expected
+
+
+def test_weighted_threads_recomputed_after_new_usage():
+    container = ContainerInfo("container")
+    container.add_pid(1)
+    container.set_weighted_cpu_usage(1, 50.0)
+    assert container.get_weighted_threads() == 1
+    container.add_pid(2)
+    container.set_weighted_cpu_usage(2, 50.0)
+    assert container.get_weighted_threads() == 2
+    container.set_weighted_cpu_usage(2, 0)
+    assert container.get_weighted_threads() == 1
+    container.remove_pid(1)
+    assert container.get_weighted_threads() == 1
@@ -0,0 +1,234 @@
+"""
+    DEEP-mon
+    Copyright (C) 2020  Brondolin Rolando
+
+    This file is part of DEEP-mon
+
+    DEEP-mon is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DEEP-mon is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import docker
+import pytest
+import threading
+
+from userspace.container_metadata import ContainerMetadataCache
+
+CONTAINER_A = "a" * 64
+CONTAINER_B = "b" * 64
+
+
+class FakeImage:
+
+    def __init__(self, image_id):
+        self.image_id = image_id
+
+    def __str__(self):
+        return "<Image: '" + self.image_id + "'>"
+
+
+class FakeImages:
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, image_id):
+        self.client.calls.append(("images.get", image_id))
+        return FakeImage(image_id)
+
+    def prepare_model(self, image):
+        return FakeImage(image["Id"])
+
+
+class FakeEvents:
+
+    def __init__(self, client, events, error=None):
+        self.client = client
+        self.events = events
+        self.error = error
+        self.closed = threading.Event()
+
+    def __iter__(self):
+        # callables change the containers while the stream is read
+        for event in self.events:
+            if callable(event):
+                event()
+            else:
+                yield event
+        if self.error is not None:
+            raise self.error
+        # the stream stays open until the cache is stopped
+        self.client.idle.set()
+        self.closed.wait()
+
+    def close(self):
+        self.closed.set()
+
+
+class FakeAPI:
+
+    def __init__(self, client):
+        self.client = client
+
+    def images(self):
+        return [{"Id": "image-1"}]
+
+    def containers(self, all=False):
+        self.client.calls.append(("containers",))
+        return [{"Id": container_id, "Names": ["/" + container["name"]],
+                 "ImageID": container["image"], "Labels": container["labels"]}
+                for container_id, container in self.client.containers.items()]
+
+    def inspect_container(self, container_id):
+        self.client.calls.append(("inspect_container", container_id))
+        for full_id, container in self.client.containers.items():
+            if full_id.startswith(container_id):
+                return {"Name": "/" + container["name"], "Image": container["image"],
+                        "Config": {"Labels": container["labels"]}}
+        raise docker.errors.NotFound("no such container: " + container_id)
+
+
+class FakeDockerClient:
+
+    def __init__(self, events=None, error=None):
+        self.containers = {}
+        self.calls = []
+        self.api = FakeAPI(self)
+        self.images = FakeImages(self)
+        self.idle = threading.Event()
+        # the streams returned by the next connections
+        self.stream = FakeEvents(self, events or [], error)
+        self.streams = [self.stream]
+
+    def add_container(self, container_id, name, labels=None):
+        self.containers[container_id] = {"name": name, "image": "image-1",
+                                         "labels": labels or {}}
+
+    def events(self, decode=False, filters=None):
+        self.calls.append(("events",))
+        if len(self.streams) > 0:
+            return self.streams.pop(0)
+        return FakeEvents(self, [])
+
+    def inspect_count(self, container_id):
+        return self.calls.count(("inspect_container", container_id))
+
+
+def event(action, container_id):
+    return {"Type": "container", "Action": action, "id": container_id}
+
+
+def start_cache(client, missing_ttl=60):
+    # one worker, the fetches are done in order
+    cache = ContainerMetadataCache(client, max_workers=1, missing_ttl=missing_ttl, retry_delay=0)
+    cache.start()
+    # wait until the events have been read
+    assert client.idle.wait(5)
+    wait_fetches(cache)
+    return cache
+
+
+def wait_fetches(cache):
+    cache.executor.submit(lambda: None).result(5)
+
+
+def test_warm_cache_hits_without_docker_calls():
+    client = FakeDockerClient()
+    client.add_container(CONTAINER_A, "web", {"tier": "front"})
+    cache = start_cache(client)
+    calls = len(client.calls)
+
+    metadata = cache.get(CONTAINER_A[0:12])
+    assert metadata.get_name() == "web"
+    assert metadata.get_image() == "<Image: 'image-1'>"
+    assert metadata.get_labels() == {"tier": "front"}
+    assert cache.get(CONTAINER_A[0:12]) is metadata
+    assert cache.get_hit_count() == 2
+    assert cache.get_miss_count() == 0
+    assert len(client.calls) == calls
+
+
+def test_unknown_container_is_fetched_once_in_background():
+    client = FakeDockerClient()
+    cache = start_cache(client)
+    client.add_container(CONTAINER_B, "db")
+
+    assert cache.get(CONTAINER_B[0:12]) is None
+    wait_fetches(cache)
+    assert cache.get(CONTAINER_B[0:12]).get_name() == "db"
+    assert client.inspect_count(CONTAINER_B[0:12]) == 1
+    assert cache.get_miss_count() == 1
+
+
+@pytest.mark.parametrize("action", ["start", "rename"])
+def test_update_events_refresh_metadata(action):
+    client = FakeDockerClient()
+    client.add_container(CONTAINER_A, "web", {"version": "1"})
+    # the container changes after the cache has been warmed
+    client.stream.events.append(lambda: client.add_container(CONTAINER_A, "web-2", {"version": "2"}))
+    client.stream.events.append(event(action, CONTAINER_A))
+    cache = start_cache(client)
+
+    assert client.inspect_count(CONTAINER_A[0:12]) == 1
+    metadata = cache.get(CONTAINER_A[0:12])
+    assert metadata.get_name() == "web-2"
+    assert metadata.get_labels() == {"version": "2"}
+
+
+def test_die_event_drops_metadata():
+    client = FakeDockerClient(events=[event("die", CONTAINER_A)])
+    client.add_container(CONTAINER_A, "web")
+    cache = start_cache(client)
+
+    # dropped by the event, fetched again on lookup
+    assert cache.get(CONTAINER_A[0:12]) is None
+    wait_fetches(cache)
+    assert cache.get(CONTAINER_A[0:12]).get_name() == "web"
+    assert client.inspect_count(CONTAINER_A[0:12]) == 1
+
+
+def test_events_stream_reconnects_and_warms_again():
+    client = FakeDockerClient(events=[event("start", CONTAINER_A)],
+                              error=docker.errors.APIError("stream closed"))
+    client.add_container(CONTAINER_A, "web")
+    # created while the stream is down, its events are lost
+    client.stream.events.append(lambda: client.add_container(CONTAINER_B, "db"))
+    cache = start_cache(client)
+
+    assert client.calls.count(("events",)) == 2
+    assert client.calls.count(("containers",)) == 2
+    assert cache.get(CONTAINER_B[0:12]).get_name() == "db"
+    assert client.inspect_count(CONTAINER_B[0:12]) == 0
+
+    cache.stop()
+    cache.events_thread.join(5)
+    assert not cache.events_thread.is_alive()
+
+
+def test_missing_container_is_not_fetched_again_until_ttl():
+    client = FakeDockerClient()
+    cache = start_cache(client)
+
+    assert cache.get(CONTAINER_B[0:12]) is None
+    wait_fetches(cache)
+    assert cache.get(CONTAINER_B[0:12]) is None
+    wait_fetches(cache)
+    assert client.inspect_count(CONTAINER_B[0:12]) == 1
+
+    # fetched again once the failure has expired
+    client.add_container(CONTAINER_B, "db")
+    cache.missing_ttl = 0
+    assert cache.get(CONTAINER_B[0:12]) is None
+    wait_fetches(cache)
+    assert cache.get(CONTAINER_B[0:12]).get_name() == "db"
+    assert client.inspect_count(CONTAINER_B[0:12]) == 2
@@ -0,0 +1,178 @@
+"""
+    DEEP-mon
+    Copyright (C) 2020  Brondolin Rolando
+
+    This file is part of DEEP-mon
+
+    DEEP-mon is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DEEP-mon is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import random
+import pytest
+
+from userspace.container_info import ContainerInfo
+from userspace.process_info import ProcessInfo
+from userspace.process_info import SocketProcessItem
+from userspace.process_table import ProcTable
+from userspace.container_metadata import ContainerMetadata
+
+IDLE_KEYS = [-1, -2, -3]
+
+
+class FakeResolver:
+
+    def __init__(self):
+        self.containers = {}
+
+    def resolve(self, pid, tgid=None):
+        if pid < 0:
+            return "----idle----"
+        return self.containers[pid]
+
+    def forget(self, pids):
+        pass
+
+
+class FakeMetadata:
+
+    def __init__(self):
+        self.metadata = {}
+
+    def get(self, container_id):
+        return self.metadata.get(container_id)
+
+
+class FakeSample:
+
+    def __init__(self, pid_dict):
+        self.pid_dict = pid_dict
+
+    def get_pid_dict(self):
+        return self.pid_dict
+
+    def get_columnar_sample(self):
+        return None
+
+
+def new_process(rnd, key, comm, ts):
+    proc_info = ProcessInfo(2)
+    proc_info.set_pid(0 if key < 0 else key)
+    proc_info.set_tgid(proc_info.get_pid())
+    proc_info.set_comm(comm)
+    proc_info.set_cycles(rnd.randint(0, 1000))
+    proc_info.set_instruction_retired(rnd.randint(0, 1000))
+    proc_info.set_cache_misses(rnd.randint(0, 100))
+    proc_info.set_cache_refs(rnd.randint(0, 100))
+    proc_info.set_time_ns(rnd.randint(0, 1000000))
+    # multiples of 0.5 keep the sums exact
+    proc_info.set_cpu_usage(rnd.choice([0, 0.5, 1.0, 25.0, 50.0, 100.0]))
+    proc_info.set_power(rnd.randint(0, 20) * 0.5)
+    proc_info.set_package_power(rnd.randint(0, 20) * 0.5)
+    proc_info.set_dram_power(rnd.randint(0, 20) * 0.5)
+    # processes that did not run for a while expire by timestamp
+    last_ts = ts - rnd.choice([0, 0, 0, 0, 9000000000])
+    proc_info.set_socket_data(0, SocketProcessItem(rnd.randint(0, 1000), last_ts))
+    proc_info.set_socket_data(1, SocketProcessItem(rnd.randint(0, 1000), last_ts))
+    return proc_info
+
+
+def rebuild_containers(proc_table):
+    # containers of the process table built from scratch
+    containers = {}
+    for key, proc_info in proc_table.items():
+        if proc_info.container_id == "":
+            continue
+        container = containers.get(proc_info.container_id)
+        if container is None:
+            container = ContainerInfo(proc_info.container_id)
+            containers[proc_info.container_id] = container
+        container.add_cycles(proc_info.get_cycles())
+        container.add_weighted_cycles(proc_info.get_aggregated_weighted_cycles())
+        container.add_instructions(proc_info.get_instruction_retired())
+        container.add_cache_misses(proc_info.get_cache_misses())
+        container.add_cache_refs(proc_info.get_cache_refs())
+        container.add_time_ns(proc_info.get_time_ns())
+        container.add_power(proc_info.get_power())
+        container.add_package_power(proc_info.get_package_power())
+        container.add_dram_power(proc_info.get_dram_power())
+        container.add_cpu_usage(proc_info.get_cpu_usage())
+        container.add_pid(key)
+        container.set_weighted_cpu_usage(key, proc_info.get_cpu_usage())
+        container.set_last_ts(proc_info.get_last_ts())
+    return containers
+
+
+def container_metrics(container):
+    return (container.get_cycles(), container.get_weighted_cycles(),
+            container.get_instruction_retired(), container.get_cache_misses(),
+            container.get_cache_refs(), container.get_time_ns(),
+            container.get_power(), container.get_package_power(),
+            container.get_dram_power(), container.get_cpu_usage(),
+            sorted(container.get_pid_set()), container.get_timestamp(),
+            container.get_weighted_threads())
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_incremental_containers_match_rebuild(seed):
+    rnd = random.Random(seed)
+    resolver = FakeResolver()
+    table = ProcTable(resolver, FakeMetadata())
+    comms = {}
+    previous_keys = set()
+
+    for tick in range(1, 200):
+        ts = (tick + 100) * 1000000000
+        table.reset_metrics_and_evict_stale_processes(ts)
+
+        keys = rnd.sample(range(0, 40), rnd.randint(0, 25))
+        keys = keys + rnd.sample(IDLE_KEYS, rnd.randint(0, len(IDLE_KEYS)))
+        pid_dict = {}
+        for key in keys:
+            if key not in comms or rnd.random() < 0.1:
+                # new process, or pid reused by another process that can
+                # be in another container
+                comms[key] = "comm-%d" % rnd.randint(0, 1000)
+                resolver.containers[key] = rnd.choice(["c1", "c2", "c3", ""])
+            pid_dict[key] = new_process(rnd, key, comms[key], ts)
+        table.add_process_from_sample(FakeSample(pid_dict))
+        containers = table.get_container_dictionary()
+
+        # only the processes of the last two samples are in the table
+        assert set(table.get_proc_table()) <= set(keys) | previous_keys
+        previous_keys = set(keys)
+
+        expected = rebuild_containers(table.get_proc_table())
+        assert sorted(containers) == sorted(expected)
+        for container_id, container in containers.items():
+            assert container_metrics(container) == container_metrics(expected[container_id])
+
+
+def test_container_metadata_follows_renames():
+    metadata = FakeMetadata()
+    resolver = FakeResolver()
+    resolver.containers[1] = "c1"
+    table = ProcTable(resolver, metadata)
+
+    metadata.metadata["c1"] = ContainerMetadata("c1", "web", "image", {"version": "1"})
+    table.reset_metrics_and_evict_stale_processes(1000000000)
+    table.add_process_from_sample(FakeSample({1: new_process(random.Random(0), 1, "web", 1000000000)}))
+    assert table.get_container_dictionary()["c1"].get_container_name() == "web"
+
+    metadata.metadata["c1"] = ContainerMetadata("c1", "web-2", "image", {"version": "2"})
+    table.reset_metrics_and_evict_stale_processes(2000000000)
+    table.add_process_from_sample(FakeSample({1: new_process(random.Random(1), 1, "web", 2000000000)}))
+    container = table.get_container_dictionary()["c1"]
+    assert container.get_container_name() == "web-2"
+    assert container.get_container_labels() == {"version": "2"}
@@ -0,0 +1,33 @@
+"""
+    DEEP-mon
+    Copyright (C) 2020  Brondolin Rolando
+
+    This file is part of DEEP-mon
+
+    DEEP-mon is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DEEP-mon is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+def get_log2_percentile(histogram, percentile):
+    # histogram is slot -> count, slot s counts the latencies in
+    # [2^(s-1), 2^s) us. Return the upper bound of the slot of the
+    # percentile, in ms
+    total = sum(histogram.values())
+    threshold = total * percentile / 100.0
+    count = 0
+    for slot in sorted(histogram):
+        count = count + histogram[slot]
+        if count >= threshold:
+            return float((1 << slot) - 1) / 1000
+    return 0
@@ -24,6 +24,9 @@ from .proc_topology import ProcTopology
 from .process_info import BpfPidStatus
 from .process_info import SocketProcessItem
 from .process_info import ProcessInfo
+from .columnar_sample import ColumnarSample
+from .container_resolver import ContainerResolver
+from .power_attribution import PowerAttributionEngine
 from .sample_controller import SampleController
 import ctypes as ct
 import json
@@ -48,7 +51,8 @@ class bcolors:
 class BpfSample:
 
     def __init__(self, max_ts, total_time, sched_switch_count, timeslice,
-                 total_active_power, pid_dict, cpu_cores):
+                 total_active_power, pid_dict, cpu_cores, columnar_sample=None,
+                 pid_map_entries=0, pid_map_max_entries=0):
         self.max_ts = max_ts
         self.total_execution_time = total_time
         self.sched_switch_count = sched_switch_count
@@ -56,6 +60,9 @@ class BpfSample:
         self.total_active_power = total_active_power
         self.pid_dict = pid_dict
         self.cpu_cores = cpu_cores
+        self.columnar_sample = columnar_sample
+        self.pid_map_entries = pid_map_entries
+        self.pid_map_max_entries = pid_map_max_entries
 
     def get_max_ts(self):
         return self.max_ts
@@ -73,15 +80,30 @@ class BpfSample:
         return self.total_active_power
 
     def get_pid_dict(self):
+        # columnar samples build the ProcessInfo views only when asked
+        if self.pid_dict is None and self.columnar_sample is not None:
+            self.pid_dict = self.columnar_sample.get_pid_dict()
         return self.pid_dict
 
+    def get_columnar_sample(self):
+        return self.columnar_sample
+
+    def get_pid_map_entries(self):
+        return self.pid_map_entries
+
+    def get_pid_map_occupancy(self):
+        # fraction of the pids map in use
+        if self.pid_map_max_entries > 0:
+            return float(self.pid_map_entries) / self.pid_map_max_entries
+        return 0.0
+
     def get_cpu_cores(self):
         return self.cpu_cores
 
     def __str__(self):
         str_representation = ""
 
-        for key, value in sorted(self.pid_dict.items()):
+        for key, value in sorted(self.get_pid_dict().items()):
             str_representation = str_representation + str(value) + "\n"
 
         str_representation = str_representation + self.get_log_line()
@@ -96,6 +118,7 @@ class BpfSample:
         d["TOTAL PACKAGE ACTIVE POWER"] = "{:.3f}".format(self.total_active_power["package"])
         d["TOTAL CORE ACTIVE POWER"] = "{:.3f}".format(self.total_active_power["core"])
         d["TOTAL DRAM ACTIVE POWER"] = "{:.3f}".format(self.total_active_power["dram"])
+        d["PID MAP OCCUPANCY"] = "{:.1f}%".format(self.get_pid_map_occupancy() * 100)
         return d
 
     def get_log_line(self):
@@ -112,17 +135,23 @@ class BpfSample:
                 + "{:.3f}".format(self.total_active_power["core"])
                 + "\n\t" + bcolors.GREEN + "TOTAL DRAM ACTIVE POWER:\t" + bcolors.ENDC
                 + "{:.3f}".format(self.total_active_power["dram"])
+                + "\n\t" + bcolors.YELLOW + "PID MAP OCCUPANCY:\t\t" + bcolors.ENDC
+                + str(self.pid_map_entries) + "/" + str(self.pid_map_max_entries)
                 )
         return str_representation
 
-    def get_log_json(self):
+    def get_log_json(self, net_map_stats=None):
         d = {"PROC TIME": str(self.total_execution_time),
              "SCHED SWITCH COUNT": str(self.sched_switch_count),
              "TIMESLICE": str(self.timeslice),
              "TOTAL PACKAGE ACTIVE POWER": str(self.total_active_power["package"]),
              "TOTAL CORE ACTIVE POWER": str(self.total_active_power["core"]),
-             "TOTAL DRAM ACTIVE POWER": str(self.total_active_power["dram"])
+             "TOTAL DRAM ACTIVE POWER": str(self.total_active_power["dram"]),
+             "PID MAP ENTRIES": str(self.pid_map_entries),
+             "PID MAP OCCUPANCY": str(self.get_pid_map_occupancy())
              }
+        if net_map_stats is not None:
+            d["NET MAP STATS"] = net_map_stats
         return json.dumps(d, indent=4)
 
 
@@ -141,37 +170,68 @@ class BPFErrors:
 
 class BpfCollector:
 
-    def __init__(self, topology, debug, power_measure):
+    def __init__(self, topology, debug, power_measure, columnar_sample=False, power_model=None, percpu_maps=False, loader=None, cgroup_aggregation=False, container_resolver=None):
         self.topology = topology
         self.debug = debug
         self.power_measure = power_measure
-        bpf_code_path = os.path.dirname(os.path.abspath(__file__)) \
-                        + "/../bpf/bpf_monitor.c"
+        self.columnar_sample = columnar_sample
+        self.percpu_maps = percpu_maps
+        self.cgroup_aggregation = cgroup_aggregation
+        if container_resolver is None:
+            container_resolver = ContainerResolver()
+        self.container_resolver = container_resolver
+        self.power_attribution = PowerAttributionEngine(power_model)
+        cflags = ["-DNUM_CPUS=%d" % multiprocessing.cpu_count(), \
+            "-DNUM_SOCKETS=%d" % len(self.topology.get_sockets())]
         if debug is False:
             if self.power_measure == True:
-                self.bpf_program = BPF(src_file=bpf_code_path, \
-                    cflags=["-DNUM_CPUS=%d" % multiprocessing.cpu_count(), \
-                    "-DNUM_SOCKETS=%d" % len(self.topology.get_sockets()), \
-                    "-DPERFORMANCE_COUNTERS"])
-            else:
-                self.bpf_program = BPF(src_file=bpf_code_path, \
-                    cflags=["-DNUM_CPUS=%d" % multiprocessing.cpu_count(), \
-                    "-DNUM_SOCKETS=%d" % len(self.topology.get_sockets())])
+                cflags.append("-DPERFORMANCE_COUNTERS")
         else:
-            self.bpf_program = BPF(src_file=bpf_code_path, \
-                cflags=["-DNUM_CPUS=%d" % multiprocessing.cpu_count(), \
-                "-DNUM_SOCKETS=%d" % len(self.topology.get_sockets()), \
-                "-DDEBUG"])
+            cflags.append("-DDEBUG")
+        if self.percpu_maps == True:
+            cflags.append("-DPERCPU_MAPS")
+        if self.cgroup_aggregation == True:
+            cflags.append("-DCGROUP_AGGREGATION")
+        if loader is not None:
+            self.bpf_program = loader.load("bpf_monitor.c", cflags)
+        else:
+            bpf_code_path = os.path.dirname(os.path.abspath(__file__)) \
+                            + "/../bpf/bpf_monitor.c"
+            self.bpf_program = BPF(src_file=bpf_code_path, cflags=cflags)
 
         self.processors = self.bpf_program.get_table("processors")
         self.pids = self.bpf_program.get_table("pids")
         self.idles = self.bpf_program.get_table("idles")
+        self.exited_pids = self.bpf_program.get_table("exited_pids")
         self.bpf_config = self.bpf_program.get_table("conf")
         self.bpf_global_timestamps = self.bpf_program.get_table("global_timestamps")
+        if self.percpu_maps == True:
+            self.bpf_switch_counts = self.bpf_program.get_table("switch_counts")
+        if self.cgroup_aggregation == True:
+            self.cgroups = self.bpf_program.get_table("cgroups")
         self.selector = 0
         self.SELECTOR_DIM = 2
         self.timeslice = 1000000000
         self.timed_capture = False
+        # BPF_MAP_LOOKUP_BATCH and BPF_MAP_DELETE_BATCH are available from
+        # kernel 5.6, and not for every map type. We find out at the first
+        # snapshot of each table if we have to fall back to a plain map walk
+        self.batch_lookup_unsupported = set()
+        self.batch_delete_unsupported = set()
+
+        # Every sweep_interval samples, remove from the pids map the threads
+        # that have not been scheduled in the last stale_windows windows
+        self.sweep_interval = 10
+        self.stale_windows = 10
+        self.sample_count = 0
+        self.pid_map_entries = 0
+        # pids that exited or were swept in the last sample
+        self.gone_pids = []
+
+        # With cgroup aggregation each cgroup is reported as a thread with a
+        # negative key, below the ones used for the idle cores
+        self.cgroup_keys = {}
+        self.next_cgroup_key = -1 * (1 + multiprocessing.cpu_count())
 
         #self.bpf_program["cpu_cycles"].open_perf_event(PerfType.HARDWARE, \
         #    PerfHWConfig.CPU_CYCLES)
@@ -271,15 +331,13 @@ class BpfCollector:
 
     def _get_new_sample(self, rapl_monitor):
 
+        self.container_resolver.forget(self.gone_pids)
+        self.gone_pids = []
+
         total_execution_time = 0.0
-        sched_switch_count = self.bpf_config[ct.c_int(3)].value
+        sched_switch_count = self._get_switch_count()
         tsmax = 0
 
-        # Initialize the weighted cycles for each core to 0
-        total_weighted_cycles = []
-        for socket in self.topology.get_sockets():
-            total_weighted_cycles.append(0)
-
         # We use a binary selector so that while userspace is reading events
         # using selector 0 we write events using selector 1 and vice versa.
         # Here we initialize it to 0 and set the number of slots used for
@@ -312,34 +370,44 @@ class BpfCollector:
 
         pid_dict = {}
 
-        tsmax = self.bpf_global_timestamps[ct.c_int(read_selector)].value
-
-
-        # Add the count of clock cycles for each active process to the total
-        # number of clock cycles of the socket
-        for key, data in self.pids.items():
-            if data.ts[read_selector] + self.timeslice > tsmax:
-                total_execution_time = total_execution_time + float(data.time_ns[read_selector])/1000000
+        if self.percpu_maps == True:
+            tsmax = self.bpf_global_timestamps.max(ct.c_int(read_selector)).value
+        else:
+            tsmax = self.bpf_global_timestamps[ct.c_int(read_selector)].value
+
+        # Copy the maps once, both the totals and the attribution passes
+        # below work on the same in-memory snapshot
+        idles_snapshot = self._snapshot_table(self.idles)
+        self.sample_count = self.sample_count + 1
+        sweep = self.sample_count % self.sweep_interval == 0
+
+        if self.cgroup_aggregation == True:
+            # one entry per cgroup, the pids map is read only by the sweep
+            pids_snapshot = self._get_cgroup_snapshot(read_selector, tsmax)
+            if sweep:
+                for key in self._sweep_stale_entries(self.cgroups, pids_snapshot, tsmax):
+                    self.container_resolver.remove_aggregate_key(self.cgroup_keys.pop(key.value))
+                threads_snapshot = self._snapshot_table(self.pids)
+                if self.percpu_maps == True:
+                    threads_snapshot = self._merge_percpu_snapshot(threads_snapshot, read_selector, tsmax)
+                self.pid_map_entries = len(threads_snapshot)
+                self._forget_pids(self._sweep_stale_entries(self.pids, threads_snapshot, tsmax))
+            # the counters of the exited threads are in their cgroup entry
+            exited_pids = self._snapshot_table(self.exited_pids)
+            self._delete_keys(self.exited_pids, [key for key, data in exited_pids])
+            self.gone_pids.extend([key.pid for key, data in exited_pids])
+        else:
+            pids_snapshot = self._snapshot_table(self.pids)
+            if self.percpu_maps == True:
+                pids_snapshot = self._merge_percpu_snapshot(pids_snapshot, read_selector, tsmax)
+            self.pid_map_entries = len(pids_snapshot)
 
-            if self.power_measure == True:
-                for multisocket_selector in range(read_selector, total_slots_length, self.SELECTOR_DIM):
-                    # Compute the number of total weighted cycles per socket
-                    cycles_index = int(multisocket_selector/self.SELECTOR_DIM)
-                    if data.ts[read_selector] + self.timeslice > tsmax:
-                        total_weighted_cycles[cycles_index] = total_weighted_cycles[cycles_index] + data.weighted_cycles[multisocket_selector]
-
-        # Add the count of clock cycles for each idle process to the total
-        # number of clock cycles of the socket
-        for key, data in self.idles.items():
-            if data.ts[read_selector] + self.timeslice > tsmax:
-                total_execution_time = total_execution_time + float(data.time_ns[read_selector])/1000000
+            if sweep:
+                self._forget_pids(self._sweep_stale_entries(self.pids, pids_snapshot, tsmax))
 
-            if self.power_measure == True:
-                for multisocket_selector in range(read_selector, total_slots_length, self.SELECTOR_DIM):
-                    # Compute the number of total weighted cycles per socket
-                    cycles_index = int(multisocket_selector/self.SELECTOR_DIM)
-                    if data.ts[read_selector] + self.timeslice > tsmax:
-                        total_weighted_cycles[cycles_index] = total_weighted_cycles[cycles_index] + data.weighted_cycles[multisocket_selector]
+            # threads that exited in the window are accounted like the live ones
+            self._add_exited_pids(pids_snapshot, read_selector, tsmax)
+        pid_map_entries = self.pid_map_entries
 
         if self.power_measure == True:
             # Compute package/core/dram power in mW from RAPL samples
@@ -355,13 +423,32 @@ class BpfCollector:
                     "dram": sum(dram_power)
                     }
         else:
+            package_power = []
+            core_power = []
+            dram_power = []
             total_power = {
                     "package": 0,
                     "core": 0,
                     "dram": 0
                     }
 
-        for key, data in self.pids.items():
+        if self.columnar_sample == True:
+            return self._get_columnar_sample(pids_snapshot, idles_snapshot,
+                read_selector, tsmax, sched_switch_count, total_power,
+                package_power, core_power, dram_power, pid_map_entries)
+
+        # Add the execution time of each active process (idle included) to
+        # the total execution time of the window. The weighted cycles per
+        # socket are totaled by the power model over the active processes
+        for key, data in pids_snapshot:
+            if data.ts[read_selector] + self.timeslice > tsmax:
+                total_execution_time = total_execution_time + float(data.time_ns[read_selector])/1000000
+
+        for key, data in idles_snapshot:
+            if data.ts[read_selector] + self.timeslice > tsmax:
+                total_execution_time = total_execution_time + float(data.time_ns[read_selector])/1000000
+
+        for key, data in pids_snapshot:
 
             proc_info = ProcessInfo(len(self.topology.get_sockets()))
             proc_info.set_pid(data.pid)
@@ -385,14 +472,9 @@ class BpfCollector:
 
             if add_proc:
                 pid_dict[data.pid] = proc_info
-
-                if self.power_measure == True:
-                    proc_info.set_power(self._get_pid_power(proc_info, total_weighted_cycles, core_power))
-                else:
-                    proc_info.set_power(0)
                 proc_info.compute_cpu_usage_millis(float(total_execution_time), multiprocessing.cpu_count())
 
-        for key, data in self.idles.items():
+        for key, data in idles_snapshot:
 
             proc_info = ProcessInfo(len(self.topology.get_sockets()))
             proc_info.set_pid(data.pid)
@@ -417,20 +499,206 @@ class BpfCollector:
 
             if add_proc:
                 pid_dict[-1 * (1 + int(key.value))] = proc_info
-                if self.power_measure == True:
-                    proc_info.set_power(self._get_pid_power(proc_info, total_weighted_cycles, core_power))
-                else:
-                    proc_info.set_power(0)
                 proc_info.compute_cpu_usage_millis(float(total_execution_time), multiprocessing.cpu_count())
 
-        return BpfSample(tsmax, total_execution_time, sched_switch_count, self.timeslice, total_power, pid_dict, self.topology.get_hyperthread_count())
+        if self.power_measure == True:
+            self._attribute_power(list(pid_dict.values()), package_power, core_power, dram_power)
+
+        return BpfSample(tsmax, total_execution_time, sched_switch_count,
+            self.timeslice, total_power, pid_dict,
+            self.topology.get_hyperthread_count(), None,
+            pid_map_entries, self.pids.max_entries)
+
+    def _get_columnar_sample(self, pids_snapshot, idles_snapshot, read_selector,
+            tsmax, sched_switch_count, total_power, package_power, core_power,
+            dram_power, pid_map_entries):
 
-    def _get_pid_power(self, pid, total_cycles, core_power):
+        columnar_sample = ColumnarSample(len(self.topology.get_sockets()))
+        columnar_sample.load_snapshot(pids_snapshot, idles_snapshot,
+            read_selector, self.SELECTOR_DIM, self.timeslice, tsmax)
 
-        pid_power = 0
-        for socket in self.topology.get_sockets():
-            if float(total_cycles[socket]) > 0:
-                pid_power = pid_power + (core_power[socket] * \
-                    (float(pid.get_socket_data(socket).get_weighted_cycles()) \
-                    / float(total_cycles[socket])))
-        return pid_power
+        total_execution_time = columnar_sample.get_total_execution_time()
+
+        if self.power_measure == True:
+            columnar_sample.set_power(self.power_attribution.attribute(
+                columnar_sample.get_weighted_cycles_matrix(),
+                columnar_sample.get_cache_misses(),
+                package_power, core_power, dram_power))
+
+        columnar_sample.compute_cpu_usage_millis(total_execution_time, multiprocessing.cpu_count())
+
+        return BpfSample(tsmax, total_execution_time, sched_switch_count,
+            self.timeslice, total_power, None,
+            self.topology.get_hyperthread_count(), columnar_sample,
+            pid_map_entries, self.pids.max_entries)
+
+    def _snapshot_table(self, table):
+        # Copy a whole bpf map in userspace with a single walk. When the kernel
+        # supports BPF_MAP_LOOKUP_BATCH the copy is done with batched syscalls,
+        # otherwise we fall back to a single items() pass over the map
+        if table.name not in self.batch_lookup_unsupported:
+            try:
+                return list(table.items_lookup_batch())
+            except Exception:
+                self.batch_lookup_unsupported.add(table.name)
+        return list(table.items())
+
+    def _get_switch_count(self):
+        # context switches of the window that is about to be read
+        if self.percpu_maps == True:
+            switch_count = 0
+            for cpu_count in self.bpf_switch_counts[ct.c_int(0)]:
+                if cpu_count.bpf_selector == self.selector:
+                    switch_count = switch_count + cpu_count.count
+            return switch_count
+        return self.bpf_config[ct.c_int(3)].value
+
+    def _merge_percpu_snapshot(self, snapshot, read_selector, tsmax):
+        # Each cpu holds a copy of pid_status for the threads (or cgroups)
+        # it has run. Copies that were not written in the window we are
+        # reading still hold counters of older windows, so they are left
+        # out of the sum
+        total_slots_length = len(self.topology.get_sockets())*self.SELECTOR_DIM
+        merged_snapshot = []
+        for key, cpu_values in snapshot:
+            merged = None
+            for data in cpu_values:
+                # copies of the cpus where the thread never ran are zeroed
+                if max(data.ts) == 0:
+                    continue
+                if merged is None:
+                    merged = type(data)()
+                    merged.pid = data.pid
+                    merged.tgid = data.tgid
+                    merged.comm = data.comm
+                    merged.bpf_selector = data.bpf_selector
+                for selector in range(self.SELECTOR_DIM):
+                    if merged.ts[selector] < data.ts[selector]:
+                        merged.ts[selector] = data.ts[selector]
+                if data.ts[read_selector] + self.timeslice > tsmax:
+                    merged.cycles[read_selector] += data.cycles[read_selector]
+                    merged.instruction_retired[read_selector] += data.instruction_retired[read_selector]
+                    merged.cache_misses[read_selector] += data.cache_misses[read_selector]
+                    merged.cache_refs[read_selector] += data.cache_refs[read_selector]
+                    merged.time_ns[read_selector] += data.time_ns[read_selector]
+                    for multisocket_selector in range(read_selector, total_slots_length, self.SELECTOR_DIM):
+                        merged.weighted_cycles[multisocket_selector] += data.weighted_cycles[multisocket_selector]
+            if merged is not None:
+                merged_snapshot.append((key, merged))
+        return merged_snapshot
+
+    def _delete_keys(self, table, keys):
+        # Delete a list of keys from a bpf map, with a single
+        # BPF_MAP_DELETE_BATCH syscall when the kernel supports it
+        if len(keys) == 0:
+            return
+        if table.name not in self.batch_delete_unsupported:
+            try:
+                table.items_delete_batch((type(keys[0]) * len(keys))(*keys))
+                return
+            except Exception:
+                # keys that are gone already fail the batch too, the rest
+                # is deleted one by one from now on
+                self.batch_delete_unsupported.add(table.name)
+        for key in keys:
+            try:
+                del table[key]
+            except KeyError:
+                continue
+
+    def _drain_exited_pids(self, read_selector):
+        # Exited threads accounted in the window we are reading are consumed,
+        # the ones that exited after the selector switch stay for the next sample
+        drained = []
+        for key, data in self._snapshot_table(self.exited_pids):
+            if key.bpf_selector == read_selector:
+                drained.append((key, data))
+        self._delete_keys(self.exited_pids, [key for key, data in drained])
+        self.gone_pids.extend([key.pid for key, data in drained])
+        return drained
+
+    def _forget_pids(self, keys):
+        # the containers of the pids that are gone are dropped at the next
+        # sample, the other collectors still resolve them in this one
+        self.gone_pids.extend([key.value for key in keys])
+
+    def _add_exited_pids(self, pids_snapshot, read_selector, tsmax):
+        # A pid reused in the window has an exited entry and a live one, the
+        # counters of the window are merged in the live entry so that the pid
+        # is reported once. The kernel already merges the threads of the
+        # window that exited with the same pid in a single exited entry
+        total_slots_length = len(self.topology.get_sockets())*self.SELECTOR_DIM
+        positions = {}
+        for index, (key, data) in enumerate(pids_snapshot):
+            positions[data.pid] = index
+        for key, data in self._drain_exited_pids(read_selector):
+            index = positions.get(data.pid)
+            if index is None:
+                positions[data.pid] = len(pids_snapshot)
+                pids_snapshot.append((key, data))
+                continue
+            entry = pids_snapshot[index][1]
+            if data.ts[read_selector] + self.timeslice <= tsmax:
+                continue
+            if entry.ts[read_selector] + self.timeslice <= tsmax:
+                # the entry holds the counters of an older window
+                pids_snapshot[index] = (key, data)
+                continue
+            entry.cycles[read_selector] += data.cycles[read_selector]
+            entry.instruction_retired[read_selector] += data.instruction_retired[read_selector]
+            entry.cache_misses[read_selector] += data.cache_misses[read_selector]
+            entry.cache_refs[read_selector] += data.cache_refs[read_selector]
+            entry.time_ns[read_selector] += data.time_ns[read_selector]
+            for multisocket_selector in range(read_selector, total_slots_length, self.SELECTOR_DIM):
+                entry.weighted_cycles[multisocket_selector] += data.weighted_cycles[multisocket_selector]
+            if entry.ts[read_selector] < data.ts[read_selector]:
+                entry.ts[read_selector] = data.ts[read_selector]
+
+    def _sweep_stale_entries(self, table, snapshot, tsmax):
+        # threads that exit are removed in kernel by trace_exit, this sweep
+        # catches the entries left behind (e.g. exits missed at startup)
+        # and the cgroups that have been removed
+        stale_threshold = self.stale_windows * self.timeslice
+        stale_keys = []
+        for key, data in snapshot:
+            if max(data.ts) + stale_threshold < tsmax:
+                stale_keys.append(key)
+        self._delete_keys(table, stale_keys)
+        return stale_keys
+
+    def _get_cgroup_snapshot(self, read_selector, tsmax):
+        # The entries of the cgroups map look like threads to the rest of
+        # the pipeline: each cgroup gets a stable key, which the resolver
+        # maps straight to the container of the cgroup
+        snapshot = self._merge_percpu_snapshot(self._snapshot_table(self.cgroups), read_selector, tsmax)
+        new_cgroups = [key.value for key, data in snapshot
+                       if key.value not in self.cgroup_keys]
+        if len(new_cgroups) > 0:
+            containers = self.container_resolver.resolve_cgroups(new_cgroups)
+            for cgroup_id in new_cgroups:
+                self.cgroup_keys[cgroup_id] = self.next_cgroup_key
+                self.container_resolver.set_aggregate_key(self.next_cgroup_key, containers[cgroup_id])
+                self.next_cgroup_key = self.next_cgroup_key - 1
+
+        for key, data in snapshot:
+            data.pid = self.cgroup_keys[key.value]
+            data.tgid = data.pid
+            data.comm = self.container_resolver.resolve(data.pid)[0:12].encode()
+        return snapshot
+
+    def _attribute_power(self, proc_info_list, package_power, core_power, dram_power):
+        # Build the (threads x sockets) weighted cycles matrix and let the
+        # power model split the RAPL domains among all threads at once
+        num_sockets = len(self.topology.get_sockets())
+        weighted_cycles = [[proc_info.get_socket_data(socket).get_weighted_cycles()
+                            for socket in range(num_sockets)]
+                           for proc_info in proc_info_list]
+        cache_misses = [proc_info.get_cache_misses() for proc_info in proc_info_list]
+
+        attribution = self.power_attribution.attribute(weighted_cycles,
+            cache_misses, package_power, core_power, dram_power)
+
+        for index, proc_info in enumerate(proc_info_list):
+            proc_info.set_power(attribution["core"][index])
+            proc_info.set_package_power(attribution["package"][index])
+            proc_info.set_dram_power(attribution["dram"][index])
@@ -0,0 +1,82 @@
+"""
+    DEEP-mon
+    Copyright (C) 2020  Brondolin Rolando
+
+    This file is part of DEEP-mon
+
+    DEEP-mon is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DEEP-mon is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from bcc import BPF
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+
+
+class BpfProgramLoader:
+    """
+    Compiles the eBPF programs of the collectors. bcc compiles each program
+    with clang at load time, so the programs that are needed later on
+    (network and disk) are compiled in a background thread while the rest
+    of the monitor is set up and the first sample is waited for.
+    Compilations still need clang and the kernel headers on every host.
+    bcc does not document BPF() as thread safe, so compilations are
+    serialized: they overlap with the setup done in Python, not with each
+    other.
+    """
+
+    def __init__(self):
+        self.bpf_path = os.path.dirname(os.path.abspath(__file__)) + "/../bpf/"
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.programs = {}
+        self.lock = threading.Lock()
+        self.compile_lock = threading.Lock()
+
+    def _get_key(self, src_file, cflags):
+        return (src_file, tuple(cflags))
+
+    def _compile(self, src_file, cflags):
+        with self.compile_lock:
+            return BPF(src_file=self.bpf_path + src_file, cflags=list(cflags))
+
+    def load(self, src_file, cflags):
+        # compile in the calling thread, used for the scheduler program that
+        # is needed right away
+        return self._compile(src_file, cflags)
+
+    def preload(self, src_file, cflags):
+        key = self._get_key(src_file, cflags)
+        with self.lock:
+            if key not in self.programs:
+                self.programs[key] = self.executor.submit(self._compile, src_file, cflags)
+
+    def get(self, src_file, cflags):
+        # return the program compiled by preload, waiting for it if needed.
+        # Programs that were not preloaded (or whose cflags changed in the
+        # meantime) are compiled synchronously
+        key = self._get_key(src_file, cflags)
+        with self.lock:
+            future = self.programs.pop(key, None)
+        if future is None:
+            return self._compile(src_file, cflags)
+        return future.result()
+
+    def shutdown(self):
+        # stop the background thread once every program has been loaded,
+        # programs preloaded and never requested are compiled for nothing
+        with self.lock:
+            for future in self.programs.values():
+                future.cancel()
+            self.programs = {}
+        self.executor.shutdown(wait=False)
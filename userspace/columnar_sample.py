@@ -0,0 +1,173 @@
+"""
+    DEEP-mon
+    Copyright (C) 2020  Brondolin Rolando
+
+    This file is part of DEEP-mon
+
+    DEEP-mon is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DEEP-mon is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from .process_info import ProcessInfo
+import numpy as np
+
+
+class ColumnarSample:
+    """
+    Per-sample process table stored as a single numpy structured array,
+    one row for each thread (or idle core) active in the sample window.
+    ProcessInfo objects are only built on demand as views over a row.
+    """
+
+    TASK_COMM_LEN = 16
+
+    def __init__(self, num_sockets):
+        self.num_sockets = num_sockets
+        self.dtype = np.dtype([
+            ("key", np.int64),
+            ("pid", np.int64),
+            ("tgid", np.int64),
+            ("comm", "S%d" % self.TASK_COMM_LEN),
+            ("cycles", np.uint64),
+            ("instruction_retired", np.uint64),
+            ("cache_misses", np.uint64),
+            ("cache_refs", np.uint64),
+            ("time_ns", np.uint64),
+            ("weighted_cycles", np.uint64, (num_sockets,)),
+            ("ts", np.uint64),
+            ("power", np.float64),
+            ("package_power", np.float64),
+            ("dram_power", np.float64),
+            ("cpu_usage", np.float64)])
+        self.data = np.zeros(0, dtype=self.dtype)
+        self.index = None
+        self.columns = None
+
+    def load_snapshot(self, pids_snapshot, idles_snapshot, read_selector,
+                      selector_dim, timeslice, tsmax):
+        # Copy the active entries of the pids and idles maps in the array,
+        # selecting the counters written with read_selector
+        rows = []
+        for key, data in pids_snapshot:
+            ts = data.ts[read_selector]
+            if ts + timeslice > tsmax:
+                rows.append((data.pid, data.pid, data.tgid, data.comm,
+                    data.cycles[read_selector],
+                    data.instruction_retired[read_selector],
+                    data.cache_misses[read_selector],
+                    data.cache_refs[read_selector],
+                    data.time_ns[read_selector],
+                    tuple(data.weighted_cycles[read_selector::selector_dim]),
+                    ts, 0.0, 0.0, 0.0, 0.0))
+
+        for key, data in idles_snapshot:
+            ts = data.ts[read_selector]
+            if ts + timeslice > tsmax:
+                # idle entries are stored with a negative key, one per core
+                idle_key = -1 * (1 + int(key.value))
+                rows.append((idle_key, data.pid, idle_key, data.comm,
+                    data.cycles[read_selector],
+                    data.instruction_retired[read_selector],
+                    data.cache_misses[read_selector],
+                    data.cache_refs[read_selector],
+                    data.time_ns[read_selector],
+                    tuple(data.weighted_cycles[read_selector::selector_dim]),
+                    ts, 0.0, 0.0, 0.0, 0.0))
+
+        self.data = np.array(rows, dtype=self.dtype)
+        self.index = None
+        self.columns = None
+
+    def get_data(self):
+        return self.data
+
+    def get_total_execution_time(self):
+        # milliseconds of execution in the window, idle included
+        return float(np.sum(self.data["time_ns"], dtype=np.float64)) / 1000000
+
+    def get_total_weighted_cycles(self):
+        return np.sum(self.data["weighted_cycles"], axis=0, dtype=np.float64)
+
+    def get_weighted_cycles_matrix(self):
+        return self.data["weighted_cycles"].astype(np.float64)
+
+    def get_cache_misses(self):
+        return self.data["cache_misses"].astype(np.float64)
+
+    def set_power(self, attribution):
+        # per-thread power of each RAPL domain, power is the core domain
+        self.data["power"] = attribution["core"]
+        self.data["package_power"] = attribution["package"]
+        self.data["dram_power"] = attribution["dram"]
+        self.columns = None
+
+    def compute_cpu_usage_millis(self, total_execution_time_millis, total_cores):
+        if total_execution_time_millis != 0:
+            self.data["cpu_usage"] = self.data["time_ns"].astype(np.float64) \
+                / 1000000 / total_execution_time_millis * total_cores * 100
+        else:
+            self.data["cpu_usage"] = 0
+        self.columns = None
+
+    def get_index(self):
+        # map from pid_dict key to row
+        if self.index is None:
+            self.index = {}
+            for row, key in enumerate(self.data["key"].tolist()):
+                self.index[key] = row
+        return self.index
+
+    def _get_columns(self):
+        # python lists are much faster than numpy scalars when the values
+        # are copied one by one into ProcessInfo objects
+        if self.columns is None:
+            self.columns = {}
+            for name in self.dtype.names:
+                self.columns[name] = self.data[name].tolist()
+        return self.columns
+
+    def get_comm(self, row):
+        return self._get_columns()["comm"][row]
+
+    def update_process_info(self, proc_info, row):
+        columns = self._get_columns()
+        proc_info.set_power(columns["power"][row])
+        proc_info.set_package_power(columns["package_power"][row])
+        proc_info.set_dram_power(columns["dram_power"][row])
+        proc_info.set_cpu_usage(columns["cpu_usage"][row])
+        proc_info.set_instruction_retired(columns["instruction_retired"][row])
+        proc_info.set_cycles(columns["cycles"][row])
+        proc_info.set_cache_misses(columns["cache_misses"][row])
+        proc_info.set_cache_refs(columns["cache_refs"][row])
+        proc_info.set_time_ns(columns["time_ns"][row])
+
+        ts = columns["ts"][row]
+        for socket_index, weighted_cycles in enumerate(columns["weighted_cycles"][row]):
+            socket_info = proc_info.get_socket_data(socket_index)
+            socket_info.set_weighted_cycles(weighted_cycles)
+            socket_info.set_ts(ts)
+
+    def get_process_info(self, row):
+        columns = self._get_columns()
+        proc_info = ProcessInfo(self.num_sockets)
+        proc_info.set_pid(columns["pid"][row])
+        proc_info.set_tgid(columns["tgid"][row])
+        proc_info.set_comm(columns["comm"][row])
+        self.update_process_info(proc_info, row)
+        return proc_info
+
+    def get_pid_dict(self):
+        pid_dict = {}
+        for key, row in self.get_index().items():
+            pid_dict[key] = self.get_process_info(row)
+        return pid_dict
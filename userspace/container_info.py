@@ -20,11 +20,11 @@
 
 import json
 import time
-from .net_collector import TransactionData
-from .net_collector import TransactionType
-from .net_collector import TransactionRole
+from .transaction_data import TransactionData
+from .transaction_data import TransactionType
+from .transaction_data import TransactionRole
+from .transaction_data import LatencySketch
 import numpy as np
-from ddsketch.ddsketch import DDSketch
 
 class bcolors:
     RED = '\033[91m'
@@ -45,7 +45,10 @@ class ContainerInfo:
         self.container_name = None
         self.container_image = None
         self.container_labels = None
-
+        self.pid_set = set()
+        self.pct = [50,75,90,99,99.9,99.99,99.999]
+        # the counters are kept up to date by the process table, which adds
+        # the change of each pid with every sample
         self.cycles = 0
         self.weighted_cycles = 0
         self.instruction_retired = 0
@@ -53,11 +56,20 @@ class ContainerInfo:
         self.cache_refs = 0
         self.time_ns = 0
         self.power = 0.0
+        self.package_power = 0.0
+        self.dram_power = 0.0
         self.cpu_usage = 0.0
-        self.pid_set = set()
+        # cpu usage of each pid, in the order pids were added
+        self.weighted_cpus = {}
+        self.weighted_threads = None
+        self.reset_sample_metrics()
+
+    def reset_sample_metrics(self):
+        # metrics that are not kept per pid are set again with every sample
         self.timestamp = 0
         self.network_transactions = []
         self.nat_rules = []
+        self.nat_index = None
 
         #memory metrics
         self.mem_RSS = 0
@@ -69,6 +81,11 @@ class ContainerInfo:
         self.num_r = 0
         self.num_w = 0
         self.disk_avg_lat = 0
+        # block layer I/O, latency percentiles in ms
+        self.blk_kb_r = 0
+        self.blk_kb_w = 0
+        self.blk_p50_lat = 0
+        self.blk_p99_lat = 0
 
         self.tcp_transaction_count = 0
         self.tcp_transaction_count_client = 0
@@ -78,9 +95,6 @@ class ContainerInfo:
         self.tcp_avg_latency = 0
         self.tcp_avg_latency_client = 0
         self.tcp_avg_latency_server = 0
-        self.tcp_percentiles = []
-        self.tcp_percentiles_client = []
-        self.tcp_percentiles_server = []
 
         self.http_transaction_count = 0
         self.http_transaction_count_client = 0
@@ -90,15 +104,13 @@ class ContainerInfo:
         self.http_avg_latency = 0
         self.http_avg_latency_client = 0
         self.http_avg_latency_server = 0
-        self.http_percentiles = []
-        self.http_percentiles_client = []
-        self.http_percentiles_server = []
 
-        self.pct = [50,75,90,99,99.9,99.99,99.999]
+        # latency sketches by (protocol, role), quantiles are computed and
+        # cached when they are read
+        self.latency_sketches = {}
+        self.latency_percentiles = {}
 
         self.network_threads = 0
-        self.weighted_threads = 0
-        self.weighted_cpus = []
 
     def add_weighted_cycles(self, new_cycles):
         self.weighted_cycles = self.weighted_cycles + new_cycles
@@ -112,6 +124,12 @@ class ContainerInfo:
     def add_power(self, new_power):
         self.power = self.power + float(new_power)
 
+    def add_package_power(self, new_power):
+        self.package_power = self.package_power + float(new_power)
+
+    def add_dram_power(self, new_power):
+        self.dram_power = self.dram_power + float(new_power)
+
     def add_instructions(self, new_instructions):
         self.instruction_retired = self.instruction_retired + new_instructions
 
@@ -123,11 +141,15 @@ class ContainerInfo:
 
     def add_cpu_usage(self, cpu_usage):
         self.cpu_usage = self.cpu_usage + float(cpu_usage)
-        self.add_weighted_cpu_usage(cpu_usage)
 
     def add_pid(self, new_pid):
         self.pid_set.add(new_pid)
 
+    def remove_pid(self, pid):
+        self.pid_set.discard(pid)
+        if self.weighted_cpus.pop(pid, None) is not None:
+            self.weighted_threads = None
+
     def add_network_transactions(self, transaction_list):
         self.network_transactions.extend(transaction_list)
         self.network_threads = self.network_threads + 1
@@ -135,6 +157,13 @@ class ContainerInfo:
     def add_nat_rules(self, nat_list):
         self.nat_rules.extend(nat_list)
 
+    def add_nat_index(self, nat_index):
+        # the rules of the processes added first win, as in nat_rules
+        if self.nat_index is None:
+            self.nat_index = nat_index.copy()
+        else:
+            self.nat_index.merge(nat_index)
+
     def set_container_name(self, container_name):
         self.container_name = container_name
 
@@ -168,88 +197,130 @@ class ContainerInfo:
     def set_disk_avg_lat(self, avg_lat):
         self.disk_avg_lat = avg_lat
 
-    def add_weighted_cpu_usage(self, cpu_usage):
-        self.weighted_cpus.append(cpu_usage)
+    def set_disk_blk_kb_r(self, blk_kb_r):
+        self.blk_kb_r = blk_kb_r
+
+    def set_disk_blk_kb_w(self, blk_kb_w):
+        self.blk_kb_w = blk_kb_w
+
+    def set_disk_blk_p50_lat(self, p50_lat):
+        self.blk_p50_lat = p50_lat
+
+    def set_disk_blk_p99_lat(self, p99_lat):
+        self.blk_p99_lat = p99_lat
+
+    def set_weighted_cpu_usage(self, pid, cpu_usage):
+        # the estimate depends on all the threads, it is computed when it is
+        # read after the pids of the container have been updated
+        self.weighted_cpus[pid] = cpu_usage
+        self.weighted_threads = None
+
+    def compute_weighted_threads(self):
         max = 0
         #compute max
-        for usage in self.weighted_cpus:
+        for usage in self.weighted_cpus.values():
             if max < usage:
                 max = usage
 
         # how many max do we have here?
         maxes = 0
         bin = 0
-        for usage in self.weighted_cpus:
+        for usage in self.weighted_cpus.values():
             bin = bin + usage
             if bin >= max:
                 maxes = maxes + 1
                 bin = bin - max
 
+        # pids without cpu usage have zero usage, they count only if no
+        # thread of the container ran
+        idle_threads = len(self.pid_set) - len(self.weighted_cpus)
+        if max == 0 and idle_threads > 0:
+            maxes = maxes + idle_threads
+
         self.weighted_threads = maxes
+        return self.weighted_threads
 
     def compute_aggregate_network_metrics(self):
         if self.network_transactions != []:
-            http_transactions = DDSketch()
-            http_transactions_client = DDSketch()
-            http_transactions_server = DDSketch()
-            tcp_transactions = DDSketch()
-            tcp_transactions_client = DDSketch()
-            tcp_transactions_server = DDSketch()
-
+            self.latency_percentiles = {}
             for transaction in self.network_transactions:
                 if transaction.type == TransactionType.ipv4_http or transaction.type == TransactionType.ipv6_http:
                     self.http_transaction_count = self.http_transaction_count + transaction.get_transaction_count()
                     self.http_byte_rx = self.http_byte_rx + transaction.get_byte_rx()
                     self.http_byte_tx = self.http_byte_tx + transaction.get_byte_tx()
                     self.http_avg_latency = self.http_avg_latency + transaction.get_avg_latency() * transaction.get_transaction_count()
-                    http_transactions.merge(transaction.get_samples())
 
                     if transaction.role == TransactionRole.client:
                         self.http_transaction_count_client = self.http_transaction_count_client + transaction.get_transaction_count()
                         self.http_avg_latency_client = self.http_avg_latency_client + transaction.get_avg_latency() * transaction.get_transaction_count()
-                        http_transactions_client.merge(transaction.get_samples())
+                        self._add_latency_sketch('http', TransactionRole.client, transaction.get_samples())
                     else:
                         self.http_transaction_count_server = self.http_transaction_count_server + transaction.get_transaction_count()
                         self.http_avg_latency_server = self.http_avg_latency_server + transaction.get_avg_latency() * transaction.get_transaction_count()
-                        http_transactions_server.merge(transaction.get_samples())
+                        self._add_latency_sketch('http', TransactionRole.server, transaction.get_samples())
 
                 else:
                     self.tcp_transaction_count = self.tcp_transaction_count + transaction.get_transaction_count()
                     self.tcp_byte_rx = self.tcp_byte_rx + transaction.get_byte_rx()
                     self.tcp_byte_tx = self.tcp_byte_tx + transaction.get_byte_tx()
                     self.tcp_avg_latency = self.tcp_avg_latency + transaction.get_avg_latency() * transaction.get_transaction_count()
-                    tcp_transactions.merge(transaction.get_samples())
 
                     if transaction.role == TransactionRole.client:
                         self.tcp_transaction_count_client = self.tcp_transaction_count_client + transaction.get_transaction_count()
                         self.tcp_avg_latency_client = self.tcp_avg_latency_client + transaction.get_avg_latency() * transaction.get_transaction_count()
-                        tcp_transactions_client.merge(transaction.get_samples())
+                        self._add_latency_sketch('tcp', TransactionRole.client, transaction.get_samples())
                     else:
                         self.tcp_transaction_count_server = self.tcp_transaction_count_server + transaction.get_transaction_count()
                         self.tcp_avg_latency_server = self.tcp_avg_latency_server + transaction.get_avg_latency() * transaction.get_transaction_count()
-                        tcp_transactions_server.merge(transaction.get_samples())
+                        self._add_latency_sketch('tcp', TransactionRole.server, transaction.get_samples())
 
             if self.http_transaction_count > 0:
                 self.http_avg_latency = self.http_avg_latency / float(self.http_transaction_count)
-                self.http_percentiles = self.compute_container_percentiles(http_transactions)
 
                 if self.http_transaction_count_client > 0:
                     self.http_avg_latency_client = self.http_avg_latency_client / float(self.http_transaction_count_client)
-                    self.http_percentiles_client = self.compute_container_percentiles(http_transactions_client)
                 if self.http_transaction_count_server > 0:
                     self.http_avg_latency_server = self.http_avg_latency_server / float(self.http_transaction_count_server)
-                    self.http_percentiles_server = self.compute_container_percentiles(http_transactions_server)
 
             if self.tcp_transaction_count > 0:
                 self.tcp_avg_latency = self.tcp_avg_latency / float(self.tcp_transaction_count)
-                self.tcp_percentiles = self.compute_container_percentiles(tcp_transactions)
 
                 if self.tcp_transaction_count_client > 0:
                     self.tcp_avg_latency_client = self.tcp_avg_latency_client / float(self.tcp_transaction_count_client)
-                    self.tcp_percentiles_client = self.compute_container_percentiles(tcp_transactions_client)
                 if self.tcp_transaction_count_server > 0:
                     self.tcp_avg_latency_server = self.tcp_avg_latency_server / float(self.tcp_transaction_count_server)
-                    self.tcp_percentiles_server = self.compute_container_percentiles(tcp_transactions_server)
+
+    def _add_latency_sketch(self, protocol, role, latency_sketch):
+        # each transaction is merged once, in the sketch of its role
+        key = (protocol, role)
+        if key in self.latency_sketches:
+            self.latency_sketches[key].merge(latency_sketch)
+        else:
+            self.latency_sketches[key] = LatencySketch()
+            self.latency_sketches[key].merge(latency_sketch)
+
+    def _get_latency_sketch(self, protocol, role=None):
+        if role is not None:
+            return self.latency_sketches.get((protocol, role))
+        # the sketch of all the transactions combines the ones of the roles
+        client = self.latency_sketches.get((protocol, TransactionRole.client))
+        server = self.latency_sketches.get((protocol, TransactionRole.server))
+        if client is None or server is None:
+            return client if server is None else server
+        latency_sketch = LatencySketch()
+        latency_sketch.merge(client)
+        latency_sketch.merge(server)
+        return latency_sketch
+
+    def _get_latency_percentiles(self, protocol, role=None):
+        key = (protocol, role)
+        if key not in self.latency_percentiles:
+            latency_sketch = self._get_latency_sketch(protocol, role)
+            if latency_sketch is None:
+                self.latency_percentiles[key] = []
+            else:
+                self.latency_percentiles[key] = self.compute_container_percentiles(latency_sketch)
+        return self.latency_percentiles[key]
 
     def compute_container_percentiles(self, latency_sketch):
         out = []
@@ -294,9 +365,20 @@ class ContainerInfo:
     def get_power(self):
         return self.power
 
+    def get_package_power(self):
+        return self.package_power
+
+    def get_dram_power(self):
+        return self.dram_power
+
     def get_cpu_usage(self):
         return self.cpu_usage
 
+    def get_weighted_threads(self):
+        if self.weighted_threads is None:
+            return self.compute_weighted_threads()
+        return self.weighted_threads
+
     def get_pid_set(self):
         return self.pid_set
 
@@ -330,6 +412,18 @@ class ContainerInfo:
     def get_disk_avg_lat(self):
         return self.disk_avg_lat
 
+    def get_blk_kb_r(self):
+        return self.blk_kb_r
+
+    def get_blk_kb_w(self):
+        return self.blk_kb_w
+
+    def get_disk_blk_p50_lat(self):
+        return self.blk_p50_lat
+
+    def get_disk_blk_p99_lat(self):
+        return self.blk_p99_lat
+
     def get_http_transaction_count(self):
         return self.http_transaction_count
 
@@ -355,58 +449,20 @@ class ContainerInfo:
         return self.tcp_avg_latency
 
     def get_rewritten_network_transactions(self):
-
-        for index in range(len(self.network_transactions)):
-            transaction = self.network_transactions[index]
-
-            # find if there are nat rules to be added or substituted
-            src_modified = False
-            dst_modified = False
-            for nat_rule in self.nat_rules:
-                # start with transaction src and look at both ends of nat rules
-                if src_modified == False and nat_rule.get_saddr() == transaction.get_saddr() and nat_rule.get_lport() == transaction.get_lport():
-                    # rewrite transaction source
-                    transaction.set_saddr(nat_rule.get_daddr())
-                    transaction.set_lport(nat_rule.get_dport())
-                    src_modified = True
-                    # print(nat_rule)
-                #
-                # if src_modified == False and nat_rule.get_daddr() == transaction.get_saddr() and nat_rule.get_dport() == transaction.get_lport():
-                #     # rewrite transaction source
-                #     transaction.set_saddr(nat_rule.get_saddr())
-                #     transaction.set_lport(nat_rule.get_lport())
-                #     src_modified = True
-                #     # print(nat_rule)
-
-                # if dst_modified == False and nat_rule.get_saddr() == transaction.get_daddr() and nat_rule.get_lport() == transaction.get_dport():
-                #     # rewrite transaction source
-                #     transaction.set_daddr(nat_rule.get_daddr())
-                #     transaction.set_dport(nat_rule.get_dport())
-                #     dst_modified = True
-                #     # print(nat_rule)
-
-                if dst_modified == False and nat_rule.get_daddr() == transaction.get_daddr() and nat_rule.get_dport() == transaction.get_dport():
-                    # rewrite transaction source
-                    transaction.set_daddr(nat_rule.get_saddr())
-                    transaction.set_dport(nat_rule.get_lport())
-                    dst_modified = True
-                    # print(nat_rule)
-
-                if src_modified and dst_modified:
-                    break
-            self.network_transactions[index] = transaction
-
-        return self.network_transactions
+        # rewritten copies, the transactions of the processes are not changed
+        if self.nat_index is None:
+            return list(self.network_transactions)
+        return [self.nat_index.rewrite(transaction) for transaction in self.network_transactions]
 
 
     def get_nat_rules(self):
         return self.nat_rules
 
-    def get_http_percentiles(self):
-        return [self.pct, self.http_percentiles]
+    def get_http_percentiles(self, role=None):
+        return [self.pct, self._get_latency_percentiles('http', role)]
 
-    def get_tcp_percentiles(self):
-        return [self.pct, self.tcp_percentiles]
+    def get_tcp_percentiles(self, role=None):
+        return [self.pct, self._get_latency_percentiles('tcp', role)]
 
     def to_dict(self):
         return {'container_id': self.container_id,
@@ -418,6 +474,8 @@ class ContainerInfo:
                 'cycles': self.cycles,
                 'time_ns': self.time_ns,
                 'power': self.power,
+                'package_power': self.package_power,
+                'dram_power': self.dram_power,
                 'cpu_usage': self.cpu_usage,
                 'pid_set': self.pid_set
                 }
@@ -450,7 +508,17 @@ class ContainerInfo:
                     + '{:.3f}'.format(self.power)
                 )
 
-        if self.mem_RSS > 0:
+        if self.mem_RSS > 0 and self.mem_PSS is None:
+            # PSS is not available with cgroup memory accounting
+            fmt = '{:<20} {:<23} {:<23}'
+            output_line = output_line + "\n" + fmt.format(
+                    bcolors.GREEN + "\tMemory (kB): " + bcolors.ENDC,
+                    bcolors.BLUE + "RSS: " + bcolors.ENDC
+                        + str(self.mem_RSS),
+                    bcolors.BLUE + "USS: " + bcolors.ENDC
+                        + str(self.mem_USS)
+            )
+        elif self.mem_RSS > 0:
             fmt = '{:<20} {:<23} {:<23} {:<23}'
             output_line = output_line + "\n" + fmt.format(
                     bcolors.GREEN + "\tMemory (kB): " + bcolors.ENDC,
@@ -478,6 +546,20 @@ class ContainerInfo:
                         + str(round(self.disk_avg_lat,3))
             )
 
+        if (self.blk_kb_r > 0 or self.blk_kb_w > 0):
+            fmt = '{:<20} {:<23} {:<23} {:<23} {:<23}'
+            output_line = output_line + "\n" + fmt.format(
+                    bcolors.GREEN + "\tBlock I/O: " + bcolors.ENDC,
+                    bcolors.BLUE + "Kb R: " + bcolors.ENDC
+                        + str(self.blk_kb_r),
+                    bcolors.BLUE + "Kb W: " + bcolors.ENDC
+                        + str(self.blk_kb_w),
+                    bcolors.BLUE + "P50 LAT (ms): " + bcolors.ENDC
+                        + str(round(self.blk_p50_lat,3)),
+                    bcolors.BLUE + "P99 LAT (ms): " + bcolors.ENDC
+                        + str(round(self.blk_p99_lat,3))
+            )
+
         if self.http_transaction_count > 0:
             fmt = '{:<5} {:<32} {:<34} {:<34} {:<34}'
             output_line = output_line + "\n" + fmt.format(
@@ -491,16 +573,17 @@ class ContainerInfo:
                     bcolors.BLUE + "HTTP_AVG_LATENCY (ms): " + bcolors.ENDC
                         + '{:.3f}'.format(self.http_avg_latency)
                     )
+            http_percentiles = self.get_http_percentiles()[1]
             fmt = '{:<5} {:<30} {:<30} {:<30} {:<30} {:<30} {:<30} {:<30}'
             output_line = output_line + "\n" + fmt.format(
                     bcolors.BLUE + "--->" + bcolors.ENDC,
-                    bcolors.BLUE + "50p: " + bcolors.ENDC + '{:.5f}'.format(self.http_percentiles[0]),
-                    bcolors.BLUE + "75p: " + bcolors.ENDC + '{:.5f}'.format(self.http_percentiles[1]),
-                    bcolors.BLUE + "90p: " + bcolors.ENDC + '{:.5f}'.format(self.http_percentiles[2]),
-                    bcolors.BLUE + "99p: " + bcolors.ENDC + '{:.5f}'.format(self.http_percentiles[3]),
-                    bcolors.BLUE + "99.9p: " + bcolors.ENDC + '{:.5f}'.format(self.http_percentiles[4]),
-                    bcolors.BLUE + "99.99p: " + bcolors.ENDC + '{:.5f}'.format(self.http_percentiles[5]),
-                    bcolors.BLUE + "99.999p: " + bcolors.ENDC + '{:.5f}'.format(self.http_percentiles[6]),
+                    bcolors.BLUE + "50p: " + bcolors.ENDC + '{:.5f}'.format(http_percentiles[0]),
+                    bcolors.BLUE + "75p: " + bcolors.ENDC + '{:.5f}'.format(http_percentiles[1]),
+                    bcolors.BLUE + "90p: " + bcolors.ENDC + '{:.5f}'.format(http_percentiles[2]),
+                    bcolors.BLUE + "99p: " + bcolors.ENDC + '{:.5f}'.format(http_percentiles[3]),
+                    bcolors.BLUE + "99.9p: " + bcolors.ENDC + '{:.5f}'.format(http_percentiles[4]),
+                    bcolors.BLUE + "99.99p: " + bcolors.ENDC + '{:.5f}'.format(http_percentiles[5]),
+                    bcolors.BLUE + "99.999p: " + bcolors.ENDC + '{:.5f}'.format(http_percentiles[6]),
             )
 
         if self.tcp_transaction_count > 0:
@@ -516,15 +599,16 @@ class ContainerInfo:
                     bcolors.BLUE + "TCP_AVG_LATENCY (ms): " + bcolors.ENDC
                         + '{:.3f}'.format(self.tcp_avg_latency)
                     )
+            tcp_percentiles = self.get_tcp_percentiles()[1]
             fmt = '{:<5} {:<30} {:<30} {:<30} {:<30} {:<30} {:<30} {:<30}'
             output_line = output_line + "\n" + fmt.format(
                     bcolors.BLUE + "--->" + bcolors.ENDC,
-                    bcolors.BLUE + "50p: " + bcolors.ENDC + '{:.5f}'.format(self.tcp_percentiles[0]),
-                    bcolors.BLUE + "75p: " + bcolors.ENDC + '{:.5f}'.format(self.tcp_percentiles[1]),
-                    bcolors.BLUE + "90p: " + bcolors.ENDC + '{:.5f}'.format(self.tcp_percentiles[2]),
-                    bcolors.BLUE + "99p: " + bcolors.ENDC + '{:.5f}'.format(self.tcp_percentiles[3]),
-                    bcolors.BLUE + "99.9p: " + bcolors.ENDC + '{:.5f}'.format(self.tcp_percentiles[4]),
-                    bcolors.BLUE + "99.99p: " + bcolors.ENDC + '{:.5f}'.format(self.tcp_percentiles[5]),
-                    bcolors.BLUE + "99.999p: " + bcolors.ENDC + '{:.5f}'.format(self.tcp_percentiles[6]),
+                    bcolors.BLUE + "50p: " + bcolors.ENDC + '{:.5f}'.format(tcp_percentiles[0]),
+                    bcolors.BLUE + "75p: " + bcolors.ENDC + '{:.5f}'.format(tcp_percentiles[1]),
+                    bcolors.BLUE + "90p: " + bcolors.ENDC + '{:.5f}'.format(tcp_percentiles[2]),
+                    bcolors.BLUE + "99p: " + bcolors.ENDC + '{:.5f}'.format(tcp_percentiles[3]),
+                    bcolors.BLUE + "99.9p: " + bcolors.ENDC + '{:.5f}'.format(tcp_percentiles[4]),
+                    bcolors.BLUE + "99.99p: " + bcolors.ENDC + '{:.5f}'.format(tcp_percentiles[5]),
+                    bcolors.BLUE + "99.999p: " + bcolors.ENDC + '{:.5f}'.format(tcp_percentiles[6]),
             )
         return output_line
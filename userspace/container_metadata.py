@@ -0,0 +1,194 @@
+"""
+    DEEP-mon
+    Copyright (C) 2020  Brondolin Rolando
+
+    This file is part of DEEP-mon
+
+    DEEP-mon is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DEEP-mon is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import docker
+import threading
+import time
+
+
+class ContainerMetadata:
+
+    def __init__(self, container_id, name, image, labels):
+        self.container_id = container_id
+        self.name = name
+        self.image = image
+        self.labels = labels
+
+    def get_container_id(self):
+        return self.container_id
+
+    def get_name(self):
+        return self.name
+
+    def get_image(self):
+        return self.image
+
+    def get_labels(self):
+        return self.labels
+
+
+class ContainerMetadataCache:
+    """
+    Name, image and labels of the running containers, keyed by short
+    (12 chars) container id. The cache is warmed with a single list call and
+    kept up to date by a thread listening to the docker events stream.
+    Lookups never block: unknown containers are fetched in background and
+    are available from one of the next samples. Ids that docker does not
+    know (e.g. containers of another runtime) are not fetched again for
+    missing_ttl seconds. When the events stream breaks the thread connects
+    again, with exponential backoff, and warms the cache again since
+    events might have been missed in the meantime.
+    """
+
+    # container events that can change name, image or labels
+    update_events = ["create", "start", "rename", "update"]
+    # stopped or removed containers are fetched again if they show up
+    invalidate_events = ["die", "destroy"]
+
+    def __init__(self, docker_client, max_workers=4, missing_ttl=60, retry_delay=1, max_retry_delay=60):
+        self.docker_client = docker_client
+        self.metadata = {}
+        self.images = {}
+        self.pending = set()
+        # container id -> time of the failed fetch
+        self.missing = {}
+        self.missing_ttl = missing_ttl
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.events = None
+        self.events_thread = None
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.stopped = threading.Event()
+
+        self.hit_count = 0
+        self.miss_count = 0
+
+    def start(self):
+        self._warm()
+        self.events_thread = threading.Thread(target=self._watch_events, daemon=True)
+        self.events_thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.events is not None:
+            self.events.close()
+        self.executor.shutdown(wait=False)
+
+    def _get_image_string(self, image_id):
+        # same string as str(container.image), images are shared by many
+        # containers so they are fetched once
+        if image_id not in self.images:
+            self.images[image_id] = str(self.docker_client.images.get(image_id))
+        return self.images[image_id]
+
+    def _warm(self):
+        try:
+            for image in self.docker_client.api.images():
+                self.images[image["Id"]] = str(self.docker_client.images.prepare_model(image))
+
+            for container in self.docker_client.api.containers(all=True):
+                name = container["Names"][0].lstrip("/") if container.get("Names") else None
+                image = self._get_image_string(container["ImageID"])
+                self._set(ContainerMetadata(container["Id"][0:12], name, image,
+                    container.get("Labels") or {}))
+        except docker.errors.DockerException:
+            # leave the cache empty, containers are fetched one by one
+            pass
+
+    def _set(self, metadata):
+        with self.lock:
+            self.metadata[metadata.get_container_id()] = metadata
+            self.pending.discard(metadata.get_container_id())
+            self.missing.pop(metadata.get_container_id(), None)
+
+    def _fetch(self, container_id):
+        try:
+            container = self.docker_client.api.inspect_container(container_id)
+            labels = container["Config"].get("Labels") or {}
+            self._set(ContainerMetadata(container_id, container["Name"].lstrip("/"),
+                self._get_image_string(container["Image"]), labels))
+        except docker.errors.DockerException:
+            # container already gone, or not a docker container at all
+            with self.lock:
+                self.pending.discard(container_id)
+                self.missing[container_id] = time.monotonic()
+
+    def _schedule_fetch(self, container_id):
+        with self.lock:
+            if container_id in self.pending:
+                return
+            self.pending.add(container_id)
+        self.executor.submit(self._fetch, container_id)
+
+    def _watch_events(self):
+        retry_delay = self.retry_delay
+        connected = True
+        while not self.stopped.is_set():
+            try:
+                self.events = self.docker_client.events(decode=True,
+                    filters={"type": "container"})
+                if not connected:
+                    # events sent while the stream was down are lost
+                    self._warm()
+                    connected = True
+                for event in self.events:
+                    retry_delay = self.retry_delay
+                    container_id = event.get("id", "")[0:12]
+                    action = event.get("Action", event.get("status"))
+                    if container_id == "":
+                        continue
+                    if action in self.invalidate_events:
+                        with self.lock:
+                            self.metadata.pop(container_id, None)
+                    elif action in self.update_events:
+                        with self.lock:
+                            self.missing.pop(container_id, None)
+                        self._schedule_fetch(container_id)
+            except Exception:
+                # stream broken, unknown containers are still fetched on
+                # lookup until we are connected again
+                pass
+            connected = False
+            self.stopped.wait(retry_delay)
+            retry_delay = min(retry_delay * 2, self.max_retry_delay)
+
+    def get(self, container_id):
+        # return the cached metadata, or None while the container is fetched
+        with self.lock:
+            metadata = self.metadata.get(container_id)
+        if metadata is not None:
+            self.hit_count = self.hit_count + 1
+            return metadata
+
+        self.miss_count = self.miss_count + 1
+        with self.lock:
+            failed = self.missing.get(container_id)
+        if failed is not None and time.monotonic() - failed < self.missing_ttl:
+            return None
+        self._schedule_fetch(container_id)
+        return None
+
+    def get_hit_count(self):
+        return self.hit_count
+
+    def get_miss_count(self):
+        return self.miss_count
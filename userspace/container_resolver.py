@@ -0,0 +1,183 @@
+"""
+    DEEP-mon
+    Copyright (C) 2020  Brondolin Rolando
+
+    This file is part of DEEP-mon
+
+    DEEP-mon is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DEEP-mon is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from collections import OrderedDict
+import os
+import threading
+
+
+class ContainerResolver:
+    """
+    Maps pids to the (64 chars) id of the docker container they belong to.
+    Results are kept in a bounded LRU cache keyed by pid and trusted until
+    the pid is reported gone through forget(): by the exit hook and the
+    sweep of the scheduler collector, and by the process table when a pid
+    changes comm or is evicted. A cached pid costs a dict lookup, only new
+    processes cause /proc/<pid>/cgroup to be read.
+    With in-kernel cgroup aggregation, cgroup ids are mapped to containers
+    through the inode numbers of the cgroup v2 hierarchy, which is scanned
+    again only when an unknown cgroup id shows up.
+    """
+
+    IDLE = "----idle----"
+    OTHERS = "---others---"
+
+    def __init__(self, proc_paths=None, max_entries=65536, cgroup_paths=None):
+        if proc_paths is None:
+            proc_paths = ["/host/proc", "/proc"]
+        if cgroup_paths is None:
+            cgroup_paths = ["/host/sys/fs/cgroup", "/sys/fs/cgroup"]
+        self.proc_paths = proc_paths
+        self.cgroup_paths = cgroup_paths
+        self.max_entries = max_entries
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+        # cgroup inode -> container id
+        self.cgroup_containers = {}
+        # keys of the per cgroup entries of the sample -> container id
+        self.aggregate_keys = {}
+
+    def _get_container_id(self, cgroup_name):
+        # cgroupfs driver: .../docker/<id>
+        # systemd driver: .../docker-<id>.scope
+        if cgroup_name.startswith("docker-") and cgroup_name.endswith(".scope"):
+            cgroup_name = cgroup_name[len("docker-"):-len(".scope")]
+        if len(cgroup_name) == 64:
+            return cgroup_name
+        return None
+
+    def _parse_cgroup_file(self, pid):
+        for path in self.proc_paths:
+            try:
+                with open(os.path.join(path, str(pid), "cgroup"), "r") as f:
+                    for line in f:
+                        container_id = self._get_container_id(line.rstrip("\n").split("/")[-1])
+                        if container_id is not None:
+                            return container_id
+            except IOError:
+                # process has already terminated, or not in this namespace
+                continue
+            return self.OTHERS
+        return None
+
+    def resolve(self, pid, tgid=None):
+        if pid in self.aggregate_keys:
+            return self.aggregate_keys[pid]
+        # exclude idle
+        if pid < 0:
+            return self.IDLE
+
+        for id in [pid, tgid]:
+            if id is None:
+                continue
+            with self.lock:
+                container_id = self.cache.get(id)
+                if container_id is not None:
+                    self.cache.move_to_end(id)
+                    return container_id
+
+            container_id = self._parse_cgroup_file(id)
+            if container_id is None:
+                continue
+            with self.lock:
+                self.cache[id] = container_id
+                if len(self.cache) > self.max_entries:
+                    self.cache.popitem(last=False)
+            return container_id
+        return self.OTHERS
+
+    def forget(self, pids):
+        # the pids are gone, a reused pid is resolved again
+        with self.lock:
+            for pid in pids:
+                self.cache.pop(pid, None)
+
+    def resolve_all(self, pids):
+        # resolve a list of pids (or (pid, tgid) tuples) in one call
+        containers = {}
+        for pid in pids:
+            if isinstance(pid, tuple):
+                containers[pid[0]] = self.resolve(pid[0], pid[1])
+            else:
+                containers[pid] = self.resolve(pid)
+        return containers
+
+    def _scan_cgroups(self):
+        # use the unified hierarchy, under unified/ on hybrid hosts
+        for path in self.cgroup_paths:
+            if os.path.isdir(os.path.join(path, "unified")):
+                path = os.path.join(path, "unified")
+            if not os.path.exists(os.path.join(path, "cgroup.controllers")):
+                continue
+            cgroup_containers = {}
+            path_containers = {}
+            for root, dirs, files in os.walk(path):
+                container_id = self._get_container_id(os.path.basename(root))
+                if container_id is None:
+                    # nested cgroups belong to the container of their parent
+                    container_id = path_containers.get(os.path.dirname(root), self.OTHERS)
+                path_containers[root] = container_id
+                try:
+                    cgroup_containers[os.stat(root).st_ino] = container_id
+                except OSError:
+                    continue
+            self.cgroup_containers = cgroup_containers
+            break
+
+    def find_container_cgroups(self, hierarchy_path):
+        # container id -> cgroup directory of the container, for the
+        # cgroups under hierarchy_path (a v2 root or a v1 controller)
+        container_cgroups = {}
+        for root, dirs, files in os.walk(hierarchy_path):
+            container_id = self._get_container_id(os.path.basename(root))
+            if container_id is not None:
+                container_cgroups[container_id] = root
+                # nested cgroups belong to the same container
+                dirs[:] = []
+        return container_cgroups
+
+    def resolve_cgroup(self, cgroup_id):
+        # before linux 5.5 cgroup ids also carry the inode generation
+        # in the upper 32 bits
+        for inode in [cgroup_id, cgroup_id & 0xffffffff]:
+            if inode in self.cgroup_containers:
+                return self.cgroup_containers[inode]
+        return None
+
+    def resolve_cgroups(self, cgroup_ids):
+        # map a list of cgroup ids to containers, scanning the hierarchy once
+        # if some of them are unknown
+        if any(self.resolve_cgroup(cgroup_id) is None for cgroup_id in cgroup_ids):
+            self._scan_cgroups()
+        containers = {}
+        for cgroup_id in cgroup_ids:
+            container_id = self.resolve_cgroup(cgroup_id)
+            containers[cgroup_id] = container_id if container_id is not None else self.OTHERS
+        return containers
+
+    def set_aggregate_key(self, key, container_id):
+        self.aggregate_keys[key] = container_id
+
+    def remove_aggregate_key(self, key):
+        self.aggregate_keys.pop(key, None)
+
+    def get_cache_size(self):
+        return len(self.cache)
@@ -118,8 +118,8 @@ class Curse:
             "CONTAINER_ID", "CONTAINER_NAME", "RSS (Kb)", "PSS (Kb)", "USS (Kb)"
             ))
         elif (self.displayed_metric == 'disk'):
-            label_win.addstr(1,0, "%12s %40s %11s %11s %11s %11s %11s" % (
-            "CONTAINER_ID", "CONTAINER_NAME", "Kb_R", "Kb_W", "NUM_R", "NUM_W", "AVG_LAT(ms)"
+            label_win.addstr(1,0, "%12s %40s %11s %11s %11s %11s %11s %11s %11s" % (
+            "CONTAINER_ID", "CONTAINER_NAME", "Kb_R", "Kb_W", "NUM_R", "NUM_W", "AVG_LAT(ms)", "BLK_P50(ms)", "BLK_P99(ms)"
             ))
         elif (self.displayed_metric == 'tcp'):
             label_win.addstr(1,0, "%12s %40s %13s %14s %14s %13s" % (
@@ -179,14 +179,18 @@ class Curse:
 
                     elif self.displayed_metric == 'memory':
                         metrics_win.addstr(counter-self.start_display_index, 54, str.ljust("%11s %11s %11s" % (
-                        str(value.get_mem_RSS()), str(value.get_mem_PSS()), str(value.get_mem_USS())
+                        str(value.get_mem_RSS()),
+                        '-' if value.get_mem_PSS() is None else str(value.get_mem_PSS()),
+                        str(value.get_mem_USS())
                         ),cx-54), color)
 
                     elif self.displayed_metric == 'disk':
-                        metrics_win.addstr(counter-self.start_display_index, 54, str.ljust("%11s %11s %11s %11s %11s" % (
+                        metrics_win.addstr(counter-self.start_display_index, 54, str.ljust("%11s %11s %11s %11s %11s %11s %11s" % (
                         str(value.get_kb_r()), str(value.get_kb_w()),
                         str(value.get_num_r()), str(value.get_num_w()),
-                        '{:.3f}'.format(value.get_disk_avg_lat())
+                        '{:.3f}'.format(value.get_disk_avg_lat()),
+                        '{:.3f}'.format(value.get_disk_blk_p50_lat()),
+                        '{:.3f}'.format(value.get_disk_blk_p99_lat())
                         ),cx-54), color)
 
                     elif self.displayed_metric == 'http':
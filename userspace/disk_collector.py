@@ -19,46 +19,131 @@
 """
 
 from bcc import BPF
+from .block_latency import get_log2_percentile
+from .container_resolver import ContainerResolver
+from collections import OrderedDict
+import heapq
 import os
 import json
+import platform
 
 class DiskCollector:
-    def __init__(self, monitor_disk, monitor_file):
+    def __init__(self, monitor_disk, monitor_file, loader=None, container_resolver=None, vfs_probe_mode="kprobe"):
+        self.loader = loader
+        # fentry/fexit probes (BPF trampolines) need kernel 5.5 or later.
+        # With "auto" they are used when available. They still need a per
+        # pid hash for the entry timestamps, so kprobes stay the default
+        # until they are shown to be cheaper
+        if vfs_probe_mode == "fexit" or (vfs_probe_mode != "kprobe" and BPF.support_kfunc()):
+            self.use_fexit = True
+        else:
+            self.use_fexit = False
+        if container_resolver is None:
+            container_resolver = ContainerResolver()
+        self.container_resolver = container_resolver
         self.monitor_file = monitor_file
         self.monitor_disk = monitor_disk
         self.disk_sample = None
         self.disk_monitor = None
-        self.proc_path = "/host/proc"
-        self.proc_files = [f for f in os.listdir(self.proc_path) if os.path.isfile(os.path.join(self.proc_path, f))]
         self.number_files_to_keep = 10
-
-    def start_capture(self):
-        bpf_code_path = os.path.dirname(os.path.abspath(__file__)) \
-                        + "/../bpf/vfs_monitor.c"
-        #DNAME_INLINE_LEN = 32  # linux/dcache.h
-        self.disk_monitor = BPF(src_file=bpf_code_path, cflags=["-DNAME_INLINE_LEN=%d" % 32])
-        self.disk_monitor.attach_kprobe(event="vfs_read", fn_name="trace_rw_entry")
-        self.disk_monitor.attach_kretprobe(event="vfs_read", fn_name="trace_read_return")
-
-        self.disk_monitor.attach_kprobe(event="vfs_write", fn_name="trace_rw_entry")
-        self.disk_monitor.attach_kretprobe(event="vfs_write", fn_name="trace_write_return")
-
-    def _include_file_path(self, file_name, file_parent, file_parent2):
-        file_name = file_name.decode("utf-8")
-        file_parent = file_parent.decode("utf-8")
-        file_parent2 = file_parent2.decode("utf-8")
-
-        if (file_parent == "/"):
-            if (file_name in self.proc_files or file_name.isdigit()):
-                return False
-            return "/"+file_name
-        if (file_parent2 == "/"):
-            if (file_parent in self.proc_files or file_parent.isdigit()):
+        self.file_path_cache = FilePathCache()
+        # max number of files tracked in kernel between two samples
+        self.file_table_size = 10240
+        # names copied in kernel for each file, the file and its parents
+        self.file_path_depth = 4
+
+        # block layer latency, from the block_io_start/done tracepoints
+        # (linux 6.5 or later) or from kprobes on the request functions
+        self.block_tracepoints = BPF.tracepoint_exists("block", "block_io_done")
+        self.block_done_function = None
+        if not self.block_tracepoints:
+            for function in [b"__blk_account_io_done", b"blk_account_io_done"]:
+                if BPF.get_kprobe_functions(function):
+                    self.block_done_function = function
+                    break
+        self.monitor_block = monitor_disk and (self.block_tracepoints or self.block_done_function is not None)
+        self.bio_has_blkg = self.monitor_block and self._bio_has_blkg()
+
+    def _request_has_rq_disk(self):
+        # request->rq_disk was removed in linux 5.17, the disk is then
+        # reached through the request queue
+        try:
+            return BPF.kernel_struct_has_field(b"request", b"rq_disk") == 1
+        except AttributeError:
+            # bcc without BTF helpers, guess from the kernel version
+            version = platform.release().split("-")[0].split(".")
+            return (int(version[0]), int(version[1])) < (5, 17)
+
+    def _bio_has_blkg(self):
+        # bios carry the cgroup they are charged to since linux 4.19, in the
+        # io controller of cgroup v2 its id is the one the resolver knows.
+        # struct blkcg_gq is private to the block layer from linux 5.19, so
+        # it is used only when the kernel headers still define it
+        try:
+            if BPF.kernel_struct_has_field(b"bio", b"bi_blkg") != 1:
                 return False
-            return "/"+file_parent+"/"+file_name
-        if (file_parent2 in self.proc_files or file_parent2.isdigit()):
+        except AttributeError:
             return False
-        return file_parent2+"/"+file_parent+"/"+file_name
+        header = "/lib/modules/%s/build/include/linux/blk-cgroup.h" % platform.release()
+        try:
+            with open(header, "r") as f:
+                if "struct blkcg_gq {" not in f.read():
+                    return False
+        except IOError:
+            return False
+        for path in ["/host/sys/fs/cgroup", "/sys/fs/cgroup"]:
+            try:
+                with open(os.path.join(path, "cgroup.controllers"), "r") as f:
+                    return "io" in f.read().split()
+            except IOError:
+                continue
+        return False
+
+    def get_cflags(self):
+        #DNAME_INLINE_LEN = 32  # linux/dcache.h
+        cflags = ["-DNAME_INLINE_LEN=%d" % 32, "-DFILE_TABLE_SIZE=%d" % self.file_table_size]
+        cflags.append("-DFILE_PATH_DEPTH=%d" % self.file_path_depth)
+        if self.use_fexit:
+            cflags.append("-DVFS_FEXIT")
+        if self.monitor_block:
+            cflags.append("-DBLOCK_IO")
+            if self.block_tracepoints:
+                cflags.append("-DBLOCK_IO_TRACEPOINTS")
+            if self._request_has_rq_disk():
+                cflags.append("-DRQ_DISK")
+            if self.bio_has_blkg:
+                cflags.append("-DBIO_BLKG")
+        return cflags
+
+    def preload(self):
+        # start compiling the program while the other collectors are set up
+        if self.loader is not None:
+            self.loader.preload("vfs_monitor.c", self.get_cflags())
+
+    def start_capture(self):
+        if self.loader is not None:
+            self.disk_monitor = self.loader.get("vfs_monitor.c", self.get_cflags())
+        else:
+            bpf_code_path = os.path.dirname(os.path.abspath(__file__)) \
+                            + "/../bpf/vfs_monitor.c"
+            self.disk_monitor = BPF(src_file=bpf_code_path, cflags=self.get_cflags())
+        # fentry and fexit programs are attached by bcc when the program is loaded
+        if not self.use_fexit:
+            self.disk_monitor.attach_kprobe(event="vfs_read", fn_name="trace_rw_entry")
+            self.disk_monitor.attach_kretprobe(event="vfs_read", fn_name="trace_read_return")
+
+            self.disk_monitor.attach_kprobe(event="vfs_write", fn_name="trace_rw_entry")
+            self.disk_monitor.attach_kretprobe(event="vfs_write", fn_name="trace_write_return")
+
+        if self.monitor_file:
+            # renamed and deleted files invalidate the cached paths
+            self.disk_monitor.attach_kprobe(event="d_move", fn_name="trace_d_move")
+            self.disk_monitor.attach_kprobe(event="d_delete", fn_name="trace_d_delete")
+
+        # raw tracepoints are attached by bcc when the program is loaded
+        if self.monitor_block and not self.block_tracepoints:
+            self.disk_monitor.attach_kprobe(event="blk_mq_start_request", fn_name="trace_block_start")
+            self.disk_monitor.attach_kprobe(event=self.block_done_function, fn_name="trace_block_done")
 
     def get_sample(self):
         disk_dict = {}
@@ -71,54 +156,34 @@ class DiskCollector:
                 disk_dict[key]["kb_w"] = int(v.bytes_w/1000)
                 disk_dict[key]["num_r"] = int(v.num_r)
                 disk_dict[key]["num_w"] = int(v.num_w)
-                disk_dict[key]["avg_lat"] = float(v.sum_ts_deltas) / 1000 / (v.num_r+v.num_w)
-                disk_dict[key]["container_ID"] = "---others---"
-                if (os.path.exists(os.path.join(self.proc_path,str(v.pid),"cgroup"))):
-                    try:
-                        with open(os.path.join(self.proc_path, str(v.pid), 'cgroup'), 'r') as f:
-                            for line in f:
-                                line_array = line.split("/")
-                                if len(line_array) > 1 and \
-                                    len(line_array[len(line_array) -1]) == 65:
-                                    disk_dict[key]["container_ID"] = line_array[len(line_array) -1][:-1]
-                                    break
-                    except IOError:
-                        continue
-                    # systemd Docker
-                    try:
-                        with open(os.path.join(self.proc_path, str(v.pid), 'cgroup'), 'r') as f:
-                            for line in f:
-                                line_array = line.split("/")
-                                if len(line_array) > 1 \
-                                    and "docker-" in line_array[len(line_array) -1] \
-                                    and ".scope" in line_array[len(line_array) -1]:
-
-                                    new_id = line_array[len(line_array) -1].replace("docker-", "")
-                                    new_id = new_id.replace(".scope", "")
-                                    if len(new_id) == 65:
-                                        disk_dict[key]["container_ID"] = new_id
-                                        break
-                    except IOError:
-                        continue
+                disk_dict[key]["sum_lat"] = float(v.sum_ts_deltas) / 1000
+                disk_dict[key]["container_ID"] = self.container_resolver.resolve(key)
 
             disk_dict =  self._aggregate_metrics_by_container(disk_dict)
             disk_counts.clear()
 
+            if self.monitor_block:
+                self._add_block_metrics(disk_dict)
+
         file_dict = {}
         if (self.monitor_file):
             counter = 0
+            self.file_path_cache.invalidate(self.disk_monitor.get_table("invalidated_files"))
             file_counts = self.disk_monitor.get_table("counts_by_file")
-            for k, v in reversed(sorted(file_counts.items(), key=lambda counts_f: (counts_f[1].bytes_r+counts_f[1].bytes_w))):
-                if (self._include_file_path(k.name, k.parent1, k.parent2) != False) and counter < self.number_files_to_keep:
-                    key = self._include_file_path(k.name, k.parent1, k.parent2)
-                    file_dict[key] = FileInfo()
-                    file_dict[key].set_file_path(key)
-                    file_dict[key].set_kb_r(int(v.bytes_r/1000))
-                    file_dict[key].set_kb_w(int(v.bytes_w/1000))
-                    file_dict[key].set_num_r(int(v.num_r))
-                    file_dict[key].set_num_w(int(v.num_w))
-                    file_dict[key].set_file_id(counter)
-                    counter+=1
+            top_files = heapq.nlargest(self.number_files_to_keep, file_counts.items(),
+                key=lambda counts_f: (counts_f[1].bytes_r+counts_f[1].bytes_w))
+            for k, v in top_files:
+                # pseudo filesystems (e.g. /proc) are already filtered in kernel
+                names = [name.value for name in v.name]
+                key = self.file_path_cache.get_path(k.dev, k.ino, v.tgid, names, v.root)
+                file_dict[key] = FileInfo()
+                file_dict[key].set_file_path(key)
+                file_dict[key].set_kb_r(int(v.bytes_r/1000))
+                file_dict[key].set_kb_w(int(v.bytes_w/1000))
+                file_dict[key].set_num_r(int(v.num_r))
+                file_dict[key].set_num_w(int(v.num_w))
+                file_dict[key].set_file_id(counter)
+                counter+=1
 
             file_counts.clear()
 
@@ -128,31 +193,146 @@ class DiskCollector:
         aggregate_dict['disk_sample'] = disk_dict
         return aggregate_dict
 
+    def _get_empty_container_entry(self, container_id):
+        entry = {}
+        entry["full_ID"] = container_id
+        entry["kb_r"] = 0
+        entry["kb_w"] = 0
+        entry["num_r"] = 0
+        entry["num_w"] = 0
+        entry["avg_lat"] = 0
+        entry["blk_kb_r"] = 0
+        entry["blk_kb_w"] = 0
+        entry["blk_p50_lat"] = 0
+        entry["blk_p99_lat"] = 0
+        entry["pids"] = []
+        return entry
+
     def _aggregate_metrics_by_container(self, disk_sample):
         container_dict = dict()
         for pid in disk_sample:
             shortened_ID = disk_sample[pid]["container_ID"][:12]
             if shortened_ID not in container_dict:
-                container_dict[shortened_ID] = {}
-                container_dict[shortened_ID]["full_ID"] = disk_sample[pid]["container_ID"]
-                container_dict[shortened_ID]["kb_r"] = 0
-                container_dict[shortened_ID]["kb_w"] = 0
-                container_dict[shortened_ID]["num_r"] = 0
-                container_dict[shortened_ID]["num_w"] = 0
-                container_dict[shortened_ID]["avg_lat"] = 0
-                container_dict[shortened_ID]["pids"] = []
+                container_dict[shortened_ID] = self._get_empty_container_entry(disk_sample[pid]["container_ID"])
             container_dict[shortened_ID]["kb_r"] += disk_sample[pid]["kb_r"]
             container_dict[shortened_ID]["kb_w"] += disk_sample[pid]["kb_w"]
             container_dict[shortened_ID]["num_r"] += disk_sample[pid]["num_r"]
             container_dict[shortened_ID]["num_w"] += disk_sample[pid]["num_w"]
-            container_dict[shortened_ID]["num_w"] += disk_sample[pid]["num_w"]
-            container_dict[shortened_ID]["avg_lat"] += disk_sample[pid]["avg_lat"]
+            container_dict[shortened_ID]["avg_lat"] += disk_sample[pid]["sum_lat"]
             container_dict[shortened_ID]["pids"].append(pid)
         for k,v in container_dict.items():
-            container_dict[k]["avg_lat"] = container_dict[k]["avg_lat"] /  len(container_dict[k]["pids"])
+            # mean over all the reads and writes of the container
+            num_ops = container_dict[k]["num_r"] + container_dict[k]["num_w"]
+            if num_ops > 0:
+                container_dict[k]["avg_lat"] = container_dict[k]["avg_lat"] / num_ops
 
         return container_dict
 
+    def _add_block_metrics(self, container_dict):
+        block_latency = self.disk_monitor.get_table("block_latency")
+        block_counts = self.disk_monitor.get_table("block_counts")
+        latencies = block_latency.items()
+        counts = block_counts.items()
+        block_latency.clear()
+        block_counts.clear()
+
+        cgroup_ids = set([k.cgroup_id for k, v in counts] + [k.cgroup_id for k, v in latencies])
+        cgroup_containers = self.container_resolver.resolve_cgroups(list(cgroup_ids))
+
+        # sum up the cgroups and devices of each container
+        for k, v in counts:
+            entry = self._get_block_entry(container_dict, cgroup_containers[k.cgroup_id])
+            entry["blk_kb_r"] += int(v.bytes_r/1000)
+            entry["blk_kb_w"] += int(v.bytes_w/1000)
+
+        histograms = {}
+        for k, v in latencies:
+            container_id = cgroup_containers[k.cgroup_id]
+            self._get_block_entry(container_dict, container_id)
+            histogram = histograms.setdefault(container_id[:12], {})
+            histogram[k.slot] = histogram.get(k.slot, 0) + v.value
+
+        for shortened_ID, histogram in histograms.items():
+            container_dict[shortened_ID]["blk_p50_lat"] = get_log2_percentile(histogram, 50)
+            container_dict[shortened_ID]["blk_p99_lat"] = get_log2_percentile(histogram, 99)
+
+    def _get_block_entry(self, container_dict, container_id):
+        shortened_ID = container_id[:12]
+        if shortened_ID not in container_dict:
+            # block I/O without VFS calls in this sample
+            container_dict[shortened_ID] = self._get_empty_container_entry(container_id)
+        return container_dict[shortened_ID]
+
+
+
+class FilePathCache:
+    """
+    Full paths of the files reported by DiskCollector, in a LRU cache keyed
+    by (device, inode). Paths are resolved only for the files that are
+    reported, by looking for the file among the open fds of the last
+    process that used it. When the file is not open anymore the path is
+    rebuilt from the names copied in kernel when the file was first seen,
+    relative to the root of its filesystem, or starting with ".../" when
+    it is deeper than the names. Both are cached, so the fds of a process
+    are listed at most once per file. The kernel reports renamed and
+    deleted files, and their paths are dropped from the cache.
+    """
+
+    def __init__(self, proc_path="/host/proc", max_entries=4096):
+        self.proc_path = proc_path
+        self.max_entries = max_entries
+        self.cache = OrderedDict()
+
+    def _to_userspace_dev(self, dev):
+        # the kernel keeps 12 bits of major and 20 of minor in s_dev
+        return os.makedev(dev >> 20, dev & 0xfffff)
+
+    def _resolve(self, dev, ino, tgid):
+        fd_path = os.path.join(self.proc_path, str(tgid), "fd")
+        try:
+            fds = os.listdir(fd_path)
+        except OSError:
+            return None
+
+        for fd in fds:
+            try:
+                st = os.stat(os.path.join(fd_path, fd))
+            except OSError:
+                continue
+            if st.st_ino == ino and st.st_dev == self._to_userspace_dev(dev):
+                try:
+                    return os.readlink(os.path.join(fd_path, fd))
+                except OSError:
+                    return None
+        return None
+
+    def _get_kernel_path(self, names, root):
+        # names are leaf first, the name of the root of the filesystem is "/"
+        names = [name.decode("utf-8", "replace") for name in names if len(name) > 0]
+        if root:
+            return "/" + "/".join(reversed(names[:-1]))
+        return ".../" + "/".join(reversed(names))
+
+    def get_path(self, dev, ino, tgid, names, root):
+        key = (dev, ino)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        path = self._resolve(dev, ino, tgid)
+        if path is None:
+            # file is not open anymore
+            path = self._get_kernel_path(names, root)
+
+        self.cache[key] = path
+        if len(self.cache) > self.max_entries:
+            self.cache.popitem(last=False)
+        return path
+
+    def invalidate(self, invalidated_files):
+        for k, v in invalidated_files.items():
+            self.cache.pop((k.dev, k.ino), None)
+        invalidated_files.clear()
 
 
 class FileInfo:
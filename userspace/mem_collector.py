@@ -18,12 +18,36 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+from .container_resolver import ContainerResolver
+from concurrent.futures import ThreadPoolExecutor
+import heapq
 import os
+import threading
+import time
 
 class MemCollector:
-    def __init__ (self):
+    """
+    Per-process memory from /proc, aggregated by container.
+    RSS is read from statm for every process at each sample. PSS and USS
+    need a full smaps walk, so they are refreshed in background for at most
+    smaps_budget processes per sample, starting from the ones with the
+    oldest values, and the latest values are reported for the others.
+    """
+
+    def __init__ (self, container_resolver=None, smaps_budget=64, max_workers=4):
         self.mem_dictionary = dict()
+        if container_resolver is None:
+            container_resolver = ContainerResolver()
+        self.container_resolver = container_resolver
         self.proc_path = "/host/proc"
+        self.page_size_kb = os.sysconf("SC_PAGE_SIZE") / 1024
+
+        self.smaps_budget = smaps_budget
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        # pid -> (refresh time, PSS, USS)
+        self.smaps_cache = {}
+        self.smaps_pending = set()
+        self.lock = threading.Lock()
 
     def get_mem_dictionary(self):
         self.mem_dictionary = self._aggregate_mem_metrics(self._get_sample())
@@ -50,67 +74,150 @@ class MemCollector:
             container_dict[shortened_ID]["pids"].append(pid)
         return container_dict
 
+    def _read_rss(self, pid):
+        # second field of statm is the resident set size in pages
+        with open(os.path.join(self.proc_path, str(pid), "statm"), "r") as f:
+            return int(int(f.read().split()[1]) * self.page_size_kb)
+
+    def _read_smaps(self, pid):
+        pss = 0
+        uss = 0
+        #USS and PSS from smaps_rollup, or from smaps when smaps_rollup isn't in proc
+        smaps_path = os.path.join(self.proc_path, str(pid), "smaps_rollup")
+        if not os.path.exists(smaps_path):
+            smaps_path = os.path.join(self.proc_path, str(pid), "smaps")
+        with open(smaps_path, "r") as f:
+            for line in f:
+                s = line.replace(" ","").replace("\n","").split(':')
+                if (s[0] == "Pss"):
+                    pss += int(s[1][:-2])
+                elif (s[0] == "Private_Clean" or s[0] == "Private_Dirty" or s[0] == "Private_Hugetlb"):
+                    uss += int(s[1][:-2])
+        return pss, uss
+
+    def _refresh_smaps(self, pid):
+        try:
+            pss, uss = self._read_smaps(pid)
+        except IOError:
+            # process terminated, or kernel thread without smaps. It is
+            # marked as refreshed anyway to move on with the rotation
+            pss, uss = 0, 0
+        with self.lock:
+            self.smaps_cache[pid] = (time.time(), pss, uss)
+            self.smaps_pending.discard(pid)
+
+    def _schedule_smaps_refresh(self, pid_list):
+        # pids never scanned come first, then the least recently refreshed
+        with self.lock:
+            candidates = [pid for pid in pid_list if pid not in self.smaps_pending]
+            to_refresh = heapq.nsmallest(self.smaps_budget, candidates,
+                key=lambda pid: self.smaps_cache.get(pid, (0, 0, 0))[0])
+            self.smaps_pending.update(to_refresh)
+        for pid in to_refresh:
+            self.executor.submit(self._refresh_smaps, pid)
+
     def _get_sample(self):
         pid_dict = dict()
-        for pid in self._get_pid_list():
+        pid_list = self._get_pid_list()
+        self._schedule_smaps_refresh(pid_list)
+
+        with self.lock:
+            # forget the processes that are gone
+            live_pids = set(pid_list)
+            for pid in [pid for pid in self.smaps_cache if pid not in live_pids]:
+                del self.smaps_cache[pid]
+            smaps_cache = dict(self.smaps_cache)
+
+        for pid in pid_list:
+            try:
+                rss = self._read_rss(pid)
+            except IOError:
+                continue
             pid_dict[pid] = {}
-            pid_dict[pid]["RSS"] = 0
-            pid_dict[pid]["USS"] = 0
-            pid_dict[pid]["PSS"] = 0
-            pid_dict[pid]["container_ID"] = "---others---"
-            #USS and PSS from smaps_rollup
-            if (os.path.exists(os.path.join(self.proc_path,str(pid),"smaps_rollup"))):
-                try:
-                    with open(os.path.join(self.proc_path,str(pid),"smaps_rollup"),"r") as f:
-                        for line in f:
-                            s = line.replace(" ","").replace("\n","").split(':')
-                            if (s[0] == "Rss"):
-                                pid_dict[pid]["RSS"] = int(s[1][:-2])
-                            elif (s[0] == "Pss"):
-                                pid_dict[pid]["PSS"] = int(s[1][:-2])
-                            elif (s[0] == "Private_Clean" or s[0] == "Private_Dirty" or s[0] == "Private_Hugetlb"):
-                                pid_dict[pid]["USS"] += int(s[1][:-2])
-                except IOError:
-                    continue
-            #USS and PSS from smaps when smaps_rollup isn't in proc
-            else:
-                try:
-                    with open(os.path.join(self.proc_path,str(pid),"smaps"),"r") as f:
-                        for line in f:
-                            s = line.replace(" ","").replace("\n","").split(':')
-                            if (s[0] == "Pss"):
-                                pid_dict[pid]["RSS"] += int(s[1][:-2])
-                            elif (s[0] == "Pss"):
-                                pid_dict[pid]["PSS"] += int(s[1][:-2])
-                            elif (s[0] == "Private_Clean" or s[0] == "Private_Dirty" or s[0] == "Private_Hugetlb"):
-                                pid_dict[pid]["USS"] += int(s[1][:-2])
-                except IOError:
-                    continue
+            pid_dict[pid]["RSS"] = rss
+            refresh_time, pid_dict[pid]["PSS"], pid_dict[pid]["USS"] = smaps_cache.get(pid, (0, 0, 0))
             #assign container ID from proc
-            if (os.path.exists(os.path.join(self.proc_path,str(pid),"cgroup"))):
-                try:
-                    with open(os.path.join(self.proc_path, str(pid), 'cgroup'), 'r') as f:
-                        for line in f:
-                            line_array = line.split("/")
-                            if len(line_array) > 1 and \
-                                len(line_array[len(line_array) -1]) == 65:
-                                pid_dict[pid]["container_ID"] = line_array[len(line_array) -1][:-1]
-                except IOError:
-                    continue
-                # systemd Docker
-                try:
-                    with open(os.path.join(self.proc_path, str(pid), 'cgroup'), 'r') as f:
-                        for line in f:
-                            line_array = line.split("/")
-                            if len(line_array) > 1 \
-                                and "docker-" in line_array[len(line_array) -1] \
-                                and ".scope" in line_array[len(line_array) -1]:
-
-                                new_id = line_array[len(line_array) -1].replace("docker-", "")
-                                new_id = new_id.replace(".scope", "")
-                                if len(new_id) == 65:
-                                    pid_dict[pid]["container_ID"] = new_id
-                except IOError:
-                    continue
+            pid_dict[pid]["container_ID"] = self.container_resolver.resolve(pid)
 
         return pid_dict
+
+
+class CgroupMemCollector:
+    """
+    Per-container memory read from the memory controller of each container
+    cgroup: one memory.stat per container instead of one smaps per pid.
+    RSS is anonymous plus mapped file memory, USS is anonymous memory.
+    The kernel does not account PSS per cgroup, it is reported as None.
+    Processes outside of containers are not accounted in ---others---.
+    """
+
+    def __init__ (self, container_resolver=None):
+        self.mem_dictionary = dict()
+        if container_resolver is None:
+            container_resolver = ContainerResolver()
+        self.container_resolver = container_resolver
+        self.cgroup_paths = ["/host/sys/fs/cgroup", "/sys/fs/cgroup"]
+        self.container_cgroups = {}
+        self.cgroup_v2 = False
+        # look for new containers every rescan_interval samples
+        self.rescan_interval = 5
+        self.sample_count = 0
+
+    def get_mem_dictionary(self):
+        self.mem_dictionary = self._get_sample()
+        return self.mem_dictionary
+
+    def _scan_container_cgroups(self):
+        for path in self.cgroup_paths:
+            if os.path.exists(os.path.join(path, "cgroup.controllers")):
+                self.cgroup_v2 = True
+            elif os.path.isdir(os.path.join(path, "memory")):
+                self.cgroup_v2 = False
+                path = os.path.join(path, "memory")
+            else:
+                continue
+            self.container_cgroups = self.container_resolver.find_container_cgroups(path)
+            return
+
+    def _read_memory_stat(self, cgroup_path):
+        stat = {}
+        with open(os.path.join(cgroup_path, "memory.stat"), "r") as f:
+            for line in f:
+                s = line.split()
+                if len(s) == 2:
+                    stat[s[0]] = int(s[1])
+        if self.cgroup_v2:
+            anon = stat.get("anon", 0)
+            mapped_file = stat.get("file_mapped", 0)
+        else:
+            # the total_ counters include the child cgroups
+            anon = stat.get("total_rss", stat.get("rss", 0))
+            mapped_file = stat.get("total_mapped_file", stat.get("mapped_file", 0))
+        # bytes to Kb, as in smaps
+        return int((anon + mapped_file) / 1024), int(anon / 1024)
+
+    def _get_sample(self):
+        if self.sample_count % self.rescan_interval == 0:
+            self._scan_container_cgroups()
+        self.sample_count = self.sample_count + 1
+
+        container_dict = dict()
+        removed = []
+        for container_id, cgroup_path in self.container_cgroups.items():
+            try:
+                rss, uss = self._read_memory_stat(cgroup_path)
+            except IOError:
+                # container is gone
+                removed.append(container_id)
+                continue
+            shortened_ID = container_id[:12]
+            container_dict[shortened_ID] = {}
+            container_dict[shortened_ID]["full_ID"] = container_id
+            container_dict[shortened_ID]["RSS"] = rss
+            container_dict[shortened_ID]["PSS"] = None
+            container_dict[shortened_ID]["USS"] = uss
+            container_dict[shortened_ID]["pids"] = []
+
+        for container_id in removed:
+            self.container_cgroups.pop(container_id, None)
+        return container_dict
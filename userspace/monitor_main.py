@@ -19,12 +19,15 @@
 """
 
 from .bpf_collector import BpfCollector
+from .bpf_loader import BpfProgramLoader
 from .proc_topology import ProcTopology
 from .sample_controller import SampleController
 from .process_table import ProcTable
 from .net_collector import NetCollector
 from .mem_collector import MemCollector
+from .mem_collector import CgroupMemCollector
 from .disk_collector import DiskCollector
+from .container_resolver import ContainerResolver
 from .rapl.rapl import RaplMonitor
 import os
 import socket
@@ -37,39 +40,54 @@ except ImportError:
 
 class MonitorMain():
 
-    def __init__(self, output_format, window_mode, debug_mode, net_monitor, nat_trace, print_net_details, dynamic_tcp_client_port_masking, power_measure, memory_measure, disk_measure, file_measure):
+    def __init__(self, output_format, window_mode, debug_mode, net_monitor, nat_trace, print_net_details, dynamic_tcp_client_port_masking, power_measure, memory_measure, disk_measure, file_measure, columnar_sample, power_model, percpu_maps, cgroup_aggregation, memory_mode, vfs_probe_mode, net_table_size, http_path_templating, http_path_limit):
         self.output_format = output_format
         self.window_mode = window_mode
         # TODO: Don't hardcode the frequency
         self.frequency = 1
 
         self.topology = ProcTopology()
-        self.collector = BpfCollector(self.topology, debug_mode, power_measure)
+        # pid to container mapping shared by all the collectors
+        self.container_resolver = ContainerResolver()
+        # the scheduler program is loaded first, then the network and disk
+        # programs are compiled in background while the rest of the monitor
+        # is set up
+        self.bpf_loader = BpfProgramLoader()
+        self.collector = BpfCollector(self.topology, debug_mode, power_measure, columnar_sample, power_model, percpu_maps, self.bpf_loader, cgroup_aggregation, self.container_resolver)
+        if net_monitor:
+            self.net_collector = NetCollector(trace_nat = nat_trace, dynamic_tcp_client_port_masking=dynamic_tcp_client_port_masking, loader=self.bpf_loader, table_size=net_table_size, http_path_templating=http_path_templating, http_path_limit=http_path_limit, container_resolver=self.container_resolver)
+            self.net_collector.preload()
+        else:
+            self.net_collector = None
+        if disk_measure or file_measure:
+            self.disk_collector = DiskCollector(disk_measure, file_measure, loader=self.bpf_loader, container_resolver=self.container_resolver, vfs_probe_mode=vfs_probe_mode)
+            self.disk_collector.preload()
+        else:
+            self.disk_collector = None
+
         self.sample_controller = SampleController(self.topology.get_hyperthread_count())
-        self.process_table = ProcTable()
+        self.process_table = ProcTable(self.container_resolver)
         self.rapl_monitor = RaplMonitor(self.topology)
         self.started = False
 
         self.print_net_details = print_net_details
         self.net_monitor = net_monitor
         self.dynamic_tcp_client_port_masking = dynamic_tcp_client_port_masking
-        self.net_collector = None
 
         self.mem_measure = memory_measure
         self.mem_collector = None
 
         self.disk_measure = disk_measure
         self.file_measure = file_measure
-        self.disk_collector = None
-
-        if self.net_monitor:
-            self.net_collector = NetCollector(trace_nat = nat_trace, dynamic_tcp_client_port_masking=dynamic_tcp_client_port_masking)
 
         if self.mem_measure:
-            self.mem_collector = MemCollector()
-
-        if self.disk_measure or self.file_measure:
-            self.disk_collector = DiskCollector(disk_measure, file_measure)
+            # smaps gives PSS and USS per process, but it is slow on
+            # hosts with many processes or large address spaces.
+            # memory.stat is read once per container, without PSS
+            if memory_mode == "cgroup":
+                self.mem_collector = CgroupMemCollector(self.container_resolver)
+            else:
+                self.mem_collector = MemCollector(self.container_resolver)
 
     def get_window_mode(self):
         return self.window_mode
@@ -92,6 +110,8 @@ class MonitorMain():
                 self.disk_collector.start_capture()
         else:
             print("Please provide a window mode")
+        # every program has been loaded
+        self.bpf_loader.shutdown()
 
 
     def get_sample(self):
@@ -118,18 +138,20 @@ class MonitorMain():
                 file_dict = aggregate_disk_sample['file_sample']
 
         nat_data = []
+        net_sample = None
         if self.net_monitor:
             net_sample = self.net_collector.get_sample()
             self.process_table.add_process_from_sample(sample, \
                 net_dictionary=net_sample.get_pid_dictionary(), \
-                nat_dictionary=net_sample.get_nat_dictionary())
+                nat_dictionary=net_sample.get_nat_dictionary(), \
+                nat_index_dictionary=net_sample.get_nat_index_dictionary())
         else:
             self.process_table.add_process_from_sample(sample)
 
         # Now, extract containers!
         container_list = self.process_table.get_container_dictionary(mem_dict, disk_dict)
 
-        return [sample, container_list, self.process_table.get_proc_table(), nat_data, file_dict]
+        return [sample, container_list, self.process_table.get_proc_table(), nat_data, file_dict, net_sample]
 
 
     def monitor_loop(self):
@@ -151,7 +173,11 @@ class MonitorMain():
             if self.output_format == "json":
                 for key, value in container_list.items():
                     print(value.to_json())
-                print(sample.get_log_json())
+                net_sample = sample_array[5]
+                if net_sample is not None:
+                    print(sample.get_log_json(net_sample.get_map_stats()))
+                else:
+                    print(sample.get_log_json())
 
             elif self.output_format == "console":
                 if self.print_net_details:
@@ -171,6 +197,9 @@ class MonitorMain():
                 print('│')
                 print('└─╼', end='\t')
                 print(sample.get_log_line())
+                net_sample = sample_array[5]
+                if net_sample is not None and (net_sample.get_map_failures() > 0 or net_sample.get_map_evictions() > 0):
+                    print(net_sample.get_map_stats_line())
                 print()
                 print()
 
@@ -24,8 +24,15 @@ import numpy as np
 from socket import inet_ntop, AF_INET, AF_INET6
 from struct import pack
 from collections import namedtuple
+import copy
+import math
 import os
-from ddsketch.ddsketch import DDSketch
+import re
+from .transaction_data import LATENCY_RELATIVE_ACCURACY
+from .transaction_data import LatencySketch
+from .transaction_data import TransactionType
+from .transaction_data import TransactionRole
+from .transaction_data import TransactionData
 
 
 from enum import Enum
@@ -68,6 +75,19 @@ def get_ipv6_http_session_key(k):
                          dport=k.dport,
                          path=k.http_payload)
 
+def get_raw_session_key(k, type):
+    # hashable key of the fields of k without the latency slot, the same for
+    # the summary and the latency entries of a session
+    if type is TransactionType.ipv4_tcp:
+        return (k.saddr, k.lport, k.daddr, k.dport)
+    elif type is TransactionType.ipv4_http:
+        return (k.saddr, k.lport, k.daddr, k.dport, k.http_payload)
+    elif type is TransactionType.ipv6_tcp:
+        return (bytes(k.saddr), k.lport, bytes(k.daddr), k.dport)
+    elif type is TransactionType.ipv6_http:
+        return (bytes(k.saddr), k.lport, bytes(k.daddr), k.dport, k.http_payload)
+    return None
+
 def get_session_key_by_type(k, type):
     if type is TransactionType.ipv4_tcp:
         return get_ipv4_session_key(k)
@@ -79,72 +99,37 @@ def get_session_key_by_type(k, type):
         return get_ipv6_http_session_key(k)
     return None
 
-class TransactionType(Enum):
-    ipv4_tcp = 0
-    ipv4_http = 1
-    ipv6_tcp = 2
-    ipv6_http = 3
+HTTP_UUID_SEGMENT = re.compile(r'^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$')
+HTTP_NUMERIC_SEGMENT = re.compile(r'^[0-9]+$')
+HTTP_OVERFLOW_PATH = "{other}"
+
+def get_http_path_template(payload):
+    # "GET /users/42/orders HTTP/1.1" -> "GET /users/{id}/orders HTTP/1.1"
+    if isinstance(payload, bytes):
+        payload = payload.decode("utf-8", "replace")
+    request = payload.split(" ")
+    if len(request) < 2:
+        return payload
+    segments = request[1].split("/")
+    for i in range(0, len(segments)):
+        if HTTP_NUMERIC_SEGMENT.match(segments[i]):
+            segments[i] = "{id}"
+        elif HTTP_UUID_SEGMENT.match(segments[i]):
+            segments[i] = "{uuid}"
+    request[1] = "/".join(segments)
+    return " ".join(request)
 
-class TransactionRole(Enum):
-    client = -1
-    server = 1
-
-class TransactionData:
-
-    def __init__(self, type, role, saddr, lport, daddr, dport, transaction_count, byte_rx, byte_tx):
+class NatData:
+    def __init__(self, type, saddr, lport, daddr, dport):
         self.type = type
-        self.role = role
         self.saddr = saddr
         self.lport = lport
         self.daddr = daddr
         self.dport = dport
-        self.t_count = transaction_count
-        self.byte_rx = byte_rx
-        self.byte_tx = byte_tx
-        self.avg = 0
-        self.p50 = 0
-        self.p75 = 0
-        self.p90 = 0
-        self.p99 = 0
-        self.p99_9 = 0
-        self.p99_99 = 0
-        self.p99_999 = 0
-        self.http_path = ""
-        self.samples = []
-
-    def load_latencies(self, latency_sketch, total_time, transaction_count):
-        self.samples = latency_sketch
-        self.avg = float(total_time) / float(transaction_count * 1000000)
-
-        self.p50 = latency_sketch.get_quantile_value(0.5)
-        self.p75 = latency_sketch.get_quantile_value(0.75)
-        self.p90 = latency_sketch.get_quantile_value(0.9)
-        self.p99 = latency_sketch.get_quantile_value(0.99)
-        self.p99_9 = latency_sketch.get_quantile_value(0.999)
-        self.p99_99 = latency_sketch.get_quantile_value(0.9999)
-        self.p99_999 = latency_sketch.get_quantile_value(0.99999)
-
-    def load_http_path(self, path):
-        self.http_path = path
 
     def get_type(self):
         return self.type
 
-    def get_type_str_no_ip(self):
-        if self.type is TransactionType.ipv6_tcp or self.type is TransactionType.ipv4_tcp:
-            return "tcp"
-        else:
-            return "http"
-
-    def get_role(self):
-        return self.role
-
-    def get_role_str(self):
-        if self.role is TransactionRole.client:
-            return "client"
-        else:
-            return "server"
-
     def get_saddr(self):
         return self.saddr
 
@@ -157,134 +142,78 @@ class TransactionData:
     def get_dport(self):
         return self.dport
 
-    def get_transaction_count(self):
-        return self.t_count
-
-    def get_byte_rx(self):
-        return self.byte_rx
-
-    def get_byte_tx(self):
-        return self.byte_tx
-
-    def get_avg_latency(self):
-        return self.avg
-
-    def get_percentiles(self):
-        return [self.p50, self.p75, self.p90, self.p99, self.p99_9, self.p99_99, self.p99_999]
-
-    def get_http_path(self):
-        return self.http_path
-
-    def get_samples(self):
-        return self.samples
-
-    def set_saddr(self, saddr):
-        self.saddr = saddr
-
-    def set_lport(self, lport):
-        self.lport = lport
-
-    def set_daddr(self, daddr):
-        self.daddr = daddr
-
-    def set_dport(self, dport):
-        self.dport = dport
-
-
     def __str__(self):
-        role_str = ""
-        if self.role is TransactionRole.server:
-            role_str = "server"
-        else:
-            role_str = "client"
-
-        output_str = ""
-        if self.type == TransactionType.ipv4_http or self.type == TransactionType.ipv6_http:
-            fmt = '{:<8} {:<40} {:<40} {:<20} {:<20} {:<20} {:<25} {:<68}'
-            output_str = fmt.format(
-                role_str,
-                "SRC: " + str(self.saddr) + ":" + str(self.lport),
-                "DST: " + str(self.daddr) + ":" + str(self.dport),
-                "T_COUNT: " + str(self.t_count),
-                "BYTE_TX: " + str(self.byte_tx),
-                "BYTE_RX: " + str(self.byte_rx),
-                "LAT_AVG (ms): " + '{:.5f}'.format(self.avg),
-                str(self.http_path)
-            )
 
-        else:
-            fmt = '{:<8} {:<40} {:<40} {:<20} {:<20} {:<20} {:<25}'
-            output_str = fmt.format(
-                role_str,
-                "SRC: " + str(self.saddr) + ":" + str(self.lport),
-                "DST: " + str(self.daddr) + ":" + str(self.dport),
-                "T_COUNT: " + str(self.t_count),
-                "BYTE_TX: " + str(self.byte_tx),
-                "BYTE_RX: " + str(self.byte_rx),
-                "LAT_AVG (ms): " + '{:.5f}'.format(self.avg)
-            )
-
-        fmt = '{:<5} {:<30} {:<30} {:<30} {:<30} {:<30} {:<30} {:<30}'
-        output_str = output_str + "\n" + fmt.format(
-            "--->",
-            "50p: " + '{:.5f}'.format(self.p50),
-            "75p: " + '{:.5f}'.format(self.p75),
-            "90p: " + '{:.5f}'.format(self.p90),
-            "99p: " + '{:.5f}'.format(self.p99),
-            "99.9p: " + '{:.5f}'.format(self.p99_9),
-            "99.99p: " + '{:.5f}'.format(self.p99_99),
-            "99.999p: " + '{:.5f}'.format(self.p99_999),
+        fmt = '{:<10} {:<40} {:<40}'
+        output_str = fmt.format(
+            "NAT RULE",
+            "SRC: " + str(self.saddr) + ":" + str(self.lport),
+            "DST: " + str(self.daddr) + ":" + str(self.dport),
         )
 
         return output_str
 
 
 
-class NatData:
-    def __init__(self, type, saddr, lport, daddr, dport):
-        self.type = type
-        self.saddr = saddr
-        self.lport = lport
-        self.daddr = daddr
-        self.dport = dport
-
-    def get_type(self):
-        return self.type
-
-    def get_saddr(self):
-        return self.saddr
+class NatIndex:
+    """
+    NAT rules indexed by the endpoint they rewrite, the source (addr, port)
+    of a rule maps to its destination and the other way around. Only the
+    first rule added for an endpoint is kept.
+    """
 
-    def get_lport(self):
-        return self.lport
+    def __init__(self):
+        self.src_rules = {}
+        self.dst_rules = {}
 
-    def get_daddr(self):
-        return self.daddr
+    def add_nat_rule(self, nat_rule):
+        self.src_rules.setdefault((nat_rule.get_saddr(), nat_rule.get_lport()), (nat_rule.get_daddr(), nat_rule.get_dport()))
+        self.dst_rules.setdefault((nat_rule.get_daddr(), nat_rule.get_dport()), (nat_rule.get_saddr(), nat_rule.get_lport()))
 
-    def get_dport(self):
-        return self.dport
+    def merge(self, nat_index):
+        for key, value in nat_index.src_rules.items():
+            self.src_rules.setdefault(key, value)
+        for key, value in nat_index.dst_rules.items():
+            self.dst_rules.setdefault(key, value)
 
-    def __str__(self):
+    def copy(self):
+        nat_index = NatIndex()
+        nat_index.src_rules = dict(self.src_rules)
+        nat_index.dst_rules = dict(self.dst_rules)
+        return nat_index
 
-        fmt = '{:<10} {:<40} {:<40}'
-        output_str = fmt.format(
-            "NAT RULE",
-            "SRC: " + str(self.saddr) + ":" + str(self.lport),
-            "DST: " + str(self.daddr) + ":" + str(self.dport),
-        )
+    def rewrite(self, transaction):
+        # the transaction is returned as is if no rule applies, otherwise
+        # a rewritten copy is returned
+        src = self.src_rules.get((transaction.get_saddr(), transaction.get_lport()))
+        dst = self.dst_rules.get((transaction.get_daddr(), transaction.get_dport()))
+        if src is None and dst is None:
+            return transaction
 
-        return output_str
+        rewritten = copy.copy(transaction)
+        if src is not None:
+            rewritten.set_saddr(src[0])
+            rewritten.set_lport(src[1])
+        if dst is not None:
+            rewritten.set_daddr(dst[0])
+            rewritten.set_dport(dst[1])
+        return rewritten
 
 
 
 class NetSample:
 
-    def __init__(self, pid_dictionary, nat_dictionary, nat_list, host_transaction_count, host_byte_tx, host_byte_rx):
+    def __init__(self, pid_dictionary, nat_dictionary, nat_list, host_transaction_count, host_byte_tx, host_byte_rx, map_stats=None, nat_index_dictionary=None):
         self.pid_dictionary = pid_dictionary
         self.nat_dictionary = nat_dictionary
+        # pid -> NatIndex of the nat rules of nat_dictionary
+        self.nat_index_dictionary = nat_index_dictionary if nat_index_dictionary is not None else {}
         self.host_transaction_count = host_transaction_count
         self.host_byte_tx = host_byte_tx
         self.host_byte_rx = host_byte_rx
         self.nat_list = nat_list
+        # table name -> inserts, deletes, failures and evictions in the sample
+        self.map_stats = map_stats if map_stats is not None else {}
 
     def get_pid_dictionary(self):
         return self.pid_dictionary
@@ -292,6 +221,9 @@ class NetSample:
     def get_nat_dictionary(self):
         return self.nat_dictionary
 
+    def get_nat_index_dictionary(self):
+        return self.nat_index_dictionary
+
     def get_host_transaction_count(self):
         return self.host_transaction_count
 
@@ -304,17 +236,73 @@ class NetSample:
     def get_nat_list(self):
         return self.nat_list
 
+    def get_map_stats(self):
+        return self.map_stats
+
+    def get_map_failures(self):
+        return sum(stats["failures"] for stats in self.map_stats.values())
+
+    def get_map_evictions(self):
+        return sum(stats["evictions"] for stats in self.map_stats.values())
+
+    def get_map_stats_line(self):
+        # only the tables that lost something in the sample
+        output_str = "NET MAPS"
+        for name, stats in sorted(self.map_stats.items()):
+            if stats["failures"] > 0 or stats["evictions"] > 0:
+                output_str = output_str + " " + name + " failures: " + str(stats["failures"]) \
+                    + " evictions: " + str(stats["evictions"])
+        return output_str
+
 
 
 class NetCollector:
 
-    def __init__(self, trace_nat=False, dynamic_tcp_client_port_masking=False):
+    # order of the tables in the map_stats array of tcp_monitor.c, the first
+    # ones are LRU tables of table_size entries
+    MAP_STATS_TABLES = ["ipv4_endpoints", "ipv6_endpoints", "ipv4_connections", "ipv6_connections", "set_state_cache", "recv_cache", "summary", "latency"]
+    LRU_TABLES = 6
+    MAP_EVENTS = 3
+
+    def __init__(self, trace_nat=False, dynamic_tcp_client_port_masking=False, loader=None, table_size=0, http_path_templating=True, http_path_limit=0, container_resolver=None):
         self.ebpf_tcp_monitor = None
+        self.loader = loader
         self.nat = trace_nat
         self.dynamic_tcp_client_port_masking = dynamic_tcp_client_port_masking
 
+        # numeric and uuid segments of http paths are replaced by a
+        # placeholder, and each container reports at most http_path_limit
+        # distinct paths (0 for no limit), the others go in HTTP_OVERFLOW_PATH
+        self.http_path_templating = http_path_templating
+        self.http_path_limit = int(http_path_limit) if http_path_limit is not None else 0
+        self.container_resolver = container_resolver
+        # container -> paths reported in the last sample
+        self.http_paths = {}
+
+        # size of the connection and endpoint tables, derived from the
+        # connection tracking limit of the host if not set
+        if table_size is not None and int(table_size) > 0:
+            self.table_size = int(table_size)
+        else:
+            self.table_size = self._get_host_table_size()
+
+        # per-cpu counters of the tables, with the totals of the last sample
+        # and an estimate of the entries in the LRU tables
+        self.map_stats = None
+        self.map_stats_totals = [0] * (len(self.MAP_STATS_TABLES) * self.MAP_EVENTS)
+        self.lru_entries = [0] * self.LRU_TABLES
+
         # define hash tables, skip endpoints and connections for now
-        # as they self manage and self clean in eBPF code
+        # as they self manage and self clean in eBPF code.
+        # Summaries and latencies have two inner maps each, the outer maps
+        # point the probes to the one of the current sample
+        self.outer_maps = []
+        self.inner_map_selector = None
+        # raw keys of the summaries read without latency buckets, for each
+        # buffer. A probe was still writing the transaction when the buffer
+        # was read: the summary is left in its inner map for the next read
+        # of the buffer, once
+        self.carried_summaries = [set(), set()]
         self.ipv4_summary = [None, None]
         self.ipv6_summary = [None, None]
         self.ipv4_http_summary = [None, None]
@@ -327,19 +315,42 @@ class NetCollector:
         self.ipv4_http_latency = [None, None]
         self.ipv6_http_latency = [None, None]
 
-        self.latency_index_max = 240
-        self.bucket_count = 15
-        self.latency_bucket_size = 16
+        # latencies are counted in kernel in the buckets of a DDSketch
+        # mapping with this relative accuracy, see LatencySketch
+        self.latency_relative_accuracy = LATENCY_RELATIVE_ACCURACY
 
         self.tcp_dyn_masking_threshold = 10
 
-    def start_capture(self):
-        bpf_code_path = os.path.dirname(os.path.abspath(__file__)) \
-                        + "/../bpf/tcp_monitor.c"
-
-        cflags = ["-DLATENCY_SAMPLES=%d" % self.latency_index_max, \
-                    "-DLATENCY_BUCKET_SIZE=%d" % self.latency_bucket_size, \
-                    "-DBUCKET_COUNT=%d" % self.bucket_count]
+        # raw keys -> session keys and raw addresses -> strings, the same
+        # endpoints show up at every sample and are formatted only once.
+        # The caches are emptied when they reach key_cache_size entries
+        self.session_keys = {}
+        self.addresses = {}
+        self.key_cache_size = 65536
+
+        # BPF_MAP_LOOKUP_BATCH and BPF_MAP_DELETE_BATCH are available from
+        # kernel 5.6, and not for every map type. We find out at the first
+        # sample of each table if we have to fall back to one syscall per key
+        self.batch_lookup_unsupported = set()
+        self.batch_delete_unsupported = set()
+
+    def _get_host_table_size(self, min_size=100000, max_size=1048576):
+        # one entry per tracked connection, bounded to keep the tables of
+        # hosts with huge conntrack limits in a reasonable amount of memory
+        for path in ["/host/proc", "/proc"]:
+            try:
+                with open(os.path.join(path, "sys/net/netfilter/nf_conntrack_max"), "r") as f:
+                    return max(min_size, min(max_size, int(f.read().strip())))
+            except (IOError, ValueError):
+                continue
+        return min_size
+
+    def get_cflags(self):
+        # multiplier of the mapping, 1 / log2(gamma) with linear interpolation
+        # of log2, in fixed point with 16 fractional bits
+        gamma_mantissa = 2 * self.latency_relative_accuracy / (1 - self.latency_relative_accuracy)
+        cflags = ["-DLATENCY_MULTIPLIER=%d" % round(65536 / math.log1p(gamma_mantissa))]
+        cflags.append("-DCONNECTION_TABLE_SIZE=%d" % self.table_size)
         if self.nat:
             cflags.append("-DBYPASS")
             cflags.append("-DREVERSE_BYPASS")
@@ -352,34 +363,204 @@ class NetCollector:
         if self.dynamic_tcp_client_port_masking:
             cflags.append("-DDYN_TCP_CLIENT_PORT_MASKING")
             cflags.append("-DDYN_TCP_CLIENT_PORT_MASKING_THRESHOLD=%d" % self.tcp_dyn_masking_threshold)
+        return cflags
 
-        # print(cflags)
+    def preload(self):
+        # start compiling the program while the other collectors are set up
+        if self.loader is not None:
+            self.loader.preload("tcp_monitor.c", self.get_cflags())
 
-        self.ebpf_tcp_monitor = BPF(src_file=bpf_code_path, cflags=cflags)
+    def start_capture(self):
+        cflags = self.get_cflags()
+        # print(cflags)
 
-        self.ipv4_summary[0] = self.ebpf_tcp_monitor["ipv4_summary"]
-        self.ipv6_summary[0] = self.ebpf_tcp_monitor["ipv6_summary"]
-        self.ipv4_http_summary[0] = self.ebpf_tcp_monitor["ipv4_http_summary"]
-        self.ipv6_http_summary[0] = self.ebpf_tcp_monitor["ipv6_http_summary"]
-        self.ipv4_summary[1] = self.ebpf_tcp_monitor["ipv4_summary_1"]
-        self.ipv6_summary[1] = self.ebpf_tcp_monitor["ipv6_summary_1"]
-        self.ipv4_http_summary[1] = self.ebpf_tcp_monitor["ipv4_http_summary_1"]
-        self.ipv6_http_summary[1] = self.ebpf_tcp_monitor["ipv6_http_summary_1"]
+        if self.loader is not None:
+            self.ebpf_tcp_monitor = self.loader.get("tcp_monitor.c", cflags)
+        else:
+            bpf_code_path = os.path.dirname(os.path.abspath(__file__)) \
+                            + "/../bpf/tcp_monitor.c"
+            self.ebpf_tcp_monitor = BPF(src_file=bpf_code_path, cflags=cflags)
+
+        self.ipv4_summary = self._get_inner_maps("ipv4_summary")
+        self.ipv6_summary = self._get_inner_maps("ipv6_summary")
+        self.ipv4_http_summary = self._get_inner_maps("ipv4_http_summary")
+        self.ipv6_http_summary = self._get_inner_maps("ipv6_http_summary")
         self.rewritten_rules = self.ebpf_tcp_monitor["rewritten_rules"]
         self.rewritten_rules_6 = self.ebpf_tcp_monitor["rewritten_rules_6"]
 
-        self.ipv4_latency[0] = self.ebpf_tcp_monitor["ipv4_latency"]
-        self.ipv6_latency[0] = self.ebpf_tcp_monitor["ipv6_latency"]
-        self.ipv4_http_latency[0] = self.ebpf_tcp_monitor["ipv4_http_latency"]
-        self.ipv6_http_latency[0] = self.ebpf_tcp_monitor["ipv6_http_latency"]
-        self.ipv4_latency[1] = self.ebpf_tcp_monitor["ipv4_latency_1"]
-        self.ipv6_latency[1] = self.ebpf_tcp_monitor["ipv6_latency_1"]
-        self.ipv4_http_latency[1] = self.ebpf_tcp_monitor["ipv4_http_latency_1"]
-        self.ipv6_http_latency[1] = self.ebpf_tcp_monitor["ipv6_http_latency_1"]
+        self.ipv4_latency = self._get_inner_maps("ipv4_latency")
+        self.ipv6_latency = self._get_inner_maps("ipv6_latency")
+        self.ipv4_http_latency = self._get_inner_maps("ipv4_http_latency")
+        self.ipv6_http_latency = self._get_inner_maps("ipv6_http_latency")
 
-        self.bpf_config = self.ebpf_tcp_monitor["conf"]
+        self.map_stats = self.ebpf_tcp_monitor["map_stats"]
+
+        self.inner_map_selector = self.ebpf_tcp_monitor["inner_map_selector"]
         self.selector = 0
-        self.bpf_config[ct.c_int(0)] = ct.c_uint(self.selector)
+        self._swap_inner_maps()
+
+    def _get_inner_maps(self, name):
+        # the outer maps point to both inner maps for the whole run
+        outer_map = self.ebpf_tcp_monitor[name]
+        inner_maps = [self.ebpf_tcp_monitor[name + "_a"], self.ebpf_tcp_monitor[name + "_b"]]
+        for index, inner_map in enumerate(inner_maps):
+            outer_map[ct.c_int(index)] = ct.c_int(inner_map.get_fd())
+        self.outer_maps.append((outer_map, inner_maps))
+        return inner_maps
+
+    def _swap_inner_maps(self):
+        # a single write moves all the probes to the other inner maps, each
+        # probe reads the selector once and writes the summary and the
+        # latency of a transaction to the same buffer
+        self.inner_map_selector[ct.c_int(0)] = ct.c_int(self.selector)
+
+    def _snapshot_table(self, table):
+        # Copy a whole bpf map in userspace, with batched syscalls when the
+        # kernel supports BPF_MAP_LOOKUP_BATCH
+        if table.name not in self.batch_lookup_unsupported:
+            try:
+                return list(table.items_lookup_batch())
+            except Exception:
+                self.batch_lookup_unsupported.add(table.name)
+        return list(table.items())
+
+    def _clear_table(self, table, keys):
+        # Delete the keys read from an inner map that is not written anymore,
+        # with a single BPF_MAP_DELETE_BATCH syscall when the kernel supports it
+        if len(keys) == 0:
+            return
+        if table.name not in self.batch_delete_unsupported:
+            try:
+                table.items_delete_batch((type(keys[0]) * len(keys))(*keys))
+                return
+            except Exception:
+                # keys deleted in the meantime fail the batch too, the rest
+                # is deleted one by one from now on
+                self.batch_delete_unsupported.add(table.name)
+        for key in keys:
+            try:
+                del table[key]
+            except KeyError:
+                continue
+
+    def _get_map_stats(self):
+        # counters are cumulative, report the events of the last sample
+        map_stats = {}
+        for i in range(0, len(self.MAP_STATS_TABLES)):
+            deltas = []
+            for event in range(0, self.MAP_EVENTS):
+                index = i * self.MAP_EVENTS + event
+                total = sum(self.map_stats[ct.c_int(index)])
+                deltas.append(total - self.map_stats_totals[index])
+                self.map_stats_totals[index] = total
+
+            # LRU tables evict silently: keep an estimate of the entries of
+            # the table and count as evicted the new keys that do not fit
+            evictions = 0
+            if i < self.LRU_TABLES:
+                entries = self.lru_entries[i] + deltas[0] - deltas[1]
+                entries = max(0, entries)
+                if entries > self.table_size:
+                    evictions = entries - self.table_size
+                    entries = self.table_size
+                self.lru_entries[i] = entries
+
+            map_stats[self.MAP_STATS_TABLES[i]] = {
+                "inserts": deltas[0],
+                "deletes": deltas[1],
+                "failures": deltas[2],
+                "evictions": evictions
+            }
+        return map_stats
+
+    def get_table_size(self):
+        return self.table_size
+
+    def _get_address(self, family, addr):
+        address = self.addresses.get(addr)
+        if address is None:
+            if len(self.addresses) >= self.key_cache_size:
+                self.addresses = {}
+            if family == AF_INET:
+                address = inet_ntop(AF_INET, pack("I", addr))
+            else:
+                address = inet_ntop(AF_INET6, addr)
+            self.addresses[addr] = address
+        return address
+
+    def _get_session_key(self, raw_key, transaction_type):
+        formatted_key = self.session_keys.get(raw_key)
+        if formatted_key is not None:
+            return formatted_key
+        if len(self.session_keys) >= self.key_cache_size:
+            self.session_keys = {}
+
+        family = AF_INET6
+        if transaction_type == TransactionType.ipv4_tcp or transaction_type == TransactionType.ipv4_http:
+            family = AF_INET
+        saddr = self._get_address(family, raw_key[0])
+        daddr = self._get_address(family, raw_key[2])
+
+        if transaction_type == TransactionType.ipv4_http or transaction_type == TransactionType.ipv6_http:
+            if self.http_path_templating == True:
+                path = get_http_path_template(raw_key[4])
+            else:
+                path = raw_key[4].decode("utf-8", "replace")
+            formatted_key = HTTPSessionKey(saddr=saddr, lport=raw_key[1], daddr=daddr, dport=raw_key[3], path=path)
+        else:
+            formatted_key = TCPSessionKey(saddr=saddr, lport=raw_key[1], daddr=daddr, dport=raw_key[3])
+        self.session_keys[raw_key] = formatted_key
+        return formatted_key
+
+    def _limit_http_paths(self, http_entries):
+        # Paths already reported by a container in the last sample are kept
+        # first, the new ones are added in order up to the limit and the
+        # others are merged in an overflow entry per connection
+        if self.http_path_limit <= 0:
+            return http_entries
+
+        entry_containers = {}
+        sample_paths = {}
+        for entry_key in http_entries:
+            pid = entry_key[0]
+            if pid not in entry_containers:
+                if self.container_resolver is not None:
+                    entry_containers[pid] = self.container_resolver.resolve(pid)
+                else:
+                    entry_containers[pid] = pid
+            sample_paths.setdefault(entry_containers[pid], set()).add(entry_key[3].path)
+
+        http_paths = {}
+        for container, paths in sample_paths.items():
+            kept = [path for path in self.http_paths.get(container, []) if path in paths]
+            kept = kept[:self.http_path_limit]
+            for path in sorted(paths.difference(kept)):
+                if len(kept) >= self.http_path_limit:
+                    break
+                kept.append(path)
+            http_paths[container] = kept
+        self.http_paths = http_paths
+
+        allowed_paths = {}
+        for container, paths in http_paths.items():
+            allowed_paths[container] = set(paths)
+
+        limited_entries = {}
+        for entry_key, entry in http_entries.items():
+            pid, status, transaction_type, formatted_key = entry_key
+            if formatted_key.path not in allowed_paths[entry_containers[pid]]:
+                entry_key = (pid, status, transaction_type, formatted_key._replace(path=HTTP_OVERFLOW_PATH))
+            if entry_key in limited_entries:
+                self._merge_http_entry(limited_entries[entry_key], entry)
+            else:
+                limited_entries[entry_key] = entry
+        return limited_entries
+
+    def _merge_http_entry(self, entry, other):
+        # count, bytes rx, bytes tx, total time and keys of the latencies
+        for i in range(0, 4):
+            entry[i] = entry[i] + other[i]
+        entry[4].extend(other[4])
 
     def get_sample(self):
         #iterate over summary tables
@@ -398,7 +579,13 @@ class NetCollector:
             self.selector = 1
         else:
             self.selector = 0
-        self.bpf_config[ct.c_int(0)] = ct.c_uint(self.selector)
+        self._swap_inner_maps()
+
+        # latency sketches by raw key and http summaries of all the types,
+        # http transactions with the same path template are merged
+        latency_data = {}
+        http_entries = {}
+        carried_summaries = set()
 
         # set the types and tables to iterate on
         transaction_types = [TransactionType.ipv4_tcp, TransactionType.ipv6_tcp, TransactionType.ipv4_http, TransactionType.ipv6_http]
@@ -412,25 +599,34 @@ class NetCollector:
             transaction_table = transaction_tables[i]
             transaction_latency = transaction_latencies[i]
 
-            latency_data = {}
-
-            # retrieve latency reservoir data
-            for key, value in transaction_latency.items():
-                formatted_key = get_session_key_by_type(key, transaction_type)
-                sketch = latency_data[formatted_key] = latency_data.get(formatted_key, DDSketch())
-
-                for i in range(0, self.latency_bucket_size):
-                    if value.latency_vector[i] > 0:
-                        sketch.add(float(value.latency_vector[i]) / 1000000)
-                        bucket_count = bucket_count+1
-                # if value.latency_vector[0] > 0:
-                #     sketch.add(float(value.latency_vector[0]) / 1000000)
-                #     bucket_count = bucket_count+1
+            latency_items = self._snapshot_table(transaction_latency)
+            transaction_items = self._snapshot_table(transaction_table)
+
+            # retrieve latency histograms, each bucket is added once with
+            # the count of its transactions as weight
+            for key, value in latency_items:
+                raw_key = get_raw_session_key(key, transaction_type)
+                sketch = latency_data.get(raw_key)
+                if sketch is None:
+                    sketch = latency_data[raw_key] = LatencySketch()
+                sketch.add_bucket(key.slot, value.value)
+                bucket_count = bucket_count+1
             # print(latency_data)
 
-            for key, value in transaction_table.items():
+            cleared_keys = []
+            for key, value in transaction_items:
                 data_item = None
-                formatted_key = get_session_key_by_type(key, transaction_type)
+                raw_key = get_raw_session_key(key, transaction_type)
+                if raw_key not in latency_data and not (value.status == 0 and self.nat):
+                    if raw_key not in self.carried_summaries[old_selector]:
+                        carried_summaries.add(raw_key)
+                        continue
+                    # no latency in two reads of the buffer, the histogram
+                    # table was full
+                    cleared_keys.append(key)
+                    continue
+                cleared_keys.append(key)
+                formatted_key = self._get_session_key(raw_key, transaction_type)
                 if value.status == 0 and self.nat:
                     # we found a nat rule, use the appropriate object
                     data_item = NatData(transaction_type, formatted_key.saddr, formatted_key.lport, formatted_key.daddr, formatted_key.dport)
@@ -441,6 +637,14 @@ class NetCollector:
                     else:
                         nat_dict[int(value.pid)] = [data_item]
 
+                elif transaction_type == TransactionType.ipv4_http or transaction_type == TransactionType.ipv6_http:
+                    entry_key = (int(value.pid), int(value.status), transaction_type, formatted_key)
+                    entry = [int(value.transaction_count), int(value.byte_rx), int(value.byte_tx), int(value.time), [raw_key]]
+                    if entry_key in http_entries:
+                        self._merge_http_entry(http_entries[entry_key], entry)
+                    else:
+                        http_entries[entry_key] = entry
+
                 else:
                     role = None
                     if int(value.status) == -1:
@@ -449,14 +653,7 @@ class NetCollector:
                         role = TransactionRole.server;
 
                     data_item = TransactionData(transaction_type, role, formatted_key.saddr, formatted_key.lport, formatted_key.daddr, formatted_key.dport, int(value.transaction_count), int(value.byte_rx), int(value.byte_tx))
-                    try:
-                        data_item.load_latencies(latency_data[formatted_key], int(value.time), int(value.transaction_count))
-                    except KeyError:
-                        # skip item if we lost it somehow
-                        continue
-
-                    if transaction_type == TransactionType.ipv4_http or transaction_type == TransactionType.ipv6_http:
-                        data_item.load_http_path(str(key.http_payload))
+                    data_item.load_latencies(latency_data[raw_key], int(value.time), int(value.transaction_count))
 
                     # sum up host metrics
                     host_transaction_count = host_transaction_count + int(value.transaction_count)
@@ -469,6 +666,49 @@ class NetCollector:
                     else:
                         pid_dict[int(value.pid)] = [data_item]
 
+            # the probes are writing to the other inner maps, empty these ones
+            # for the next swap
+            self._clear_table(transaction_latency, [key for key, value in latency_items])
+            self._clear_table(transaction_table, cleared_keys)
+        self.carried_summaries[old_selector] = carried_summaries
+
+        for entry_key, entry in self._limit_http_paths(http_entries).items():
+            pid, status, transaction_type, formatted_key = entry_key
+            role = None
+            if status == -1:
+                role = TransactionRole.client
+            elif status == 1:
+                role = TransactionRole.server
+
+            latency_keys = set(entry[4])
+            if len(latency_keys) == 1:
+                latency_sketch = latency_data.get(entry[4][0])
+            else:
+                # templated or overflow paths, merge the latencies of
+                # the sessions of the entry
+                latency_sketch = None
+                for latency_key in latency_keys:
+                    if latency_key in latency_data:
+                        if latency_sketch is None:
+                            latency_sketch = LatencySketch()
+                        latency_sketch.merge(latency_data[latency_key])
+            if latency_sketch is None:
+                # skip item if we lost it somehow
+                continue
+
+            data_item = TransactionData(transaction_type, role, formatted_key.saddr, formatted_key.lport, formatted_key.daddr, formatted_key.dport, entry[0], entry[1], entry[2])
+            data_item.load_latencies(latency_sketch, entry[3], entry[0])
+            data_item.load_http_path(formatted_key.path)
+
+            host_transaction_count = host_transaction_count + entry[0]
+            host_byte_tx = host_byte_tx + entry[2]
+            host_byte_rx = host_byte_rx + entry[1]
+
+            if pid in pid_dict:
+                pid_dict[pid].append(data_item)
+            else:
+                pid_dict[pid] = [data_item]
+
         #print(len(self.ipv4_summary[old_selector]))
         # print(len(self.ebpf_tcp_monitor["recv_cache"]))
         # print(len(self.ebpf_tcp_monitor["ipv4_endpoints"]))
@@ -481,29 +721,18 @@ class NetCollector:
         # print(len(self.ipv4_http_summary[old_selector]) + len(self.ipv4_summary[old_selector]) + len(self.ipv6_http_summary[old_selector]) + len(self.ipv6_summary[old_selector]))
         # print(len(self.ipv4_http_latency[old_selector]) + len(self.ipv4_latency[old_selector]) + len(self.ipv6_http_latency[old_selector]) + len(self.ipv6_latency[old_selector]))
         # print(bucket_count)
-        try:
-            # clear tables for next sample
-            self.ipv4_summary[old_selector].clear()
-            self.ipv6_summary[old_selector].clear()
-            self.ipv4_http_summary[old_selector].clear()
-            self.ipv6_http_summary[old_selector].clear()
-        except Exception as e:
-            print(e)
-            # try to clean rewritten rules as for each packet the useful nat rules
-            # are rewritten inside the tables automatically
-        try:
-            self.rewritten_rules.clear()
-            self.rewritten_rules_6.clear()
-        except Exception as e:
-            print(e)
-
-        try:
-            # clear also reservoir hashmaps
-            self.ipv4_latency[old_selector].clear()
-            self.ipv6_latency[old_selector].clear()
-            self.ipv4_http_latency[old_selector].clear()
-            self.ipv6_http_latency[old_selector].clear()
-        except Exception as e:
-            print(e)
-
-        return NetSample(pid_dict, nat_dict, nat_list, host_transaction_count, host_byte_tx, host_byte_rx)
+
+        # try to clean rewritten rules as for each packet the useful nat rules
+        # are rewritten inside the tables automatically
+        for rewritten_rules in [self.rewritten_rules, self.rewritten_rules_6]:
+            self._clear_table(rewritten_rules, [key for key, value in self._snapshot_table(rewritten_rules)])
+
+        # index the nat rules once, containers rewrite their transactions
+        # with a lookup per endpoint
+        nat_index_dict = {}
+        for pid, nat_rules in nat_dict.items():
+            nat_index = nat_index_dict[pid] = NatIndex()
+            for nat_rule in nat_rules:
+                nat_index.add_nat_rule(nat_rule)
+
+        return NetSample(pid_dict, nat_dict, nat_list, host_transaction_count, host_byte_tx, host_byte_rx, self._get_map_stats(), nat_index_dict)
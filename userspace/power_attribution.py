@@ -0,0 +1,106 @@
+"""
+    DEEP-mon
+    Copyright (C) 2020  Brondolin Rolando
+
+    This file is part of DEEP-mon
+
+    DEEP-mon is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DEEP-mon is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+
+
+def socket_share(matrix):
+    # normalize each socket column by its total, columns without activity
+    # get a share of 0 for every thread
+    totals = np.sum(matrix, axis=0)
+    return np.divide(matrix, totals, out=np.zeros(matrix.shape), where=totals > 0)
+
+
+class PowerAttributionModel:
+    """
+    Base class for the power models. A model receives a (threads x sockets)
+    matrix of weighted cycles, the per-thread cache misses and the power of
+    each RAPL domain per socket, and returns the per-thread power of each
+    domain.
+    """
+
+    domains = ["package", "core", "dram"]
+
+    def attribute(self, weighted_cycles, cache_misses, socket_power):
+        attribution = {}
+        cycles_share = socket_share(weighted_cycles)
+        for domain in self.domains:
+            attribution[domain] = cycles_share.dot(socket_power[domain])
+        return attribution
+
+
+class WeightedCyclesModel(PowerAttributionModel):
+    """
+    Every domain is split among threads proportionally to the weighted
+    cycles they spent on each socket
+    """
+    pass
+
+
+class CacheMissDramModel(PowerAttributionModel):
+    """
+    Package and core power follow the weighted cycles, DRAM power follows the
+    cache misses. Misses are not tracked per socket, so the misses of each
+    thread are spread over the sockets like its weighted cycles.
+    """
+
+    def attribute(self, weighted_cycles, cache_misses, socket_power):
+        attribution = {}
+        cycles_share = socket_share(weighted_cycles)
+        attribution["package"] = cycles_share.dot(socket_power["package"])
+        attribution["core"] = cycles_share.dot(socket_power["core"])
+
+        thread_cycles = np.sum(weighted_cycles, axis=1)
+        thread_distribution = np.divide(weighted_cycles, thread_cycles[:, None],
+            out=np.zeros(weighted_cycles.shape), where=thread_cycles[:, None] > 0)
+        miss_share = socket_share(thread_distribution * cache_misses[:, None])
+        attribution["dram"] = miss_share.dot(socket_power["dram"])
+        return attribution
+
+
+class PowerAttributionEngine:
+
+    models = {
+        "weighted_cycles": WeightedCyclesModel,
+        "cache_miss_dram": CacheMissDramModel
+    }
+
+    def __init__(self, model_name=None):
+        if model_name is None:
+            model_name = "weighted_cycles"
+        if model_name not in self.models:
+            raise ValueError("Unknown power model: " + str(model_name)
+                + ", available models: " + ", ".join(sorted(self.models)))
+        self.model_name = model_name
+        self.model = self.models[model_name]()
+
+    def get_model_name(self):
+        return self.model_name
+
+    def attribute(self, weighted_cycles, cache_misses, package_power, core_power, dram_power):
+        socket_power = {
+            "package": np.array(package_power, dtype=np.float64),
+            "core": np.array(core_power, dtype=np.float64),
+            "dram": np.array(dram_power, dtype=np.float64)
+        }
+        weighted_cycles = np.asarray(weighted_cycles, dtype=np.float64) \
+            .reshape(-1, len(socket_power["core"]))
+        return self.model.attribute(weighted_cycles,
+            np.asarray(cache_misses, dtype=np.float64), socket_power)
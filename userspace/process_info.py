@@ -19,7 +19,7 @@
 """
 
 import ctypes as ct
-from .net_collector import TransactionData
+from .transaction_data import TransactionData
 import json
 
 
@@ -67,6 +67,23 @@ class SocketProcessItem:
         return "ts: " + str(self.ts) \
             + " w:" + str(self.weighted_cycles)
 
+class SampleGeneration:
+    """
+    Counter of the samples added to a process table. Processes keep the
+    generation of the last sample that updated them, the sample metrics of
+    the processes that are not in the current sample read as zero without
+    resetting them one by one.
+    """
+
+    def __init__(self):
+        self.generation = 0
+
+    def advance(self):
+        self.generation = self.generation + 1
+
+    def get(self):
+        return self.generation
+
 class ProcessInfo:
 
     def __init__(self, num_sockets):
@@ -74,6 +91,8 @@ class ProcessInfo:
         self.tgid = -1
         self.comm = ""
         self.power = 0.0
+        self.package_power = 0.0
+        self.dram_power = 0.0
         self.cpu_usage = 0.0
         self.socket_data = []
         self.cgroup_id = ""
@@ -87,6 +106,12 @@ class ProcessInfo:
 
         self.network_transactions = []
         self.nat_rules = []
+        self.nat_index = None
+
+        # generation of the last sample that updated the process, None
+        # for processes that are not in a process table
+        self.sample_generation = None
+        self.generation = 0
 
         for i in range(0, num_sockets):
             self.socket_data.append(SocketProcessItem())
@@ -103,6 +128,12 @@ class ProcessInfo:
     def set_power(self, power):
         self.power = float(power)
 
+    def set_package_power(self, package_power):
+        self.package_power = float(package_power)
+
+    def set_dram_power(self, dram_power):
+        self.dram_power = float(dram_power)
+
     def set_cpu_usage(self, cpu_usage):
         self.cpu_usage = float(cpu_usage)
 
@@ -149,6 +180,16 @@ class ProcessInfo:
     def set_nat_rules(self, nat_rules):
         self.nat_rules = nat_rules
 
+    def set_nat_index(self, nat_index):
+        self.nat_index = nat_index
+
+    def set_sample_generation(self, sample_generation):
+        self.sample_generation = sample_generation
+        self.generation = sample_generation.get()
+
+    def is_current(self):
+        return self.sample_generation is None or self.generation == self.sample_generation.get()
+
 
     def reset_data(self):
         self.instruction_retired = 0
@@ -157,6 +198,7 @@ class ProcessInfo:
         self.time_ns = 0
         self.network_transactions = []
         self.nat_rules = []
+        self.nat_index = None
         for item in self.socket_data:
             item.reset()
 
@@ -170,25 +212,31 @@ class ProcessInfo:
         return self.comm
 
     def get_power(self):
-        return self.power
+        return self.power if self.is_current() else 0.0
+
+    def get_package_power(self):
+        return self.package_power if self.is_current() else 0.0
+
+    def get_dram_power(self):
+        return self.dram_power if self.is_current() else 0.0
 
     def get_cpu_usage(self):
-        return self.cpu_usage
+        return self.cpu_usage if self.is_current() else 0.0
 
     def get_instruction_retired(self):
-        return self.instruction_retired
+        return self.instruction_retired if self.is_current() else 0
 
     def get_cycles(self):
-        return self.cycles
+        return self.cycles if self.is_current() else 0
 
     def get_cache_misses(self):
-        return self.cache_misses
+        return self.cache_misses if self.is_current() else 0
 
     def get_cache_refs(self):
-        return self.cache_refs
+        return self.cache_refs if self.is_current() else 0
 
     def get_time_ns(self):
-        return self.time_ns
+        return self.time_ns if self.is_current() else 0
 
     def get_socket_data(self, socket_index = -1):
         if socket_index < 0:
@@ -203,6 +251,8 @@ class ProcessInfo:
 
     def get_aggregated_weighted_cycles(self):
         aggregated = 0
+        if not self.is_current():
+            return aggregated
         for item in self.socket_data:
             aggregated = aggregated + item.get_weighted_cycles()
         return aggregated
@@ -215,16 +265,19 @@ class ProcessInfo:
         return max_ts
 
     def get_network_transactions(self):
-        return self.network_transactions
+        return self.network_transactions if self.is_current() else []
 
     def get_nat_rules(self):
-        return self.nat_rules
+        return self.nat_rules if self.is_current() else []
+
+    def get_nat_index(self):
+        return self.nat_index if self.is_current() else None
 
 
     def __str__(self):
         str_rep = str(self.pid) + " comm: " + str(self.comm) \
-            + " c_id: " + self.container_id + " p: " + str(self.power) \
-            + " u: " + str(self.cpu_usage)
+            + " c_id: " + self.container_id + " p: " + str(self.get_power()) \
+            + " u: " + str(self.get_cpu_usage())
 
         for socket_item in self.socket_data:
             str_rep = str_rep + " " + str(socket_item)
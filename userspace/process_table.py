@@ -19,46 +19,188 @@
 """
 
 from .process_info import ProcessInfo
-from .bpf_collector import BpfSample
+from .process_info import SampleGeneration
 from .container_info import ContainerInfo
-import os
+from .container_metadata import ContainerMetadataCache
+from .container_resolver import ContainerResolver
 import docker
+import heapq
 
 class ProcTable:
 
-    def __init__(self):
+    def __init__(self, container_resolver=None, container_metadata=None):
         self.proc_table = {}
-        self.docker_client = docker.from_env()
+        # containers are updated with the pids of each sample and removed
+        # when their last pid is evicted, container_values holds what each
+        # key added to its container so that only the changes are applied
+        self.container_dict = {}
+        self.container_values = {}
+        self.sample_keys = set()
+        self.previous_sample_keys = set()
+        # (last ts, key) of the processes by expiry time, with the last ts
+        # of each key to skip the entries of processes updated later. The
+        # last ts of a process missing from a sample is reset to 0, so it
+        # expires with the next sample
+        self.sample_generation = SampleGeneration()
+        self.expiry_heap = []
+        self.last_seen = {}
+        if container_resolver is None:
+            container_resolver = ContainerResolver()
+        self.container_resolver = container_resolver
+        if container_metadata is None:
+            self.docker_client = docker.from_env()
+            container_metadata = ContainerMetadataCache(self.docker_client)
+            container_metadata.start()
+        self.container_metadata = container_metadata
 
     # remove processes that did not receive updates in the last 8 seconds
+    # or that were not in the last sample
     def reset_metrics_and_evict_stale_processes(self, ts):
-        evicted_keys = []
+        # the sample metrics of the processes that are not in the new
+        # sample read as zero from now on
+        self.sample_generation.advance()
+        self.previous_sample_keys = self.sample_keys
+        self.sample_keys = set()
 
-        for proc_table_key, proc_table_value in self.proc_table.items():
-            if proc_table_value.get_last_ts() + 8000000000 < ts:
-                evicted_keys.append(proc_table_key)
-            else:
-                proc_table_value.set_power(0)
-                proc_table_value.set_cpu_usage(0)
-                proc_table_value.reset_data()
+        # entries of processes updated after they were pushed are skipped
+        while len(self.expiry_heap) > 0 and self.expiry_heap[0][0] + 8000000000 < ts:
+            last_ts, key = heapq.heappop(self.expiry_heap)
+            if self.last_seen.get(key) != last_ts:
+                continue
+            del self.last_seen[key]
+            proc_info = self.proc_table.pop(key, None)
+            if proc_info is not None:
+                self._remove_from_container(key, proc_info)
+                self.container_resolver.forget([key])
+
+        for container in self.container_dict.values():
+            container.reset_sample_metrics()
+
+    def _set_updated(self, key, proc_info):
+        # the process is part of the current sample, network data is set
+        # again only if the process has some in the sample
+        proc_info.set_sample_generation(self.sample_generation)
+        self.sample_keys.add(key)
+        proc_info.set_network_transactions([])
+        proc_info.set_nat_rules([])
+        proc_info.set_nat_index(None)
+
+        last_ts = proc_info.get_last_ts()
+        if self.last_seen.get(key) != last_ts:
+            self.last_seen[key] = last_ts
+            heapq.heappush(self.expiry_heap, (last_ts, key))
+
+    def _get_container_values(self, proc_info):
+        return (proc_info.get_cycles(),
+                proc_info.get_aggregated_weighted_cycles(),
+                proc_info.get_instruction_retired(),
+                proc_info.get_cache_misses(),
+                proc_info.get_cache_refs(),
+                proc_info.get_time_ns(),
+                proc_info.get_power(),
+                proc_info.get_package_power(),
+                proc_info.get_dram_power(),
+                proc_info.get_cpu_usage())
+
+    def _add_container_values(self, container, values, sign):
+        container.add_cycles(sign * values[0])
+        container.add_weighted_cycles(sign * values[1])
+        container.add_instructions(sign * values[2])
+        container.add_cache_misses(sign * values[3])
+        container.add_cache_refs(sign * values[4])
+        container.add_time_ns(sign * values[5])
+        container.add_power(sign * values[6])
+        container.add_package_power(sign * values[7])
+        container.add_dram_power(sign * values[8])
+        container.add_cpu_usage(sign * values[9])
+
+    def _remove_from_container(self, key, proc_info):
+        container = self.container_dict.get(proc_info.container_id)
+        if container is not None:
+            values = self.container_values.pop(key, None)
+            if values is not None:
+                self._add_container_values(container, values, -1)
+            container.remove_pid(key)
+            if len(container.get_pid_set()) == 0:
+                self.container_dict.pop(proc_info.container_id, None)
+
+    def _add_to_container(self, key, proc_info):
+        if proc_info.container_id == "":
+            return
+        container = self.container_dict.get(proc_info.container_id)
+        if container is None:
+            container = ContainerInfo(proc_info.container_id)
+            self.container_dict[proc_info.container_id] = container
+
+        # only the difference with the values of the previous sample is
+        # added to the container
+        values = self._get_container_values(proc_info)
+        previous_values = self.container_values.get(key)
+        if previous_values is None:
+            self._add_container_values(container, values, 1)
+            container.add_pid(key)
+        elif previous_values != values:
+            self._add_container_values(container,
+                [value - previous for value, previous in zip(values, previous_values)], 1)
+        self.container_values[key] = values
+        container.set_weighted_cpu_usage(key, proc_info.get_cpu_usage())
+
+        container.set_last_ts(proc_info.get_last_ts())
+        container.add_network_transactions(proc_info.get_network_transactions())
+        container.add_nat_rules(proc_info.get_nat_rules())
+        if proc_info.get_nat_index() is not None:
+            container.add_nat_index(proc_info.get_nat_index())
+
+    def _reset_stale_processes(self):
+        # processes of the previous sample that are not in this one do not
+        # add anything to their containers anymore, and are evicted with
+        # the next sample
+        for key in self.previous_sample_keys - self.sample_keys:
+            proc_info = self.proc_table.get(key)
+            if proc_info is None:
+                continue
+            proc_info.reset_data()
+            self.last_seen[key] = 0
+            heapq.heappush(self.expiry_heap, (0, key))
 
-        #remove evicted keys
-        for k in evicted_keys:
-            self.proc_table.pop(k, None)
+            values = self.container_values.pop(key, None)
+            container = self.container_dict.get(proc_info.container_id)
+            if container is not None and values is not None:
+                self._add_container_values(container, values, -1)
+                container.set_weighted_cpu_usage(key, 0)
 
+    def _replace_process(self, key, old_proc_info, proc_info):
+        # the values added by the old process are kept as the previous
+        # values of the key when the container does not change
+        if old_proc_info.container_id != proc_info.container_id:
+            self._remove_from_container(key, old_proc_info)
+        self.proc_table[key] = proc_info
 
     def add_process(self, proc_info):
         self.proc_table[proc_info.get_pid()] = proc_info
+        self._set_updated(proc_info.get_pid(), proc_info)
 
 
-    def add_process_from_sample(self, sample, net_dictionary=None, nat_dictionary=None):
+    def add_process_from_sample(self, sample, net_dictionary=None, nat_dictionary=None, nat_index_dictionary=None):
+        if sample.get_columnar_sample() is not None:
+            self._add_process_from_columnar_sample(sample.get_columnar_sample(),
+                net_dictionary, nat_dictionary, nat_index_dictionary)
+        else:
+            self._add_process_from_pid_dict(sample.get_pid_dict(),
+                net_dictionary, nat_dictionary, nat_index_dictionary)
+        self._reset_stale_processes()
+
+    def _add_process_from_pid_dict(self, pid_dict, net_dictionary=None, nat_dictionary=None, nat_index_dictionary=None):
+
         # reset counters for each entries
-        for key, value in sample.get_pid_dict().items():
+        for key, value in pid_dict.items():
             if key in self.proc_table:
                 # process already there, check if comm is the same
                 if value.get_comm() == self.proc_table[key].get_comm():
                     # ok, update stuff
                     self.proc_table[key].set_power(value.get_power())
+                    self.proc_table[key].set_package_power(value.get_package_power())
+                    self.proc_table[key].set_dram_power(value.get_dram_power())
                     self.proc_table[key].set_cpu_usage(value.get_cpu_usage())
                     self.proc_table[key].set_instruction_retired(value.get_instruction_retired())
                     self.proc_table[key].set_cycles(value.get_cycles())
@@ -69,92 +211,76 @@ class ProcTable:
 
                 else:
                     # process is changed, replace entry and find cgroup_id
+                    # again, the pid might have been reused
+                    self.container_resolver.forget([key])
                     value.set_cgroup_id(self.find_cgroup_id(key, value.tgid))
                     value.set_container_id(value.get_cgroup_id()[0:12])
-                    self.proc_table[key] = value
+                    self._replace_process(key, self.proc_table[key], value)
             else:
                 # new process, add it and find cgroup_id
                 value.set_cgroup_id(self.find_cgroup_id(key, value.tgid))
                 value.set_container_id(value.get_cgroup_id()[0:12])
                 self.proc_table[key] = value
+            self._set_updated(key, self.proc_table[key])
             if net_dictionary and key in net_dictionary:
                 self.proc_table[key].set_network_transactions(net_dictionary[key])
             if nat_dictionary and key in nat_dictionary:
                 self.proc_table[key].set_nat_rules(nat_dictionary[key])
+            if nat_index_dictionary and key in nat_index_dictionary:
+                self.proc_table[key].set_nat_index(nat_index_dictionary[key])
+            self._add_to_container(key, self.proc_table[key])
+
+    def _add_process_from_columnar_sample(self, columnar_sample, net_dictionary=None, nat_dictionary=None, nat_index_dictionary=None):
+        # same as add_process_from_sample, but ProcessInfo objects are
+        # created only for new processes, the others are updated in place
+        for key, row in columnar_sample.get_index().items():
+            proc_info = self.proc_table.get(key)
+            if proc_info is not None \
+                and proc_info.get_comm() == columnar_sample.get_comm(row):
+                columnar_sample.update_process_info(proc_info, row)
+            else:
+                # new or changed process, replace entry and find cgroup_id
+                old_proc_info = proc_info
+                if old_proc_info is not None:
+                    self.container_resolver.forget([key])
+                proc_info = columnar_sample.get_process_info(row)
+                proc_info.set_cgroup_id(self.find_cgroup_id(key, proc_info.get_tgid()))
+                proc_info.set_container_id(proc_info.get_cgroup_id()[0:12])
+                if old_proc_info is not None:
+                    self._replace_process(key, old_proc_info, proc_info)
+                else:
+                    self.proc_table[key] = proc_info
+            self._set_updated(key, proc_info)
+            if net_dictionary and key in net_dictionary:
+                proc_info.set_network_transactions(net_dictionary[key])
+            if nat_dictionary and key in nat_dictionary:
+                proc_info.set_nat_rules(nat_dictionary[key])
+            if nat_index_dictionary and key in nat_index_dictionary:
+                proc_info.set_nat_index(nat_index_dictionary[key])
+            self._add_to_container(key, proc_info)
 
     def find_cgroup_id(self, pid, tgid):
-        # exclude idle
-        if pid < 0:
-            return "----idle----"
-
-        for id in [pid, tgid]:
-
-            #scan proc folder searching for the pid
-            for path in ['/host/proc', '/proc']:
-                try:
-                    # Non-systemd Docker
-                    with open(os.path.join(path, str(id), 'cgroup'), 'r') as f:
-                        for line in f:
-                            line_array = line.split("/")
-                            if len(line_array) > 1 and \
-                                len(line_array[len(line_array) -1]) == 65:
-                                return line_array[len(line_array) -1]
-                except IOError:
-                    continue
-
-            for path in ['/host/proc', '/proc']:
-                try:
-                    # systemd Docker
-                    with open(os.path.join(path, str(id), 'cgroup'), 'r') as f:
-                        for line in f:
-                            line_array = line.split("/")
-                            if len(line_array) > 1 \
-                                and "docker-" in line_array[len(line_array) -1] \
-                                and ".scope" in line_array[len(line_array) -1]:
-
-                                new_id = line_array[len(line_array) -1].replace("docker-", "")
-                                new_id = new_id.replace(".scope", "")
-                                if len(new_id) == 65:
-                                    return new_id
-
-                except IOError: # proc has already terminated
-                    continue
-        return "---others---"
+        return self.container_resolver.resolve(pid, tgid)
 
     def get_proc_table(self):
         return self.proc_table
 
+    def get_container_metadata_cache(self):
+        return self.container_metadata
+
     def get_container_dictionary(self, mem_dictionary = None, disk_dictionary = None):
-        container_dict = {}
-        # not_a_container = ContainerInfo("---others---")
-        # idle = ContainerInfo("----idle----")
-        # container_dict["---others---"] = not_a_container
-        # container_dict["----idle----"] = idle
-
-        for key, value in self.proc_table.items():
-            if value.container_id != "":
-                if value.container_id not in container_dict:
-                    container_dict[value.container_id] = ContainerInfo(value.container_id)
-
-                    if value.container_id not in ["---others---", "----idle----"]:
-                        #retrieve info from docker
-                        container = self.docker_client.containers.get(value.container_id)
-                        container_dict[value.container_id].set_container_name(str(container.name))
-                        container_dict[value.container_id].set_container_image(str(container.image))
-                        container_dict[value.container_id].set_container_labels(container.labels)
-
-                container_dict[value.container_id].add_cycles(value.get_cycles())
-                container_dict[value.container_id].add_weighted_cycles(value.get_aggregated_weighted_cycles())
-                container_dict[value.container_id].add_instructions(value.get_instruction_retired())
-                container_dict[value.container_id].add_cache_misses(value.get_cache_misses())
-                container_dict[value.container_id].add_cache_refs(value.get_cache_refs())
-                container_dict[value.container_id].add_time_ns(value.get_time_ns())
-                container_dict[value.container_id].add_power(value.get_power())
-                container_dict[value.container_id].add_cpu_usage(value.get_cpu_usage())
-                container_dict[value.container_id].add_pid(value.get_pid())
-                container_dict[value.container_id].set_last_ts(value.get_last_ts())
-                container_dict[value.container_id].add_network_transactions(value.get_network_transactions())
-                container_dict[value.container_id].add_nat_rules(value.get_nat_rules())
+        container_dict = self.container_dict
+
+        for key, value in container_dict.items():
+            if key not in ["---others---", "----idle----"]:
+                # retrieve info from docker at every sample, the cache
+                # follows renames and label updates. Containers that are
+                # not in the cache yet get their metadata later on
+                metadata = self.container_metadata.get(key)
+                if metadata is not None:
+                    value.set_container_name(str(metadata.get_name()))
+                    value.set_container_image(str(metadata.get_image()))
+                    value.set_container_labels(metadata.get_labels())
 
         # aggregate stuff at the container level
         for key, value in container_dict.items():
@@ -175,6 +301,10 @@ class ProcTable:
                     value.set_disk_num_r(disk_dictionary[key]["num_r"])
                     value.set_disk_num_w(disk_dictionary[key]["num_w"])
                     value.set_disk_avg_lat(disk_dictionary[key]["avg_lat"])
+                    value.set_disk_blk_kb_r(disk_dictionary[key]["blk_kb_r"])
+                    value.set_disk_blk_kb_w(disk_dictionary[key]["blk_kb_w"])
+                    value.set_disk_blk_p50_lat(disk_dictionary[key]["blk_p50_lat"])
+                    value.set_disk_blk_p99_lat(disk_dictionary[key]["blk_p99_lat"])
 
 
         return container_dict
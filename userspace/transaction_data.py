@@ -0,0 +1,226 @@
+"""
+    DEEP-mon
+    Copyright (C) 2020  Brondolin Rolando
+
+    This file is part of DEEP-mon
+
+    DEEP-mon is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DEEP-mon is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from ddsketch.ddsketch import BaseDDSketch
+from ddsketch.mapping import LinearlyInterpolatedMapping
+from ddsketch.store import DenseStore
+from enum import Enum
+
+
+# relative accuracy of the latency buckets counted in kernel
+LATENCY_RELATIVE_ACCURACY = 0.01
+
+class LatencyMapping(LinearlyInterpolatedMapping):
+    """
+    Mapping of the latency buckets counted in kernel: keys are computed on
+    latencies in ns, as in tcp_monitor.c, and values are returned in ms.
+    """
+
+    def key(self, value):
+        return super(LatencyMapping, self).key(value * 1000000)
+
+    def value(self, key):
+        return super(LatencyMapping, self).value(key) / 1000000
+
+LATENCY_MAPPING = LatencyMapping(LATENCY_RELATIVE_ACCURACY)
+
+class LatencySketch(BaseDDSketch):
+    """
+    DDSketch of transaction latencies in ms. Its bins are the buckets of
+    the kernel histograms, so they are added to the store without mapping
+    the latencies again.
+    """
+
+    def __init__(self):
+        super(LatencySketch, self).__init__(
+            mapping=LATENCY_MAPPING,
+            store=DenseStore(),
+            negative_store=DenseStore(),
+            zero_count=0.0,
+        )
+
+    def add_bucket(self, key, count):
+        value = self._mapping.value(key)
+        self._store.add(key, count)
+        self._count = self._count + count
+        self._sum = self._sum + value * count
+        if value < self._min:
+            self._min = value
+        if value > self._max:
+            self._max = value
+
+class TransactionType(Enum):
+    ipv4_tcp = 0
+    ipv4_http = 1
+    ipv6_tcp = 2
+    ipv6_http = 3
+
+class TransactionRole(Enum):
+    client = -1
+    server = 1
+
+class TransactionData:
+
+    def __init__(self, type, role, saddr, lport, daddr, dport, transaction_count, byte_rx, byte_tx):
+        self.type = type
+        self.role = role
+        self.saddr = saddr
+        self.lport = lport
+        self.daddr = daddr
+        self.dport = dport
+        self.t_count = transaction_count
+        self.byte_rx = byte_rx
+        self.byte_tx = byte_tx
+        self.avg = 0
+        self.p50 = 0
+        self.p75 = 0
+        self.p90 = 0
+        self.p99 = 0
+        self.p99_9 = 0
+        self.p99_99 = 0
+        self.p99_999 = 0
+        self.http_path = ""
+        self.samples = []
+
+    def load_latencies(self, latency_sketch, total_time, transaction_count):
+        self.samples = latency_sketch
+        self.avg = float(total_time) / float(transaction_count * 1000000)
+
+        self.p50 = latency_sketch.get_quantile_value(0.5)
+        self.p75 = latency_sketch.get_quantile_value(0.75)
+        self.p90 = latency_sketch.get_quantile_value(0.9)
+        self.p99 = latency_sketch.get_quantile_value(0.99)
+        self.p99_9 = latency_sketch.get_quantile_value(0.999)
+        self.p99_99 = latency_sketch.get_quantile_value(0.9999)
+        self.p99_999 = latency_sketch.get_quantile_value(0.99999)
+
+    def load_http_path(self, path):
+        self.http_path = path
+
+    def get_type(self):
+        return self.type
+
+    def get_type_str_no_ip(self):
+        if self.type is TransactionType.ipv6_tcp or self.type is TransactionType.ipv4_tcp:
+            return "tcp"
+        else:
+            return "http"
+
+    def get_role(self):
+        return self.role
+
+    def get_role_str(self):
+        if self.role is TransactionRole.client:
+            return "client"
+        else:
+            return "server"
+
+    def get_saddr(self):
+        return self.saddr
+
+    def get_lport(self):
+        return self.lport
+
+    def get_daddr(self):
+        return self.daddr
+
+    def get_dport(self):
+        return self.dport
+
+    def get_transaction_count(self):
+        return self.t_count
+
+    def get_byte_rx(self):
+        return self.byte_rx
+
+    def get_byte_tx(self):
+        return self.byte_tx
+
+    def get_avg_latency(self):
+        return self.avg
+
+    def get_percentiles(self):
+        return [self.p50, self.p75, self.p90, self.p99, self.p99_9, self.p99_99, self.p99_999]
+
+    def get_http_path(self):
+        return self.http_path
+
+    def get_samples(self):
+        return self.samples
+
+    def set_saddr(self, saddr):
+        self.saddr = saddr
+
+    def set_lport(self, lport):
+        self.lport = lport
+
+    def set_daddr(self, daddr):
+        self.daddr = daddr
+
+    def set_dport(self, dport):
+        self.dport = dport
+
+
+    def __str__(self):
+        role_str = ""
+        if self.role is TransactionRole.server:
+            role_str = "server"
+        else:
+            role_str = "client"
+
+        output_str = ""
+        if self.type == TransactionType.ipv4_http or self.type == TransactionType.ipv6_http:
+            fmt = '{:<8} {:<40} {:<40} {:<20} {:<20} {:<20} {:<25} {:<68}'
+            output_str = fmt.format(
+                role_str,
+                "SRC: " + str(self.saddr) + ":" + str(self.lport),
+                "DST: " + str(self.daddr) + ":" + str(self.dport),
+                "T_COUNT: " + str(self.t_count),
+                "BYTE_TX: " + str(self.byte_tx),
+                "BYTE_RX: " + str(self.byte_rx),
+                "LAT_AVG (ms): " + '{:.5f}'.format(self.avg),
+                str(self.http_path)
+            )
+
+        else:
+            fmt = '{:<8} {:<40} {:<40} {:<20} {:<20} {:<20} {:<25}'
+            output_str = fmt.format(
+                role_str,
+                "SRC: " + str(self.saddr) + ":" + str(self.lport),
+                "DST: " + str(self.daddr) + ":" + str(self.dport),
+                "T_COUNT: " + str(self.t_count),
+                "BYTE_TX: " + str(self.byte_tx),
+                "BYTE_RX: " + str(self.byte_rx),
+                "LAT_AVG (ms): " + '{:.5f}'.format(self.avg)
+            )
+
+        fmt = '{:<5} {:<30} {:<30} {:<30} {:<30} {:<30} {:<30} {:<30}'
+        output_str = output_str + "\n" + fmt.format(
+            "--->",
+            "50p: " + '{:.5f}'.format(self.p50),
+            "75p: " + '{:.5f}'.format(self.p75),
+            "90p: " + '{:.5f}'.format(self.p90),
+            "99p: " + '{:.5f}'.format(self.p99),
+            "99.9p: " + '{:.5f}'.format(self.p99_9),
+            "99.99p: " + '{:.5f}'.format(self.p99_99),
+            "99.999p: " + '{:.5f}'.format(self.p99_999),
+        )
+
+        return output_str